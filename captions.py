@@ -0,0 +1,192 @@
+import bisect
+import itertools
+from typing import Callable, List, Optional, Tuple
+
+from timeline import SubtitleEvent
+
+
+class CaptionIndex:
+    """
+    Finds the caption shown at a given time.
+
+    The captions are sorted by start time and looked up by bisection. A
+    cursor remembers the last caption found: frames are read in order, so
+    the caption of the next frame is almost always the same one or the
+    next, and the lookup is constant time instead of a scan of all the
+    captions. When captions overlap, the latest to start of the captions
+    still showing is shown.
+    """
+
+    def __init__(self, events: List[SubtitleEvent]):
+        self.events = sorted(events, key=lambda event: event.start)
+        self.starts = [event.start for event in self.events]
+        # The latest end of the captions up to every index: earlier captions
+        # may still show after a later one ended
+        self.ends = list(
+            itertools.accumulate((event.end for event in self.events), max)
+        )
+        self.cursor = 0
+
+    def _starts_at(self, index: int, t: float) -> bool:
+        """
+        Returns whether caption `index` is the latest to start at `t`.
+        """
+
+        return self.starts[index] <= t and (
+            index + 1 == len(self.starts) or t < self.starts[index + 1]
+        )
+
+    def at(self, t: float) -> Optional[SubtitleEvent]:
+        """
+        Returns the caption shown at `t`, or None.
+        """
+
+        if not self.events:
+            return None
+
+        if not self._starts_at(self.cursor, t):
+            if self.cursor + 1 < len(self.starts) and self._starts_at(
+                self.cursor + 1, t
+            ):
+                self.cursor += 1
+            else:
+                index = bisect.bisect_right(self.starts, t) - 1
+                if index < 0:
+                    return None
+                self.cursor = index
+
+        index = self.cursor
+        while index >= 0 and t < self.ends[index]:
+            if t < self.events[index].end:
+                return self.events[index]
+            index -= 1
+        return None
+
+
+def overlay_position(
+    position: List, frame_size: Tuple[int, int], overlay_size: Tuple[int, int]
+) -> Tuple[int, int]:
+    """
+    Resolves a moviepy-like position, e.g. ["center", "bottom"] or [40, 1200],
+    to the top left pixel of an overlay on a frame.
+
+    Args:
+        position (List): The horizontal and vertical position: "left",
+            "center", "right" / "top", "center", "bottom", or pixels.
+        frame_size (Tuple[int, int]): The width and height of the frame.
+        overlay_size (Tuple[int, int]): The width and height of the overlay.
+
+    Returns:
+        Tuple[int, int]: The x and y of the overlay on the frame.
+    """
+
+    anchors = {"left": 0, "top": 0, "center": 0.5, "right": 1, "bottom": 1}
+
+    coordinates = []
+    for value, frame, overlay in zip(position, frame_size, overlay_size):
+        value = value.strip() if isinstance(value, str) else value
+        if value in anchors:
+            coordinates.append(int(anchors[value] * (frame - overlay)))
+        else:
+            coordinates.append(int(float(value)))
+
+    return coordinates[0], coordinates[1]
+
+
+def prepare_overlay(clip) -> dict:
+    """
+    Precomputes the blending arrays of a still overlay clip, e.g. a caption:
+    its colors premultiplied by its alpha, and the inverse alpha.
+    """
+    import numpy
+
+    rgb = clip.get_frame(0)[..., :3].astype(numpy.float32)
+    if clip.mask is not None:
+        alpha = clip.mask.get_frame(0).astype(numpy.float32)[..., None]
+    else:
+        alpha = numpy.ones(rgb.shape[:2] + (1,), dtype=numpy.float32)
+
+    return {
+        # +0.5 rounds to nearest when the blend is truncated back to uint8
+        "rgb": rgb * alpha + 0.5,
+        "inverse_alpha": 1 - alpha,
+        "scratch": numpy.empty_like(rgb),
+        "size": (rgb.shape[1], rgb.shape[0]),
+    }
+
+
+def blend_overlay(frame, overlay: dict, x: int, y: int) -> None:
+    """
+    Blends an overlay on a frame, in place, over the overlay's bounding box
+    only. The parts of the overlay outside the frame are skipped.
+    """
+    import numpy
+
+    height, width = frame.shape[:2]
+    overlay_width, overlay_height = overlay["size"]
+
+    # Visible box, in frame and in overlay coordinates
+    left, top = max(x, 0), max(y, 0)
+    right, bottom = min(x + overlay_width, width), min(y + overlay_height, height)
+    if left >= right or top >= bottom:
+        return
+
+    box = (slice(top - y, bottom - y), slice(left - x, right - x))
+    region = frame[top:bottom, left:right]
+    scratch = overlay["scratch"][box]
+
+    numpy.multiply(region, overlay["inverse_alpha"][box], out=scratch)
+    scratch += overlay["rgb"][box]
+    numpy.copyto(region, scratch, casting="unsafe")
+
+
+def burn_captions(
+    clip, events: List[SubtitleEvent], render_caption: Callable, position: List
+):
+    """
+    Burns captions into a clip, blending each caption over its bounding box
+    only instead of compositing full frames.
+
+    Every caption is rendered and prepared once, when it first shows, and
+    reused for the frames it stays on screen. Frames without a caption are
+    passed through untouched. Decoded frames are read-only, so captioned
+    frames are copied into a buffer that is reused from frame to frame.
+
+    Args:
+        clip (VideoClip): The clip to burn the captions into.
+        events (List[SubtitleEvent]): The captions, in clip time.
+        render_caption (Callable): Returns the clip of a caption text.
+        position (List): The position of the captions, see
+            `overlay_position`.
+
+    Returns:
+        VideoClip: The clip with the captions.
+    """
+    import numpy
+
+    index = CaptionIndex(events)
+    state = {"text": None, "overlay": None, "position": None, "buffer": None}
+
+    def burn(get_frame, t):
+        frame = get_frame(t)
+
+        event = index.at(t)
+        if event is None:
+            return frame
+
+        if event.text != state["text"]:
+            overlay = prepare_overlay(render_caption(event.text))
+            state["text"], state["overlay"] = event.text, overlay
+            state["position"] = overlay_position(
+                position, (frame.shape[1], frame.shape[0]), overlay["size"]
+            )
+
+        buffer = state["buffer"]
+        if buffer is None or buffer.shape != frame.shape:
+            buffer = state["buffer"] = numpy.empty_like(frame)
+        numpy.copyto(buffer, frame)
+
+        blend_overlay(buffer, state["overlay"], *state["position"])
+        return buffer
+
+    return clip.fl(burn)
@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import subprocess
+from typing import List, Tuple
+
+from timeline import Segment, SubtitleEvent, Timeline
+
+# Rendered chunks are cached in the project space, by key
+CHUNKS_FOLDER = "chunks"
+
+# Bump to invalidate every cached chunk when the way they render changes
+CHUNK_VERSION = 2
+
+
+def plan_chunks(duration: float, fps: float, seconds: float) -> List[Tuple[int, int]]:
+    """
+    Splits a video into chunks of about `seconds` seconds.
+
+    Chunks are cut on frame boundaries, and every chunk is encoded on its
+    own, so it starts with a keyframe: the chunks are closed GOPs, which
+    can be concatenated without re-encoding.
+
+    Returns:
+        List[Tuple[int, int]]: The [first, last) frames of every chunk.
+    """
+
+    frames = max(1, round(duration * fps))
+    size = max(1, round(seconds * fps))
+
+    return [(first, min(first + size, frames)) for first in range(0, frames, size)]
+
+
+def segments_between(timeline: Timeline, start: float, end: float) -> List[Segment]:
+    """
+    Returns the segments of the video track overlapping [start, end).
+    """
+
+    return [
+        segment
+        for segment in timeline.video
+        if segment.start < end and segment.end > start
+    ]
+
+
+def events_between(
+    timeline: Timeline, start: float, end: float
+) -> List[SubtitleEvent]:
+    """
+    Returns the subtitle events shown during [start, end).
+    """
+
+    return [
+        event for event in timeline.subtitles if event.start < end and event.end > start
+    ]
+
+
+def source_fingerprint(path: str) -> List[int]:
+    """
+    Identifies the content of a source file by its size and modification time.
+    """
+
+    stat = os.stat(path)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def chunk_key(data: dict) -> str:
+    """
+    Hashes everything a chunk is rendered from.
+
+    Returns:
+        str: The cache key of the chunk.
+    """
+
+    payload = json.dumps({"version": CHUNK_VERSION, **data}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+def ffmpeg(*args: str) -> None:
+    """
+    Runs ffmpeg with the binary configured for moviepy.
+    """
+    from moviepy.config import get_setting
+
+    subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *args],
+        check=True,
+    )
+
+
+def concat_chunks(chunk_paths: List[str], output_path: str) -> str:
+    """
+    Joins encoded chunks into one video, copying their streams.
+
+    Returns:
+        str: The path to the joined video.
+    """
+
+    list_path = f"{output_path}.txt"
+    with open(list_path, "w", encoding="utf-8") as f:
+        for path in chunk_paths:
+            escaped = os.path.abspath(path).replace("'", "'\\''")
+            f.write(f"file '{escaped}'\n")
+
+    try:
+        ffmpeg(
+            "-f",
+            "concat",
+            "-safe",
+            "0",
+            "-i",
+            list_path,
+            "-c",
+            "copy",
+            "-movflags",
+            "+faststart",
+            output_path,
+        )
+    finally:
+        os.remove(list_path)
+
+    return output_path
+
+
+def mux_audio(video_path: str, audio_path: str, output_path: str) -> str:
+    """
+    Puts an audio track on a video, copying both streams.
+
+    Returns:
+        str: The path to the muxed video.
+    """
+
+    ffmpeg(
+        "-i",
+        video_path,
+        "-i",
+        audio_path,
+        "-map",
+        "0:v:0",
+        "-map",
+        "1:a:0",
+        "-c",
+        "copy",
+        "-shortest",
+        "-movflags",
+        "+faststart",
+        output_path,
+    )
+
+    return output_path
@@ -21,6 +21,7 @@ class Config:
         self.smart_llm_model = os.getenv("SMART_LLM_MODEL", "gpt-4-1106-preview")
         self.n_threads = int(os.getenv("N_THREADS", 1))
         self.subtitles_position = os.getenv("SUBTITLES_POSITION", "bottom")
+        self.subtitles_method = os.getenv("SUBTITLES_METHOD", "auto")
         self.text_color = os.getenv("TEXT_COLOR", "white")
         self.use_music = os.getenv("USE_MUSIC", False)
         self.automate_youtube_upload = os.getenv("AUTOMATE_YOUTUBE_UPLOAD", False)
@@ -30,13 +31,67 @@ class Config:
         )
         self.use_stock_videos = os.getenv("USE_STOCK_VIDEOS", False)
         self.image_video_duration = int(os.getenv("IMAGE_VIDEO_DURATION", 5))
+        self.image_generation_workers = int(os.getenv("IMAGE_GENERATION_WORKERS", 4))
+        self.use_image_store = os.getenv("USE_IMAGE_STORE", True)
+        self.image_store_dir = os.getenv("IMAGE_STORE_DIR", "cache/images")
+        self.image_similarity_threshold = float(
+            os.getenv("IMAGE_SIMILARITY_THRESHOLD", 0.85)
+        )
+        self.image_store_max_mb = int(os.getenv("IMAGE_STORE_MAX_MB", 2048))
+        self.image_store_max_age_days = int(os.getenv("IMAGE_STORE_MAX_AGE_DAYS", 90))
         self.text_font = os.getenv("TEXT_FONT", "Arial")
+        self.render_profile = os.getenv("RENDER_PROFILE", False)
+        self.render_mode = os.getenv("RENDER_MODE", "final")
+        self.renderer = os.getenv("RENDERER", "segmented")
+        # Other formats of the final video, see profiles.load_profiles
+        self.output_profiles = []
+        # Longest stretch of a stock video shown at once
+        self.max_clip_seconds = float(os.getenv("MAX_CLIP_SECONDS", 5))
+        # Stock videos whose thumbnail hashes differ by at most this many bits
+        # (of 64) are near duplicates, only the first one is kept
+        self.near_duplicate_distance = int(os.getenv("NEAR_DUPLICATE_DISTANCE", 6))
+        self.use_footage_library = os.getenv("USE_FOOTAGE_LIBRARY", True)
+        self.footage_library_dir = os.getenv("FOOTAGE_LIBRARY_DIR", "cache/footage")
+        # Pexels is searched when the library has fewer videos for a term
+        self.footage_library_min_results = int(
+            os.getenv("FOOTAGE_LIBRARY_MIN_RESULTS", 5)
+        )
+        self.timeline_seed = (
+            int(os.getenv("TIMELINE_SEED")) if os.getenv("TIMELINE_SEED") else None
+        )
+        self.prometheus_metrics_file = os.getenv("PROMETHEUS_METRICS_FILE", "")
+        self.tts_provider = os.getenv("TTS_PROVIDER", "openai")
+        self.tts_voice = os.getenv("TTS_VOICE", "alloy")
+        self.tts_model = os.getenv("TTS_MODEL", "tts-1")
+        self.tts_cache_dir = os.getenv("TTS_CACHE_DIR", "cache/tts")
+        self.tts_workers = int(os.getenv("TTS_WORKERS", 4))
+        self.storage_root = os.getenv("STORAGE_ROOT", "temp")
+        self.scratch_dir = os.getenv("SCRATCH_DIR", "")
+        self.scratch_folders = os.getenv("SCRATCH_FOLDERS", "videos").split(",")
+        self.job_quota_mb = int(os.getenv("JOB_QUOTA_MB", 0))
+        self.global_quota_mb = int(os.getenv("GLOBAL_QUOTA_MB", 0))
+        self.retention_days = float(os.getenv("RETENTION_DAYS", 0))
+        self.stale_hours = float(os.getenv("STALE_HOURS", 0))
+
+        self.openai_base_url = os.getenv("OPENAI_BASE_URL", None)
+        self.pexels_base_url = os.getenv("PEXELS_BASE_URL", "https://api.pexels.com")
+        self.tiktok_tts_endpoints = (
+            os.getenv("TIKTOK_TTS_ENDPOINTS").split(",")
+            if os.getenv("TIKTOK_TTS_ENDPOINTS")
+            else None
+        )
 
         self.load_config_file()
 
-        os.environ["OPENAI_API_KEY"] = self.openai_api_key
-        os.environ["PEXELS_API_KEY"] = self.pexels_api_key
-        os.environ["ASSEMBLY_AI_API_KEY"] = self.assembly_ai_api_key
+        for key, value in {
+            "OPENAI_API_KEY": self.openai_api_key,
+            "PEXELS_API_KEY": self.pexels_api_key,
+            "ASSEMBLY_AI_API_KEY": self.assembly_ai_api_key,
+            # Read by every OpenAI client, including the module level one
+            "OPENAI_BASE_URL": self.openai_base_url or None,
+        }.items():
+            if value is not None:
+                os.environ[key] = value
 
     def load_config_file(self) -> None:
         """Load the config file."""
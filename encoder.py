@@ -0,0 +1,237 @@
+import os
+import subprocess
+import time
+from typing import TYPE_CHECKING, List
+
+import metrics
+
+if TYPE_CHECKING:
+    import numpy
+    from moviepy.Clip import Clip
+
+# BT.601 limited range, what ffmpeg assumes for untagged yuv420p input and
+# uses itself to convert rgb24
+Y_COEFFICIENTS = [65.481 / 255, 128.553 / 255, 24.966 / 255]
+# Applied to the sum of 2x2 pixels, hence the extra / 4
+UV_COEFFICIENTS = [
+    [-37.797 / 1020, 112.0 / 1020],
+    [-74.203 / 1020, -93.786 / 1020],
+    [112.0 / 1020, -18.214 / 1020],
+]
+
+
+class FrameWriter:
+    """
+    Pipes raw frames to an ffmpeg encoder, without copying them into new
+    `bytes` objects like moviepy's writer does.
+
+    Frames are written as memoryviews, of the frame itself when it is a
+    contiguous uint8 array, or of a buffer allocated once and reused. With
+    the "yuv420p" pipe format, frames are converted with NumPy into that
+    buffer, which halves the bytes sent through the pipe and moves the
+    conversion out of ffmpeg. The time spent blocked on the pipe, i.e.
+    waiting for the encoder, is measured.
+
+    Usage:
+        with FrameWriter(path, (1080, 1920), 30) as writer:
+            for frame in frames:
+                writer.write_frame(frame)
+    """
+
+    def __init__(
+        self,
+        path: str,
+        size: List[int],
+        fps: float,
+        preset: str = "medium",
+        ffmpeg_params: List[str] = None,
+        threads: int = None,
+        pipe_format: str = "yuv420p",
+        bitrate: str = None,
+    ):
+        import numpy
+        from moviepy.config import get_setting
+
+        self.path = path
+        self.width, self.height = size
+        # Chroma is subsampled by 2x2 pixel blocks
+        if self.width % 2 or self.height % 2:
+            pipe_format = "rgb24"
+        self.pipe_format = pipe_format
+        self.blocked_time = 0.0
+        self.bytes_written = 0
+
+        if pipe_format == "yuv420p":
+            pixels = self.width * self.height
+            self._buffer = numpy.empty(pixels * 3 // 2, dtype=numpy.uint8)
+            self._y = self._buffer[:pixels].reshape(self.height, self.width)
+            self._u = self._buffer[pixels : pixels * 5 // 4].reshape(
+                self.height // 2, self.width // 2
+            )
+            self._v = self._buffer[pixels * 5 // 4 :].reshape(
+                self.height // 2, self.width // 2
+            )
+            self._luma = numpy.empty((self.height, self.width), dtype=numpy.float32)
+            self._blocks = numpy.empty(
+                (self.height // 2, self.width // 2, 3), dtype=numpy.float32
+            )
+            self._chroma = numpy.empty(
+                (self.height // 2, self.width // 2, 2), dtype=numpy.float32
+            )
+            self._y_coefficients = numpy.array(Y_COEFFICIENTS, dtype=numpy.float32)
+            self._uv_coefficients = numpy.array(UV_COEFFICIENTS, dtype=numpy.float32)
+        else:
+            self._buffer = numpy.empty(
+                (self.height, self.width, 3), dtype=numpy.uint8
+            )
+
+        command = [
+            get_setting("FFMPEG_BINARY"),
+            "-y",
+            "-loglevel",
+            "error",
+            "-f",
+            "rawvideo",
+            "-vcodec",
+            "rawvideo",
+            "-s",
+            f"{self.width}x{self.height}",
+            "-pix_fmt",
+            pipe_format,
+            "-r",
+            f"{fps:.02f}",
+            "-i",
+            "-",
+            "-an",
+            "-vcodec",
+            "libx264",
+            "-preset",
+            preset,
+            "-pix_fmt",
+            "yuv420p",
+        ]
+        if bitrate:
+            command += ["-b:v", bitrate]
+        if threads:
+            command += ["-threads", str(threads)]
+        command += list(ffmpeg_params or []) + [path]
+
+        self._process = subprocess.Popen(
+            command, stdin=subprocess.PIPE, stderr=subprocess.PIPE
+        )
+
+    def _to_yuv420p(self, frame: "numpy.ndarray") -> None:
+        import numpy
+
+        numpy.matmul(frame, self._y_coefficients, out=self._luma)
+        self._luma += 16.5
+        numpy.copyto(self._y, self._luma, casting="unsafe")
+
+        blocks = self._blocks
+        numpy.add(
+            frame[0::2, 0::2], frame[1::2, 0::2], out=blocks, dtype=numpy.float32
+        )
+        blocks += frame[0::2, 1::2]
+        blocks += frame[1::2, 1::2]
+        numpy.matmul(blocks, self._uv_coefficients, out=self._chroma)
+        self._chroma += 128.5
+        numpy.copyto(self._u, self._chroma[..., 0], casting="unsafe")
+        numpy.copyto(self._v, self._chroma[..., 1], casting="unsafe")
+
+    def write_frame(self, frame: "numpy.ndarray") -> None:
+        """
+        Sends an RGB frame (height x width x 3) to the encoder.
+        """
+        import numpy
+
+        frame = frame[..., :3]
+        if self.pipe_format == "yuv420p":
+            self._to_yuv420p(frame)
+            data = self._buffer
+        elif frame.dtype == numpy.uint8 and frame.flags.c_contiguous:
+            data = frame
+        else:
+            numpy.copyto(self._buffer, frame, casting="unsafe")
+            data = self._buffer
+
+        start = time.perf_counter()
+        try:
+            self._process.stdin.write(memoryview(data).cast("B"))
+        except BrokenPipeError:
+            raise IOError(
+                f"ffmpeg failed to encode {self.path}: "
+                + self._process.stderr.read().decode(errors="replace")
+            )
+        self.blocked_time += time.perf_counter() - start
+        self.bytes_written += data.nbytes
+
+    def close(self) -> None:
+        """
+        Waits for the encoder to finish, and reports the pipe metrics.
+        """
+
+        self._process.stdin.close()
+        error = self._process.stderr.read().decode(errors="replace")
+        self._process.stderr.close()
+        if self._process.wait() != 0:
+            raise IOError(f"ffmpeg failed to encode {self.path}: {error}")
+
+        metrics.count("bytes_piped", self.bytes_written)
+        metrics.count("pipe_blocked_ms", round(self.blocked_time * 1000))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *exc_info):
+        if exc_type is None:
+            self.close()
+        else:
+            self._process.kill()
+            self._process.wait()
+            for pipe in [self._process.stdin, self._process.stderr]:
+                try:
+                    pipe.close()
+                except OSError:
+                    # Frames still buffered for the killed encoder
+                    pass
+
+
+def write_clip(
+    clip: "Clip",
+    path: str,
+    fps: float = None,
+    preset: str = "medium",
+    ffmpeg_params: List[str] = None,
+    threads: int = None,
+    audio: bool = True,
+    pipe_format: str = "yuv420p",
+    logger: str = "bar",
+) -> str:
+    """
+    Renders a clip with a `FrameWriter`, as a replacement of moviepy's
+    `write_videofile` for H.264 MP4 outputs. The audio of the clip, if any,
+    is rendered separately and muxed in.
+
+    Returns:
+        str: The path to the video.
+    """
+    from chunks import mux_audio
+
+    fps = fps or clip.fps
+    has_audio = audio and clip.audio is not None
+    video_path = f"{os.path.splitext(path)[0]}_noaudio.mp4" if has_audio else path
+
+    with FrameWriter(
+        video_path, clip.size, fps, preset, ffmpeg_params, threads, pipe_format
+    ) as writer:
+        for frame in clip.iter_frames(fps=fps, logger=logger):
+            writer.write_frame(frame)
+
+    if has_audio:
+        audio_path = f"{os.path.splitext(path)[0]}_audio.mp3"
+        clip.audio.write_audiofile(audio_path, fps=44100, logger=None)
+        mux_audio(video_path, audio_path, path)
+        os.remove(video_path)
+        os.remove(audio_path)
+
+    return path
@@ -0,0 +1,526 @@
+import struct
+from typing import List, Optional, Tuple
+
+import metrics
+
+# Bytes read at once from the start of a video to find its index (moov box)
+PROBE_BYTES = 64 * 1024
+
+# Seconds of video kept past the last second used, before the next keyframe
+PREFIX_MARGIN = 0.5
+
+# Boxes holding the boxes down to the sample tables
+CONTAINERS = {b"moov", b"trak", b"edts", b"mdia", b"minf", b"stbl"}
+
+# Tables with an entry per sample that are not needed to play the video,
+# dropped rather than cut
+OPTIONAL_TABLES = {b"sbgp", b"subs", b"saiz", b"saio"}
+
+# Offsets of the duration in version 0 and version 1 header boxes
+MVHD_DURATION = (16, 24)
+TKHD_DURATION = (20, 28)
+MDHD_DURATION = (16, 24)
+
+
+class RangeNotSupported(Exception):
+    """
+    Raised when a server answers a Range request with the whole file.
+    """
+
+
+def get_range(url: str, start: int, end: int) -> bytes:
+    """
+    Downloads the bytes [start, end) of a file.
+    """
+    import requests
+
+    with metrics.call("video_download"):
+        with requests.get(
+            url, headers={"Range": f"bytes={start}-{end - 1}"}, stream=True
+        ) as response:
+            response.raise_for_status()
+            if response.status_code != 206:
+                raise RangeNotSupported(url)
+            content = response.content
+    metrics.count("bytes_downloaded", len(content))
+
+    return content
+
+
+def download_video(
+    url: str, path: str, byte_range: Tuple[int, int] = None, prefix: bytes = b""
+) -> str:
+    """
+    Downloads a video to `path`, streamed to disk. With `byte_range`, only
+    the bytes [start, end) are downloaded, written after `prefix`.
+
+    Returns:
+        str: The path to the video.
+    """
+    import requests
+
+    headers = {}
+    if byte_range:
+        headers["Range"] = f"bytes={byte_range[0]}-{byte_range[1] - 1}"
+
+    with metrics.call("video_download"):
+        with requests.get(url, headers=headers, stream=True) as response:
+            response.raise_for_status()
+            if byte_range and response.status_code != 206:
+                raise RangeNotSupported(url)
+            with open(path, "wb") as f:
+                f.write(prefix)
+                for block in response.iter_content(1024 * 1024):
+                    f.write(block)
+                    metrics.count("bytes_downloaded", len(block))
+
+    return path
+
+
+def parse_boxes(data: bytes) -> List[list]:
+    """
+    Parses MP4 boxes into [type, content] pairs. The content of the
+    containers leading to the sample tables is their parsed boxes, the
+    content of the other boxes their payload.
+    """
+
+    boxes = []
+    offset = 0
+    while offset + 8 <= len(data):
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, offset + 8)
+            header = 16
+        elif size == 0:
+            size = len(data) - offset
+        if size < header:
+            raise ValueError(f"Invalid {kind} box")
+
+        payload = data[offset + header : offset + size]
+        boxes.append([kind, parse_boxes(payload) if kind in CONTAINERS else payload])
+        offset += size
+
+    return boxes
+
+
+def build_boxes(boxes: List[list]) -> bytes:
+    """
+    Serializes boxes parsed by `parse_boxes`.
+    """
+
+    data = []
+    for kind, content in boxes:
+        payload = build_boxes(content) if isinstance(content, list) else content
+        data.append(struct.pack(">I4s", 8 + len(payload), kind) + payload)
+    return b"".join(data)
+
+
+def find_box(boxes: List[list], *path: bytes):
+    """
+    Returns the content of the first box at `path`, e.g. b"mdia", b"mdhd",
+    or None.
+    """
+
+    for kind, content in boxes:
+        if kind == path[0]:
+            return content if len(path) == 1 else find_box(content, *path[1:])
+    return None
+
+
+def read_entries(payload: bytes, fields: str) -> List[tuple]:
+    """
+    Reads the entries of a full box table: version and flags, entry count,
+    entries of `fields` (struct format).
+    """
+
+    (count,) = struct.unpack_from(">I", payload, 4)
+    size = struct.calcsize(">" + fields)
+    return [
+        struct.unpack_from(">" + fields, payload, 8 + index * size)
+        for index in range(count)
+    ]
+
+
+def write_entries(payload: bytes, fields: str, entries: List[tuple]) -> bytes:
+    """
+    Returns a full box table payload with its entries replaced.
+    """
+
+    data = [payload[:4], struct.pack(">I", len(entries))]
+    data += [struct.pack(">" + fields, *entry) for entry in entries]
+    return b"".join(data)
+
+
+def read_duration(payload: bytes, offsets: Tuple[int, int]) -> int:
+    """
+    Reads the duration of a mvhd, tkhd or mdhd payload, by version.
+    """
+
+    if payload[0] == 1:
+        return struct.unpack_from(">Q", payload, offsets[1])[0]
+    return struct.unpack_from(">I", payload, offsets[0])[0]
+
+
+def write_duration(payload: bytes, offsets: Tuple[int, int], value: int) -> bytes:
+    """
+    Returns a mvhd, tkhd or mdhd payload with its duration replaced.
+    """
+
+    if payload[0] == 1:
+        offset, field = offsets[1], struct.pack(">Q", value)
+    else:
+        offset, field = offsets[0], struct.pack(">I", value)
+    return payload[:offset] + field + payload[offset + len(field) :]
+
+
+def read_timescale(payload: bytes) -> int:
+    """
+    Reads the timescale of a mvhd or mdhd payload.
+    """
+
+    return struct.unpack_from(">I", payload, 20 if payload[0] == 1 else 12)[0]
+
+
+def chunk_offsets(stbl: List[list]) -> List[int]:
+    """
+    Reads the file offsets of the chunks of a track, 32 or 64 bits.
+    """
+
+    if find_box(stbl, b"co64") is not None:
+        return [offset for (offset,) in read_entries(find_box(stbl, b"co64"), "Q")]
+    return [offset for (offset,) in read_entries(find_box(stbl, b"stco"), "I")]
+
+
+def chunk_runs(stbl: List[list]) -> List[Tuple[int, int, int, int]]:
+    """
+    Expands the sample-to-chunk table of a track.
+
+    Returns:
+        List[Tuple[int, int, int, int]]: The first chunk (from 1), the last
+            chunk (excluded), the samples per chunk and the sample
+            description of every run of chunks.
+    """
+
+    chunks = len(chunk_offsets(stbl))
+    runs = read_entries(find_box(stbl, b"stsc"), "III")
+    return [
+        (first, runs[index + 1][0] if index + 1 < len(runs) else chunks + 1, *run)
+        for index, (first, *run) in enumerate(runs)
+    ]
+
+
+def read_track(trak: List[list]) -> dict:
+    """
+    Reads the sample tables of a track.
+
+    Returns:
+        dict: The "handler" and "timescale" of the track, the decode
+            "times" of its samples (and of their end), their "offsets" in
+            the file and "sizes", and the "sync" samples (None if all are).
+    """
+
+    stbl = find_box(trak, b"mdia", b"minf", b"stbl")
+
+    times = [0]
+    for count, delta in read_entries(find_box(stbl, b"stts"), "II"):
+        for _ in range(count):
+            times.append(times[-1] + delta)
+
+    stsz = find_box(stbl, b"stsz")
+    sample_size, count = struct.unpack_from(">II", stsz, 4)
+    if sample_size:
+        sizes = [sample_size] * count
+    else:
+        sizes = list(struct.unpack_from(f">{count}I", stsz, 12))
+
+    offsets = []
+    chunks = chunk_offsets(stbl)
+    for first, last, samples, _ in chunk_runs(stbl):
+        for chunk in range(first, last):
+            offset = chunks[chunk - 1]
+            for sample in range(len(offsets), min(len(offsets) + samples, count)):
+                offsets.append(offset)
+                offset += sizes[sample]
+
+    stss = find_box(stbl, b"stss")
+
+    return {
+        "handler": find_box(trak, b"mdia", b"hdlr")[8:12],
+        "timescale": read_timescale(find_box(trak, b"mdia", b"mdhd")),
+        "times": times[: count + 1],
+        "offsets": offsets,
+        "sizes": sizes,
+        "sync": None if stss is None else [n - 1 for (n,) in read_entries(stss, "I")],
+    }
+
+
+def samples_before(track: dict, seconds: float) -> int:
+    """
+    Returns the number of samples of a track decoded before `seconds`.
+    """
+
+    end = seconds * track["timescale"]
+    return next(
+        (sample for sample, time in enumerate(track["times"][:-1]) if time >= end),
+        len(track["sizes"]),
+    )
+
+
+def truncate_runs(entries: List[tuple], samples: int) -> List[tuple]:
+    """
+    Truncates the (count, value) runs of a table to `samples` samples.
+    """
+
+    truncated = []
+    for count, value in entries:
+        if samples <= 0:
+            break
+        truncated.append((min(count, samples), value))
+        samples -= count
+    return truncated
+
+
+def cut_edits(elst: bytes, duration: int) -> bytes:
+    """
+    Cuts an edit list to `duration`, in the movie timescale.
+    """
+
+    fields = "QqI" if elst[0] == 1 else "IiI"
+    edits = []
+    for segment_duration, media_time, rate in read_entries(elst, fields):
+        if duration <= 0:
+            break
+        edits.append((min(segment_duration, duration), media_time, rate))
+        duration -= segment_duration
+    return write_entries(elst, fields, edits)
+
+
+def cut_track(
+    trak: List[list], track: dict, samples: int, shift: int, movie_scale: int
+) -> int:
+    """
+    Cuts the tables of a track to its first `samples` samples, in place,
+    moving its chunk offsets by `shift` bytes.
+
+    Returns:
+        int: The new duration of the track, in the movie timescale.
+    """
+
+    mdia = find_box(trak, b"mdia")
+    stbl = find_box(mdia, b"minf", b"stbl")
+
+    # The chunks of the kept samples, the last one possibly cut short
+    chunks = []
+    kept = 0
+    for first, last, per_chunk, description in chunk_runs(stbl):
+        for _ in range(first, last):
+            if kept >= samples:
+                break
+            chunks.append((min(per_chunk, samples - kept), description))
+            kept += per_chunk
+
+    new_runs = []
+    for chunk, (per_chunk, description) in enumerate(chunks, 1):
+        if not new_runs or new_runs[-1][1:] != (per_chunk, description):
+            new_runs.append((chunk, per_chunk, description))
+
+    for box in stbl:
+        kind, content = box
+        if kind == b"stts":
+            entries = truncate_runs(read_entries(content, "II"), samples)
+            box[1] = write_entries(content, "II", entries)
+        elif kind == b"ctts":
+            fields = "Ii" if content[0] == 1 else "II"
+            entries = truncate_runs(read_entries(content, fields), samples)
+            box[1] = write_entries(content, fields, entries)
+        elif kind == b"stss":
+            entries = [(n,) for (n,) in read_entries(content, "I") if n <= samples]
+            box[1] = write_entries(content, "I", entries)
+        elif kind == b"sdtp":
+            box[1] = content[: 4 + samples]
+        elif kind == b"stsz":
+            sample_size = struct.unpack_from(">I", content, 4)[0]
+            box[1] = content[:4] + struct.pack(">II", sample_size, samples)
+            if not sample_size:
+                box[1] += struct.pack(f">{samples}I", *track["sizes"][:samples])
+        elif kind == b"stsc":
+            box[1] = write_entries(content, "III", new_runs)
+        elif kind in (b"stco", b"co64"):
+            fields = "I" if kind == b"stco" else "Q"
+            offsets = read_entries(content, fields)[: len(chunks)]
+            box[1] = write_entries(
+                content, fields, [(offset + shift,) for (offset,) in offsets]
+            )
+    stbl[:] = [box for box in stbl if box[0] not in OPTIONAL_TABLES]
+
+    media_duration = track["times"][samples]
+    for box in mdia:
+        if box[0] == b"mdhd":
+            box[1] = write_duration(box[1], MDHD_DURATION, media_duration)
+
+    duration = round(media_duration * movie_scale / track["timescale"])
+    for box in trak:
+        if box[0] == b"tkhd":
+            duration = min(duration, read_duration(box[1], TKHD_DURATION))
+            box[1] = write_duration(box[1], TKHD_DURATION, duration)
+    for box in find_box(trak, b"edts") or []:
+        if box[0] == b"elst":
+            box[1] = cut_edits(box[1], duration)
+
+    return duration
+
+
+def probe_video(url: str) -> Optional[dict]:
+    """
+    Reads the index (moov box) of an MP4 video with Range requests, without
+    downloading its frames.
+
+    Returns:
+        dict: The "width", "height" and "duration" of the video, and its
+            index, or None when the video can only be downloaded whole: the
+            server ignores or fails Range requests, or the index is stored
+            after the frames (not "faststart"), or the video is fragmented,
+            truncated or malformed.
+    """
+    import requests
+
+    try:
+        return read_index(url)
+    except (RangeNotSupported, requests.RequestException):
+        return None
+    except (ValueError, IndexError, KeyError, TypeError, struct.error, StopIteration):
+        return None
+
+
+def read_index(url: str) -> Optional[dict]:
+    """
+    Reads the index of a video for `probe_video`, which handles its errors.
+    """
+
+    data = get_range(url, 0, PROBE_BYTES)
+
+    # The top level boxes, up to the frames (mdat)
+    moov = None
+    offset = 0
+    while True:
+        if offset + 16 > len(data):
+            more = get_range(url, len(data), offset + PROBE_BYTES)
+            if not more:
+                return None
+            data += more
+        size, kind = struct.unpack_from(">I4s", data, offset)
+        header = 8
+        if size == 1:
+            (size,) = struct.unpack_from(">Q", data, offset + 8)
+            header = 16
+        if kind == b"mdat":
+            break
+        if kind == b"moof" or size < header:
+            return None
+        if kind == b"moov":
+            if offset + size > len(data):
+                data += get_range(url, len(data), offset + size)
+            if offset + size > len(data):
+                return None
+            moov = (offset, size)
+        offset += size
+
+    if moov is None:
+        return None
+    mdat = (offset, header, size)
+
+    boxes = parse_boxes(data[moov[0] : moov[0] + moov[1]])[0][1]
+    if find_box(boxes, b"mvex") is not None:
+        return None
+    traks = [content for kind, content in boxes if kind == b"trak"]
+    tracks = [read_track(trak) for trak in traks]
+    video = next(
+        index for index, track in enumerate(tracks) if track["handler"] == b"vide"
+    )
+
+    # The coded size, from the visual sample entry of the video track
+    stsd = find_box(traks[video], b"mdia", b"minf", b"stbl", b"stsd")
+    width, height = struct.unpack_from(">HH", stsd, 40)
+    mvhd = find_box(boxes, b"mvhd")
+
+    return {
+        "url": url,
+        "width": width,
+        "height": height,
+        "duration": read_duration(mvhd, MVHD_DURATION) / read_timescale(mvhd),
+        "header": data[: mdat[0]],
+        "moov": moov,
+        "mdat": mdat,
+        "tracks": tracks,
+        "video_track": video,
+    }
+
+
+def download_prefix(index: dict, seconds: float, path: str) -> str:
+    """
+    Downloads the first `seconds` of a video probed by `probe_video`, into
+    a playable MP4 of the frames up to the next keyframe, indexed by a cut
+    copy of its index. The whole video is downloaded when the prefix would
+    not be smaller.
+
+    Returns:
+        str: The path to the video.
+    """
+
+    url = index["url"]
+    tracks = index["tracks"]
+    video = tracks[index["video_track"]]
+
+    # Whole groups of pictures are kept: up to the next keyframe
+    needed = samples_before(video, seconds + PREFIX_MARGIN)
+    sync = video["sync"] if video["sync"] is not None else range(len(video["sizes"]))
+    cut = next((sample for sample in sync if sample >= needed), 0)
+    if not cut:
+        return download_video(url, path)
+
+    cut_time = video["times"][cut] / video["timescale"]
+    samples = [samples_before(track, cut_time) for track in tracks]
+    kept = [
+        (offset, size)
+        for track, count in zip(tracks, samples)
+        for offset, size in zip(track["offsets"][:count], track["sizes"][:count])
+    ]
+
+    mdat_start, mdat_header, mdat_size = index["mdat"]
+    data_start = mdat_start + mdat_header
+    data_end = max(offset + size for offset, size in kept)
+    if min(offset for offset, _ in kept) < data_start or (
+        mdat_size and data_end >= mdat_start + mdat_size
+    ):
+        return download_video(url, path)
+
+    header = index["header"]
+    moov_start, moov_size = index["moov"]
+
+    def build_moov(shift: int) -> bytes:
+        boxes = parse_boxes(header[moov_start : moov_start + moov_size])[0][1]
+        traks = [content for kind, content in boxes if kind == b"trak"]
+        mvhd = find_box(boxes, b"mvhd")
+        duration = max(
+            cut_track(trak, track, count, shift, read_timescale(mvhd))
+            for trak, track, count in zip(traks, tracks, samples)
+        )
+        for box in boxes:
+            if box[0] == b"mvhd":
+                box[1] = write_duration(mvhd, MVHD_DURATION, duration)
+        return build_boxes([[b"moov", boxes]])
+
+    # The cut index is smaller: the frames move back by the difference
+    moov = build_moov(len(build_moov(0)) - moov_size)
+
+    mdat_size = data_end - mdat_start
+    if mdat_header == 16:
+        mdat = struct.pack(">I4sQ", 1, b"mdat", mdat_size)
+    else:
+        mdat = struct.pack(">I4s", mdat_size, b"mdat")
+
+    prefix = (
+        header[:moov_start] + moov + header[moov_start + moov_size : mdat_start] + mdat
+    )
+    return download_video(url, path, (data_start, data_end), prefix)
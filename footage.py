@@ -0,0 +1,205 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Set
+
+from termcolor import colored
+
+import metrics
+from text import normalize_text
+
+# The fields of a stock video kept in the library, see
+# search.search_for_stock_videos
+VIDEO_FIELDS = (
+    "url",
+    "id",
+    "duration",
+    "width",
+    "height",
+    "renditions",
+    "image",
+    "page",
+    "user",
+    "image_hash",
+)
+
+
+def page_slug(page_url: str) -> str:
+    """
+    Returns the words of the slug of a Pexels video page, e.g. "woman typing
+    on a laptop" for https://www.pexels.com/video/woman-typing-on-a-laptop-123/.
+    """
+
+    match = re.search(r"/video/([^/]+?)(?:-\d+)?/?$", page_url or "")
+    return match.group(1).replace("-", " ") if match else ""
+
+
+class FootageLibrary:
+    """
+    Persistent library of the stock videos downloaded before.
+
+    Every video is stored with its Pexels metadata: the search terms it was
+    found for (its tags), the slug of its page, its duration, resolution
+    and user. An inverted index maps every word of that metadata to the
+    videos it describes, so that search terms are looked up locally, in
+    milliseconds, before spending a Pexels API call on them.
+
+    Only the metadata is stored: the videos are downloaded from their
+    Pexels URLs again when they are used.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(self, root: str = "cache/footage", min_results: int = 5):
+        self.root = root
+        self.min_results = min_results
+
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._postings: Dict[str, Set[str]] = {}
+
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+
+    def search(
+        self, query: str, min_duration: float, max_duration: float
+    ) -> List[dict]:
+        """
+        Looks up the stored videos matching every word of a search term.
+
+        Args:
+            query (str): The search term.
+            min_duration (float): The minimum duration of the videos.
+            max_duration (float): The maximum duration of the videos.
+
+        Returns:
+            List[dict]: The videos, like `search.search_for_stock_videos`
+                returns them, the most specific matches first, or an empty
+                list if there are fewer than `min_results`.
+        """
+
+        tokens = set(normalize_text(query).split())
+
+        with self._lock:
+            keys = None
+            for token in tokens:
+                postings = self._postings.get(token, set())
+                keys = postings if keys is None else keys & postings
+            entries = [
+                self._entries[key]
+                for key in sorted(keys or ())
+                if min_duration <= self._entries[key]["duration"] <= max_duration
+            ]
+
+            if len(entries) < self.min_results:
+                self.misses += 1
+                metrics.count("cache_misses")
+                return []
+
+            self.hits += 1
+            metrics.count("cache_hits")
+
+            # Videos described by fewer words match the term more closely
+            entries.sort(key=lambda entry: len(self._tokens(entry)))
+            return [
+                {field: entry.get(field) for field in VIDEO_FIELDS}
+                for entry in entries
+            ]
+
+    def add(self, videos: List[dict]) -> None:
+        """
+        Adds downloaded videos to the library, or the search terms they were
+        found for to the tags of the videos stored already.
+
+        Args:
+            videos (List[dict]): The videos, see
+                `search.search_for_stock_videos`, each with the "query" it
+                was found for.
+        """
+
+        now = time.time()
+        with self._lock:
+            for video in videos:
+                key = str(video["id"])
+                entry = self._entries.get(key)
+                if entry is None:
+                    entry = {field: video.get(field) for field in VIDEO_FIELDS}
+                    entry.update(tags=[], slug=page_slug(video.get("page")))
+                    entry["created"] = now
+                    self._entries[key] = entry
+                if entry.get("image_hash") is None:
+                    entry["image_hash"] = video.get("image_hash")
+                if video.get("query") and video["query"] not in entry["tags"]:
+                    entry["tags"].append(video["query"])
+                entry["last_used"] = now
+
+                for token in self._tokens(entry):
+                    self._postings.setdefault(token, set()).add(key)
+
+            self._save()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate statistics of the library for this session.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "videos": len(self._entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def print_stats(self) -> None:
+        """
+        Prints the hit rate statistics of the library.
+        """
+
+        stats = self.stats()
+        print(
+            colored(
+                f"[+] Footage library: {stats['hits']} hits, "
+                f"{stats['misses']} misses, hit rate {stats['hit_rate']:.0%}, "
+                f"{stats['videos']} videos stored",
+                "blue",
+            )
+        )
+
+    @staticmethod
+    def _tokens(entry: dict) -> Set[str]:
+        """
+        Returns the words of the metadata of a stored video.
+        """
+
+        text = " ".join([*entry["tags"], entry["slug"], entry.get("user") or ""])
+        return set(normalize_text(text).split())
+
+    def _load(self) -> None:
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                self._entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(
+                colored("[-] Footage library index is corrupt, starting over.", "red")
+            )
+            return
+
+        for key, entry in self._entries.items():
+            for token in self._tokens(entry):
+                self._postings.setdefault(token, set()).add(key)
+
+    def _save(self) -> None:
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        with open(f"{index_path}.part", "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(f"{index_path}.part", index_path)
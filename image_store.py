@@ -0,0 +1,307 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from collections import Counter
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from termcolor import colored
+
+import metrics
+from text import normalize_text
+
+if TYPE_CHECKING:
+    import numpy
+
+
+class ImageStore:
+    """
+    Persistent library of generated images.
+
+    Every image is indexed by its normalized prompt, model, size and quality.
+    Prompts that are not stored verbatim are matched against the stored ones
+    with TF-IDF cosine similarity, so near-identical prompts reuse an image
+    instead of paying for a new render.
+    """
+
+    INDEX_FILE = "index.json"
+
+    def __init__(
+        self,
+        root: str = "cache/images",
+        similarity_threshold: float = 0.85,
+        max_bytes: int = 2 * 1024**3,
+        max_age_days: float = 90,
+    ):
+        self.root = root
+        self.similarity_threshold = similarity_threshold
+        self.max_bytes = max_bytes
+        self.max_age = max_age_days * 24 * 60 * 60
+
+        self.hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._entries: Dict[str, dict] = {}
+        self._vectors = {}
+
+        os.makedirs(self.root, exist_ok=True)
+        self._load()
+        self.evict()
+
+    @staticmethod
+    def key(prompt: str, model: str, size: str, quality: str) -> str:
+        """
+        Returns the store key of a prompt rendered with the given settings.
+        """
+
+        raw = "|".join([normalize_text(prompt), model, size, quality])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def lookup(self, prompt: str, model: str, size: str, quality: str) -> Optional[str]:
+        """
+        Looks up a stored image for a prompt.
+
+        Args:
+            prompt (str): The image prompt.
+            model (str): The image model.
+            size (str): The image size, e.g. "1024x1792".
+            quality (str): The image quality.
+
+        Returns:
+            str: The path to the stored image, or None if there is no match.
+        """
+
+        with self._lock:
+            entry = self._entries.get(self.key(prompt, model, size, quality))
+            if entry is not None:
+                self.hits += 1
+            else:
+                entry = self._most_similar(prompt, model, size, quality)
+                if entry is not None:
+                    self.hits += 1
+                    self.similar_hits += 1
+
+            if entry is None:
+                self.misses += 1
+                metrics.count("cache_misses")
+                return None
+
+            metrics.count("cache_hits")
+
+            entry["last_used"] = time.time()
+            self._save()
+
+            return os.path.join(self.root, entry["file"])
+
+    def add(
+        self, prompt: str, model: str, size: str, quality: str, image_path: str
+    ) -> str:
+        """
+        Adds a generated image to the store.
+
+        Args:
+            prompt (str): The prompt the image was generated for.
+            model (str): The image model.
+            size (str): The image size.
+            quality (str): The image quality.
+            image_path (str): The path of the generated image.
+
+        Returns:
+            str: The path to the stored copy of the image.
+        """
+
+        key = self.key(prompt, model, size, quality)
+        file_name = f"{key}.png"
+        stored_path = os.path.join(self.root, file_name)
+
+        shutil.copyfile(image_path, stored_path)
+
+        now = time.time()
+        with self._lock:
+            self._entries[key] = {
+                "prompt": prompt,
+                "normalized": normalize_text(prompt),
+                "model": model,
+                "size": size,
+                "quality": quality,
+                "file": file_name,
+                "bytes": os.path.getsize(stored_path),
+                "created": now,
+                "last_used": now,
+            }
+            self._vectors.clear()
+            self._evict()
+            self._save()
+
+        return stored_path
+
+    def evict(self) -> None:
+        """
+        Removes images older than the maximum age, then the least recently
+        used images until the store fits in its size budget.
+        """
+
+        with self._lock:
+            self._evict()
+            self._save()
+
+    def stats(self) -> dict:
+        """
+        Returns the hit rate statistics of the store for this session.
+        """
+
+        lookups = self.hits + self.misses
+        return {
+            "images": len(self._entries),
+            "bytes": sum(entry["bytes"] for entry in self._entries.values()),
+            "hits": self.hits,
+            "similar_hits": self.similar_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def print_stats(self) -> None:
+        """
+        Prints the hit rate statistics of the store.
+        """
+
+        stats = self.stats()
+        print(
+            colored(
+                f"[+] Image store: {stats['hits']} hits "
+                f"({stats['similar_hits']} similar), {stats['misses']} misses, "
+                f"hit rate {stats['hit_rate']:.0%}, {stats['images']} images stored",
+                "blue",
+            )
+        )
+
+    def _most_similar(
+        self, prompt: str, model: str, size: str, quality: str
+    ) -> Optional[dict]:
+        """
+        Finds the stored entry with the most similar prompt, rendered with the
+        same settings, if its similarity reaches the threshold.
+        """
+
+        group = (model, size, quality)
+        if group not in self._vectors:
+            self._vectors[group] = self._build_vectors(group)
+
+        entries, vocabulary, idf, matrix = self._vectors[group]
+        if not entries:
+            return None
+
+        query = self._vectorize(normalize_text(prompt).split(), vocabulary, idf)
+        if not query.any():
+            return None
+
+        similarities = matrix @ query
+        best = int(similarities.argmax())
+        if similarities[best] < self.similarity_threshold:
+            return None
+
+        return entries[best]
+
+    def _build_vectors(self, group):
+        """
+        Builds the TF-IDF matrix of the stored prompts of a settings group.
+        """
+        import numpy
+
+        entries = [
+            entry
+            for entry in self._entries.values()
+            if (entry["model"], entry["size"], entry["quality"]) == group
+        ]
+        documents = [entry["normalized"].split() for entry in entries]
+
+        document_frequency = Counter()
+        for tokens in documents:
+            document_frequency.update(set(tokens))
+
+        vocabulary = {token: i for i, token in enumerate(sorted(document_frequency))}
+        idf = numpy.zeros(len(vocabulary), dtype=numpy.float32)
+        for token, i in vocabulary.items():
+            idf[i] = math.log((1 + len(documents)) / (1 + document_frequency[token])) + 1
+
+        matrix = numpy.zeros((len(documents), len(vocabulary)), dtype=numpy.float32)
+        for row, tokens in enumerate(documents):
+            matrix[row] = self._vectorize(tokens, vocabulary, idf)
+
+        return entries, vocabulary, idf, matrix
+
+    @staticmethod
+    def _vectorize(tokens: List[str], vocabulary: dict, idf) -> "numpy.ndarray":
+        """
+        Returns the L2 normalized TF-IDF vector of a list of tokens.
+        """
+        import numpy
+
+        vector = numpy.zeros(len(vocabulary), dtype=numpy.float32)
+        for token, count in Counter(tokens).items():
+            if token in vocabulary:
+                vector[vocabulary[token]] = count
+
+        vector *= idf
+        norm = numpy.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _evict(self) -> None:
+        now = time.time()
+        expired = [
+            key
+            for key, entry in self._entries.items()
+            if self.max_age and now - entry["last_used"] > self.max_age
+        ]
+
+        total_bytes = sum(entry["bytes"] for entry in self._entries.values())
+        by_last_use = sorted(
+            (key for key in self._entries if key not in expired),
+            key=lambda key: self._entries[key]["last_used"],
+        )
+        for key in expired:
+            total_bytes -= self._entries[key]["bytes"]
+        while self.max_bytes and total_bytes > self.max_bytes and by_last_use:
+            key = by_last_use.pop(0)
+            expired.append(key)
+            total_bytes -= self._entries[key]["bytes"]
+
+        for key in expired:
+            entry = self._entries.pop(key)
+            try:
+                os.remove(os.path.join(self.root, entry["file"]))
+            except FileNotFoundError:
+                pass
+
+        if expired:
+            self._vectors.clear()
+
+    def _load(self) -> None:
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        if not os.path.exists(index_path):
+            return
+
+        try:
+            with open(index_path, "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            print(colored("[-] Image store index is corrupt, starting over.", "red"))
+            return
+
+        # Drop entries whose image was removed behind our back
+        self._entries = {
+            key: entry
+            for key, entry in entries.items()
+            if os.path.exists(os.path.join(self.root, entry["file"]))
+        }
+
+    def _save(self) -> None:
+        index_path = os.path.join(self.root, self.INDEX_FILE)
+        with open(f"{index_path}.part", "w", encoding="utf-8") as f:
+            json.dump(self._entries, f, indent=2)
+        os.replace(f"{index_path}.part", index_path)
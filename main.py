@@ -1,41 +1,107 @@
+import argparse
 import os
-import uuid
-
-from moviepy.editor import (
-    AudioFileClip,
-    CompositeAudioClip,
-    CompositeVideoClip,
-    TextClip,
-    VideoFileClip,
-)
-from moviepy.video.tools.subtitles import SubtitlesClip
-from openai import OpenAI
+import random
+
 from termcolor import colored
 
+import metrics
 from config import Config
+from footage import FootageLibrary
+from image_store import ImageStore
+from metrics import RunMetrics
+from profiles import load_profiles
 from prompts import (
     generate_image_prompts,
     generate_images,
     generate_script,
     get_search_terms,
 )
-from search import search_for_stock_videos
+from render_modes import output_path, render_settings, scaled_size
+from search import remove_near_duplicates, search_for_stock_videos
+from speech import SegmentCache, generate_speech_openai
+from storage import StorageManager
+from tiktokvoice import TikTokSynthesizer, generate_speech_from_script
+from timeline import (
+    AudioBed,
+    Timeline,
+    plan_slide_segments,
+    plan_stock_segments,
+    proxy_rendition,
+    read_subtitle_events,
+)
 from utils import choose_random_song
-from video import combine_videos, generate_subtitles, save_video, video_from_images
+from video import (
+    RENDERERS,
+    conform_proxies,
+    fetch_stock_videos,
+    generate_subtitles,
+    list_images_in_order,
+    probe_stock_videos,
+    save_video,
+    stock_candidates,
+)
 
 
 class Videographer:
     """
     Videographer class.
+
+    moviepy is imported by the stages that render, so that the script and
+    speech stages, and runs resumed after them, start quickly.
     """
 
-    def __init__(self, topic, stage=0, project_space=None):
-        self.config = Config("config.json")
+    def __init__(self, topic, stage=0, project_space=None, config=None):
+        self.config = config or Config("config.json")
         self.topic = topic
+        self.storage = StorageManager.from_config(self.config)
         self.project_space = (
-            f"temp/{project_space}" if project_space else self.create_temp_folder()
+            self.storage.project_path(project_space)
+            if project_space
+            else self.create_temp_folder()
         )
         self.stage = stage
+        self.render_mode = self.config.render_mode
+        self.timeline = Timeline.load(self.project_space)
+        self.subtitle_events = None
+
+    @property
+    def profile_dir(self):
+        """
+        The folder render profiles are written to, or None when
+        render profiling is disabled.
+        """
+
+        if not self.config.render_profile:
+            return None
+        return f"{self.project_space}/profiles"
+
+    @property
+    def settings(self):
+        """
+        The encoder settings of the render mode.
+        """
+
+        return render_settings(self.render_mode)
+
+    @property
+    def renderer(self):
+        """
+        The renderer of the timeline, for the render mode.
+        """
+
+        return RENDERERS[self.config.renderer](
+            self.project_space,
+            self.settings,
+            self.config.n_threads or 2,
+            self.profile_dir,
+        )
+
+    def save_timeline(self):
+        """
+        Save the timeline, so that it can be rendered again.
+        """
+
+        self.timeline.save(self.project_space)
 
     def create_temp_folder(
         self,
@@ -43,31 +109,21 @@ class Videographer:
         """
         Create a temporary folder for the project.
         Subsequently create subfolders for videos, subtitles, audio, and images.
+        High-churn subfolders may live on the configured scratch directory.
         """
 
-        project_name = uuid.uuid4()
+        return self.storage.create_project()
 
-        if not os.path.exists("temp"):
-            os.makedirs("temp")
-        if not os.path.exists(f"temp/{project_name}"):
-            os.makedirs(f"temp/{project_name}")
-        if not os.path.exists(f"temp/{project_name}/videos"):
-            os.makedirs(f"temp/{project_name}/videos")
-        if not os.path.exists(f"temp/{project_name}/subtitles"):
-            os.makedirs(f"temp/{project_name}/subtitles")
-        if not os.path.exists(f"temp/{project_name}/audio"):
-            os.makedirs(f"temp/{project_name}/audio")
-        if not os.path.exists(f"temp/{project_name}/images"):
-            os.makedirs(f"temp/{project_name}/images")
-
-        return f"temp/{project_name}"
-
-    def get_video_urls_from_search_terms(self, search_terms):
+    def get_video_urls_from_search_terms(self, search_terms, library=None):
         """
-        Get video URLs from search terms.
+        Get the stock videos found for the search terms, with their Pexels
+        metadata and the search term that found them.
+
+        The footage library is searched first: Pexels is only searched for
+        the terms the library has too few videos for.
         """
 
-        video_urls = []
+        videos = []
 
         # Defines how many results it should query and search through
         number_of_stock_vids = 15
@@ -77,24 +133,42 @@ class Videographer:
         # Loop through all search terms,
         # and search for a video of the given search term
         for search_term in search_terms:
-            found_urls = search_for_stock_videos(
-                search_term,
-                self.config.pexels_api_key,
-                number_of_stock_vids,
-                min_clip_duration,
-                max_clip_duration,
+            found_videos = (
+                library.search(search_term, min_clip_duration, max_clip_duration)
+                if library
+                else []
             )
-            # Check for duplicates
-            for url in found_urls:
-                if url not in video_urls:
-                    video_urls.append(url)
+            if found_videos:
+                print(
+                    colored(
+                        f'\t=> "{search_term}" found {len(found_videos)} Videos '
+                        "in the footage library",
+                        "cyan",
+                    )
+                )
+            else:
+                found_videos = search_for_stock_videos(
+                    search_term,
+                    self.config.pexels_api_key,
+                    number_of_stock_vids,
+                    min_clip_duration,
+                    max_clip_duration,
+                    self.config.pexels_base_url,
+                )
+            # Check for duplicates: search terms find the same videos
+            for video in found_videos:
+                if video["id"] not in [found["id"] for found in videos]:
+                    videos.append({**video, "query": search_term})
                     # break
 
-        # Check if video_urls is empty
-        if not video_urls:
+        # Remove the footage that looks the same too, before downloading any
+        videos = remove_near_duplicates(videos, self.config.near_duplicate_distance)
+
+        # Check if videos is empty
+        if not videos:
             print(colored("[-] No videos found to download.", "red"))
 
-        return video_urls
+        return videos
 
     def download_videos_to_temp_folder(self, video_urls):
         """
@@ -121,6 +195,8 @@ class Videographer:
     def generate_speech_from_script_openai(self):
         """
         Generate speech from script using OpenAI API.
+        The script is synthesized sentence by sentence, and every sentence
+        is cached, so only edited sentences are synthesized again.
         """
         print(colored("[+] Generating speech from script...", "green"))
 
@@ -129,50 +205,81 @@ class Videographer:
         with open(f"{self.project_space}/script.txt", "r", encoding="utf-8") as f:
             script = (" ").join(f.readlines())
 
-        speech_file_path = f"{self.project_space}/audio/speech.mp3"
-        client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
-        response = client.audio.speech.create(
-            model="tts-1", voice="alloy", input=script
+        generate_speech_openai(
+            script,
+            self.project_space,
+            os.getenv("OPENAI_API_KEY"),
+            voice=self.config.tts_voice,
+            model=self.config.tts_model,
+            cache=SegmentCache(self.config.tts_cache_dir),
+            max_workers=self.config.tts_workers,
         )
 
-        response.stream_to_file(speech_file_path)
-
         print(colored("[+] Done generating speech from script.", "green"))
 
-    def add_music_to_video(self):
+    def generate_speech_from_script_tiktok(self):
         """
-        Add music to the generated video.
+        Generate speech from script using the TikTok voices.
         """
+        print(colored("[+] Generating speech from script...", "green"))
 
-        final_video_path = f"{self.project_space}/output.mp4"
+        with open(f"{self.project_space}/script.txt", "r", encoding="utf-8") as f:
+            script = (" ").join(f.readlines())
 
-        video_clip = VideoFileClip(final_video_path)
-        # Select a random song
-        song_path = choose_random_song()
+        with TikTokSynthesizer(
+            self.config.tiktok_tts_endpoints, max_workers=self.config.tts_workers
+        ) as synthesizer:
+            generate_speech_from_script(
+                script,
+                self.project_space,
+                self.config.voice,
+                cache=SegmentCache(self.config.tts_cache_dir),
+                synthesizer=synthesizer,
+            )
 
-        # Add song to video at 30% volume using moviepy
-        original_duration = video_clip.duration
-        original_audio = video_clip.audio
-        song_clip = AudioFileClip(song_path).set_fps(44100)
+        print(colored("[+] Done generating speech from script.", "green"))
 
-        # Set the volume of the song to 20% of the original volume
-        song_clip = song_clip.volumex(0.2).set_fps(44100)
+    def plan_music(self):
+        """
+        Choose the background music of the video.
+        """
+
+        # Select a random song, at 20% of the original volume
+        song_path = choose_random_song()
+        return AudioBed(
+            "music", os.path.relpath(song_path, self.project_space), volume=0.2
+        )
+
+    def add_music_to_video(self):
+        """
+        Add music to the generated video.
+        """
 
-        # Add the song to the video
-        comp_audio = CompositeAudioClip([original_audio, song_clip])
-        video_clip = video_clip.set_audio(comp_audio)
-        video_clip = video_clip.set_fps(30)
-        video_clip = video_clip.set_duration(original_duration)
+        final_video_path = output_path(self.project_space, self.render_mode, "output")
 
-        output_file = final_video_path.split(".")[0] + "_music.mp4"
-        video_clip.write_videofile(output_file, threads=self.config.n_threads or 1)
+        if self.timeline.audio_bed("music") is None:
+            self.timeline.set_audio_bed("music", self.plan_music())
+            self.save_timeline()
 
-        os.rename(output_file, final_video_path)
+        self.renderer.render_music(self.timeline, final_video_path)
 
         print(
             colored(f"[+] Music added to generated video: {final_video_path}!", "green")
         )
 
+    def render_profiles(self):
+        """
+        Render the video in the output profiles of the config, in one pass.
+        """
+
+        profiles = load_profiles(self.config.output_profiles)
+        final_video_path = output_path(self.project_space, self.render_mode, "output")
+
+        paths = self.renderer.render_profiles(self.timeline, profiles, final_video_path)
+
+        for path in paths:
+            print(colored(f"[+] Video : {path}", "green"))
+
     def kill_ffmpeg_processes(
         self,
     ):
@@ -191,6 +298,7 @@ class Videographer:
         """
         Generate video from stock videos.
         """
+        from moviepy.editor import AudioFileClip
 
         script = ""
 
@@ -204,25 +312,90 @@ class Videographer:
             self.config.smart_llm_model,
         )
 
-        video_urls = self.get_video_urls_from_search_terms(search_terms)
+        library = (
+            FootageLibrary(
+                self.config.footage_library_dir,
+                self.config.footage_library_min_results,
+            )
+            if self.config.use_footage_library
+            else None
+        )
+
+        videos = self.get_video_urls_from_search_terms(search_terms, library)
 
         video_duration = AudioFileClip(
             f"{self.project_space}/audio/speech.mp3"
         ).duration
 
-        combined_video_path = combine_videos(
-            video_urls,
-            video_duration,
-            self.config.n_threads or 2,
+        seed = self.config.timeline_seed
+        if seed is None:
+            seed = random.randrange(2**32)
+        max_clip_seconds = float(self.config.max_clip_seconds)
+
+        # A preview is planned and rendered on proxies: the final render
+        # downloads the full resolution of the clips kept, see render_timeline
+        preview_size = scaled_size([1080, 1920], self.settings)
+        candidates = []
+        for video, candidate in zip(
+            videos, stock_candidates([video["url"] for video in videos])
+        ):
+            candidate = {**video, **candidate}
+            if self.render_mode == "preview" and video.get("renditions"):
+                proxy = proxy_rendition(video["renditions"], preview_size)
+                if proxy["url"] != video["url"]:
+                    candidate.update(
+                        proxy,
+                        path=candidate["path"].replace(".mp4", "_proxy.mp4"),
+                        full={"url": video["url"], "path": candidate["path"]},
+                    )
+            candidates.append(candidate)
+
+        # Choose the clips with the durations reported by Pexels, then read
+        # the exact ones of the chosen videos only, and plan with them
+        chosen = {
+            segment.source
+            for segment in plan_stock_segments(
+                candidates, video_duration, seed, max_clip_seconds
+            )
+        }
+        sources = probe_stock_videos(
+            [candidate for candidate in candidates if candidate["path"] in chosen],
             self.project_space,
         )
 
-        return combined_video_path
+        self.timeline = Timeline([1080, 1920], 30, seed)
+        self.timeline.video = plan_stock_segments(
+            sources, video_duration, seed, max_clip_seconds
+        )
+        self.timeline.proxies = {
+            source["path"]: {
+                **source["full"],
+                "size": [source["width"], source["height"]],
+            }
+            for source in sources
+            if "full" in source
+        }
+        fetch_stock_videos(sources, self.timeline.video, self.project_space)
+        self.save_timeline()
+
+        if library:
+            used = {segment.source for segment in self.timeline.video}
+            library.add(
+                [
+                    video
+                    for video, candidate in zip(videos, candidates)
+                    if candidate["path"] in used
+                ]
+            )
+            library.print_stats()
+
+        return self.render_raw_video()
 
     def generate_video_from_images(self):
         """
         Generate video from dalle images.
         """
+        from moviepy.editor import AudioFileClip
 
         video_duration = AudioFileClip(
             f"{self.project_space}/audio/speech.mp3"
@@ -233,12 +406,50 @@ class Videographer:
         print(colored(f"[+] Required Video Duration: {video_duration}", "blue"))
         print(colored(f"[+] Number of images req : {number_of_images}", "blue"))
 
+        image_store = (
+            ImageStore(
+                self.config.image_store_dir,
+                self.config.image_similarity_threshold,
+                self.config.image_store_max_mb * 1024**2,
+                self.config.image_store_max_age_days,
+            )
+            if self.config.use_image_store
+            else None
+        )
+
         image_prompts = generate_image_prompts(number_of_images, self.topic)
-        generate_images(os.getenv("OPENAI_API_KEY"), image_prompts, self.project_space)
-        video_from_images(
+        generate_images(
+            os.getenv("OPENAI_API_KEY"),
+            image_prompts,
             self.project_space,
-            self.config.image_video_duration,
-            video_duration,
+            max_workers=self.config.image_generation_workers,
+            image_store=image_store,
+        )
+
+        if image_store:
+            image_store.print_stats()
+
+        images = [
+            f"images/{name}"
+            for name in list_images_in_order(f"{self.project_space}/images")
+        ]
+
+        self.timeline = Timeline([1024, 1792], 25)
+        self.timeline.video = plan_slide_segments(
+            images, self.config.image_video_duration, video_duration
+        )
+        self.save_timeline()
+
+        return self.render_raw_video()
+
+    def render_raw_video(self):
+        """
+        Render the video track of the timeline into the raw video.
+        """
+
+        return self.renderer.render_video_track(
+            self.timeline,
+            output_path(self.project_space, self.render_mode, "raw_video"),
         )
 
     def generate_script(self):
@@ -260,53 +471,50 @@ class Videographer:
         Generate subtitles for the video.
         """
 
-        generate_subtitles(
+        self.subtitle_events = generate_subtitles(
             self.project_space,
             voice=self.config.voice_prefix,
             openai_api_key=os.getenv("OPENAI_API_KEY"),
+            method=self.config.subtitles_method,
         )
 
-    def generate_video(self):
+    def plan_subtitles(self):
         """
-        Generate the final video.
+        Read the subtitle timings, choose their style and add the speech.
         """
 
-        subtitles_path = f"{self.project_space}/subtitles/subtitles.srt"
-        tts_path = f"{self.project_space}/audio/speech.mp3"
-        combined_video_path = f"{self.project_space}/videos/final_raw.mp4"
-
         # Split the subtitles position into horizontal and vertical
         horizontal_subtitles_position, vertical_subtitles_position = (
             self.config.subtitles_position.split(",")
         )
 
-        def on_subtitles_read(txt):
-            return TextClip(
-                txt,
-                font=self.config.text_font,
-                fontsize=80,
-                color=self.config.text_color or "#FFFF00",
-                bg_color="aqua",
-            ).set_opacity(0.9)
-
-        # Burn the subtitles into the video
-        subtitles = SubtitlesClip(subtitles_path, on_subtitles_read)
-
-        result = CompositeVideoClip(
-            [
-                VideoFileClip(combined_video_path),
-                subtitles.set_pos(
-                    (horizontal_subtitles_position, vertical_subtitles_position)
-                ),
-            ]
+        # The events of this run, or those of the run that made the subtitles
+        self.timeline.subtitles = self.subtitle_events or read_subtitle_events(
+            f"{self.project_space}/subtitles/subtitles.srt"
         )
+        self.timeline.subtitle_style = {
+            "position": [horizontal_subtitles_position, vertical_subtitles_position],
+            "font": self.config.text_font,
+            "fontsize": 80,
+            "color": self.config.text_color or "#FFFF00",
+            "bg_color": "aqua",
+            "opacity": 0.9,
+        }
+        self.timeline.set_audio_bed("speech", AudioBed("speech", "audio/speech.mp3"))
+
+    def generate_video(self):
+        """
+        Generate the final video.
+        """
 
-        # Add the audio
-        audio = AudioFileClip(tts_path)
-        result = result.set_audio(audio)
+        if self.timeline.subtitle_style is None:
+            self.plan_subtitles()
+            self.save_timeline()
 
-        result.write_videofile(
-            f"{self.project_space}/output.mp4", threads=self.config.n_threads or 2
+        self.renderer.render_subtitles(
+            self.timeline,
+            output_path(self.project_space, self.render_mode, "raw_video"),
+            output_path(self.project_space, self.render_mode, "output"),
         )
 
     def process(self):
@@ -314,53 +522,227 @@ class Videographer:
         Process the video creation.
         """
 
+        run_metrics = RunMetrics()
+        metrics.set_metrics(run_metrics)
+
         try:
 
             print(colored("[+] Starting the video creation process", "green"))
 
             if self.stage < 1:
                 # Generate script
-                self.generate_script()
+                with metrics.stage("script"):
+                    self.generate_script()
+                self.storage.check_quota(self.project_space)
 
             if self.stage < 2:
                 # Generate speech
-                self.generate_speech_from_script_openai()
+                with metrics.stage("speech"):
+                    if self.config.tts_provider == "tiktok":
+                        self.generate_speech_from_script_tiktok()
+                    else:
+                        self.generate_speech_from_script_openai()
+                self.storage.check_quota(self.project_space)
 
             if self.stage < 3:
                 # Generate subtitles
-                self.generate_subtitles()
+                with metrics.stage("subtitles"):
+                    self.generate_subtitles()
+                self.storage.check_quota(self.project_space)
 
             if self.stage < 4:
                 # Generate raw video
-                if self.config.use_stock_videos:
-                    self.generate_video_from_stock_videos()
-                else:
-                    self.generate_video_from_images()
+                with metrics.stage("raw_video"):
+                    if self.config.use_stock_videos:
+                        self.generate_video_from_stock_videos()
+                    else:
+                        self.generate_video_from_images()
+                self.storage.check_quota(self.project_space)
 
             if self.stage < 5:
                 # Generate final video with speech and subtitles
-                self.generate_video()
+                with metrics.stage("final_video"):
+                    self.plan_subtitles()
+                    self.save_timeline()
+                    self.generate_video()
 
-                print(colored("************", "green"))
-                print(colored(f"[+] Video : {self.project_space}/output.mp4", "green"))
-                print(colored("************", "green"))
+                self.print_output()
 
             if self.stage < 6:
 
                 # Add music to the video
-                if self.config.use_music:
-                    self.add_music_to_video()
+                self.timeline.set_audio_bed(
+                    "music", self.plan_music() if self.config.use_music else None
+                )
+                self.save_timeline()
+                if self.timeline.audio_bed("music"):
+                    with metrics.stage("music"):
+                        self.add_music_to_video()
+
+            if self.render_mode == "final" and self.config.output_profiles:
+                # Render the other formats from the same timeline
+                with metrics.stage("profiles"):
+                    self.render_profiles()
+
+            if self.render_mode == "final":
+                # Keep the output, drop the intermediates
+                self.storage.finish(self.project_space)
+            else:
+                # Keep the sources and the timeline for the final render
+                self.storage.park(self.project_space)
+                print(
+                    colored(
+                        "[+] Render the final video with: python main.py --final "
+                        f"{os.path.basename(self.project_space)}",
+                        "blue",
+                    )
+                )
 
         except Exception as e:
             print(colored(f"[-] Error generating video: {e}", "red"))
         finally:
             print(colored("[+] Cleaning up...", "green"))
             self.kill_ffmpeg_processes()
+            self.write_metrics(run_metrics)
+
+    def render_timeline(self, mode: str = "final"):
+        """
+        Render a previewed project from its timeline, without running the
+        LLM, TTS or download steps again. With the segmented renderer, only
+        the chunks changed since the last render of the mode are encoded.
+
+        Args:
+            mode (str): The render mode, "final" or "preview".
+        """
+
+        if not self.timeline.video or self.timeline.subtitle_style is None:
+            print(
+                colored(
+                    f"[-] No timeline in {self.project_space}, "
+                    "render a preview first",
+                    "red",
+                )
+            )
+            return
+
+        if mode == "final" and self.timeline.proxies:
+            try:
+                conform_proxies(self.timeline, self.project_space)
+            except Exception as e:
+                print(colored(f"[-] Could not download the videos: {e}", "red"))
+                return
+            finally:
+                self.save_timeline()
+
+        # The sources are deleted once the final video has been rendered
+        missing = [
+            path
+            for path in self.timeline.sources()
+            if not os.path.exists(f"{self.project_space}/{path}")
+        ]
+        if missing:
+            print(
+                colored(
+                    "[-] The sources of the timeline are gone: "
+                    + ", ".join(missing),
+                    "red",
+                )
+            )
+            return
+
+        self.render_mode = mode
+        run_metrics = RunMetrics()
+        metrics.set_metrics(run_metrics)
+
+        try:
+            print(
+                colored(f"[+] Rendering the {mode} video from the timeline", "green")
+            )
+
+            with metrics.stage("raw_video"):
+                self.render_raw_video()
+            self.storage.check_quota(self.project_space)
+
+            with metrics.stage("final_video"):
+                self.generate_video()
+
+            if self.timeline.audio_bed("music"):
+                with metrics.stage("music"):
+                    self.add_music_to_video()
+
+            self.print_output()
+
+            if mode == "final" and self.config.output_profiles:
+                with metrics.stage("profiles"):
+                    self.render_profiles()
+
+            if mode == "final":
+                # Keep the output, drop the intermediates
+                self.storage.finish(self.project_space)
+            else:
+                self.storage.park(self.project_space)
+
+        except Exception as e:
+            print(colored(f"[-] Error rendering video: {e}", "red"))
+        finally:
+            self.write_metrics(run_metrics)
+
+    def print_output(self):
+        """
+        Print the location of the rendered video.
+        """
+
+        print(colored("************", "green"))
+        video_path = output_path(self.project_space, self.render_mode, "output")
+        print(colored(f"[+] Video : {video_path}", "green"))
+        print(colored("************", "green"))
+
+    def write_metrics(self, run_metrics):
+        """
+        Write the run report to the project space, and in the Prometheus
+        text format if a metrics file is configured.
+        """
+
+        run_metrics.write_json(f"{self.project_space}/metrics.json")
+
+        if self.config.prometheus_metrics_file:
+            run_metrics.write_prometheus(
+                self.config.prometheus_metrics_file,
+                {"project": os.path.basename(self.project_space)},
+            )
+
+        print(colored(f"[+] Metrics : {self.project_space}/metrics.json", "green"))
 
 
 if __name__ == "__main__":
-    topic = input("Enter the topic for your video : ")
-    Videographer(topic).process()
+    parser = argparse.ArgumentParser(
+        description="Generate a short video about a topic."
+    )
+    parser.add_argument(
+        "--preview",
+        nargs="?",
+        const=True,
+        metavar="PROJECT",
+        help="render a fast low resolution draft, and save its timeline, or "
+        "render the draft of a project again from its timeline",
+    )
+    parser.add_argument(
+        "--final",
+        metavar="PROJECT",
+        help="render the final video of a previewed project from its timeline",
+    )
+    args = parser.parse_args()
+
+    if args.final:
+        Videographer(None, project_space=args.final).render_timeline("final")
+    elif isinstance(args.preview, str):
+        Videographer(None, project_space=args.preview).render_timeline("preview")
+    else:
+        topic = input("Enter the topic for your video : ")
+        videographer = Videographer(topic)
+        if args.preview:
+            videographer.render_mode = "preview"
+        videographer.process()
 
     # topic = "3 reasons rust is better than python"
     # Videographer(
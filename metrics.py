@@ -0,0 +1,377 @@
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Counters every run report contains, even when they stay at zero
+COUNTERS = [
+    "api_calls",
+    "retries",
+    "bytes_downloaded",
+    "bytes_uploaded",
+    "cache_hits",
+    "cache_misses",
+    "frames_encoded",
+    "bytes_piped",
+    "pipe_blocked_ms",
+    "decode_wait_ms",
+]
+
+
+def _high_water_mark() -> int:
+    """
+    Returns the peak resident set size of this process since it started or
+    since the last `reset_peak_rss`, in bytes, or None where /proc is not
+    available.
+    """
+
+    try:
+        with open("/proc/self/status", "r", encoding="utf-8") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+def reset_peak_rss() -> bool:
+    """
+    Resets the peak resident set size of this process to its current
+    resident set size, on Linux.
+
+    Returns:
+        bool: Whether the peak was reset. Elsewhere `peak_rss` keeps
+            reporting the peak since the process started.
+    """
+
+    try:
+        with open("/proc/self/clear_refs", "w", encoding="utf-8") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _high_water_mark() is not None
+
+
+def peak_rss() -> dict:
+    """
+    Returns the peak resident set size of this process and of its waited-for
+    children (ffmpeg), in bytes, or None where it cannot be measured.
+
+    The peak of this process is its own high-water mark since the last
+    `reset_peak_rss`. ru_maxrss is only a fallback: it survives exec, so a
+    process spawned by a large parent starts with the parent's peak.
+    """
+
+    if resource is None:
+        return {"self": _high_water_mark(), "children": None}
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    high_water_mark = _high_water_mark()
+    return {
+        "self": (
+            high_water_mark
+            if high_water_mark is not None
+            else resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+        ),
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * scale,
+    }
+
+
+def cpu_time() -> float:
+    """
+    Returns the CPU time used by this process and its waited-for children.
+    """
+
+    if resource is None:
+        return time.process_time()
+
+    usage_self = resource.getrusage(resource.RUSAGE_SELF)
+    usage_children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return (
+        usage_self.ru_utime
+        + usage_self.ru_stime
+        + usage_children.ru_utime
+        + usage_children.ru_stime
+    )
+
+
+def _escape_label(value) -> str:
+    """
+    Escapes a Prometheus label value.
+    """
+
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class RunMetrics:
+    """
+    Collects the timing, resource and I/O metrics of a video creation run.
+
+    Stages and external calls are measured with the `stage` and `call`
+    context managers, everything else is a named counter. Counters are
+    attributed to the run and to the stage that is running.
+    """
+
+    def __init__(self):
+        self.started = time.time()
+        self.counters = Counter({name: 0 for name in COUNTERS})
+        self.stages = {}
+        self.calls = {}
+
+        self._lock = threading.Lock()
+        self._stage_stack = []
+        # The peak memory of the process before the last reset, for the run
+        # and for every running stage, by id of its record
+        self._run_peak = 0
+        self._stage_peaks = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        """
+        Measures the wall time, CPU time, peak memory and counters of a stage.
+
+        The peak memory of the process is the high-water mark of the stage
+        itself where it can be reset (Linux), the peak since the process
+        started elsewhere. The peak of the children is the largest ffmpeg
+        waited for so far, by this stage or an earlier one.
+        """
+
+        record = {
+            "wall_time": 0.0,
+            "cpu_time": 0.0,
+            "peak_rss": None,
+            "status": "running",
+            "counters": Counter(),
+        }
+        with self._lock:
+            self._fold_peak()
+            self.stages[name] = record
+            self._stage_stack.append(record)
+            self._stage_peaks[id(record)] = 0
+
+        wall_start, cpu_start = time.perf_counter(), cpu_time()
+        try:
+            yield record
+            record["status"] = "ok"
+        except BaseException:
+            record["status"] = "error"
+            raise
+        finally:
+            record["wall_time"] = time.perf_counter() - wall_start
+            record["cpu_time"] = cpu_time() - cpu_start
+            with self._lock:
+                self._fold_peak()
+                self._stage_stack.remove(record)
+                record["peak_rss"] = {
+                    "self": self._stage_peaks.pop(id(record)) or None,
+                    "children_so_far": peak_rss()["children"],
+                }
+
+    @contextmanager
+    def call(self, name: str):
+        """
+        Measures an external call (API request, download, upload).
+        """
+
+        self.count("api_calls")
+        start = time.perf_counter()
+        failed = False
+        try:
+            yield
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                stats = self.calls.setdefault(
+                    name, {"count": 0, "errors": 0, "wall_time": 0.0}
+                )
+                stats["count"] += 1
+                stats["errors"] += int(failed)
+                stats["wall_time"] += elapsed
+
+    def _fold_peak(self) -> None:
+        """
+        Folds the peak memory since the last reset into the peaks of the run
+        and of the running stages, then resets it, so that the next stage
+        measures its own. Called with the lock held.
+        """
+
+        current = peak_rss()["self"]
+        if current is None:
+            return
+
+        self._run_peak = max(self._run_peak, current)
+        for key, peak in self._stage_peaks.items():
+            self._stage_peaks[key] = max(peak, current)
+        reset_peak_rss()
+
+    def count(self, name: str, value: int = 1) -> None:
+        """
+        Increments a counter of the run and of the running stage.
+        """
+
+        with self._lock:
+            self.counters[name] += value
+            if self._stage_stack:
+                self._stage_stack[-1]["counters"][name] += value
+
+    def to_dict(self) -> dict:
+        """
+        Returns the run report as a JSON serializable dict.
+        """
+
+        with self._lock:
+            current = peak_rss()
+            if current["self"] is not None:
+                current["self"] = max(self._run_peak, current["self"])
+            return {
+                "started": self.started,
+                "wall_time": time.time() - self.started,
+                "cpu_time": cpu_time(),
+                "peak_rss": current,
+                "counters": dict(self.counters),
+                "stages": {
+                    name: {**record, "counters": dict(record["counters"])}
+                    for name, record in self.stages.items()
+                },
+                "calls": {name: dict(stats) for name, stats in self.calls.items()},
+            }
+
+    def write_json(self, path: str) -> None:
+        """
+        Writes the run report as JSON.
+        """
+
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def to_prometheus(self, labels: dict = None) -> str:
+        """
+        Returns the run report in the Prometheus text exposition format.
+
+        Args:
+            labels (dict): Labels added to every sample, e.g. the project id.
+        """
+
+        report = self.to_dict()
+        base_labels = dict(labels or {})
+        lines = []
+
+        def sample(metric, value, **extra):
+            if value is None:
+                return
+            all_labels = {**base_labels, **extra}
+            if not all_labels:
+                lines.append(f"{metric} {value}")
+                return
+            label_text = ",".join(
+                f'{key}="{_escape_label(val)}"' for key, val in all_labels.items()
+            )
+            lines.append(f"{metric}{{{label_text}}} {value}")
+
+        def header(metric, metric_type, text):
+            lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+
+        header("video_creator_run_wall_seconds", "gauge", "Wall time of the run.")
+        sample("video_creator_run_wall_seconds", report["wall_time"])
+        header("video_creator_run_cpu_seconds", "gauge", "CPU time of the run.")
+        sample("video_creator_run_cpu_seconds", report["cpu_time"])
+        header("video_creator_peak_rss_bytes", "gauge", "Peak resident set size.")
+        sample("video_creator_peak_rss_bytes", report["peak_rss"]["self"], process="self")
+        sample(
+            "video_creator_peak_rss_bytes",
+            report["peak_rss"]["children"],
+            process="children",
+        )
+
+        header("video_creator_total", "counter", "Counters of the run.")
+        for name, value in sorted(report["counters"].items()):
+            sample("video_creator_total", value, name=name)
+
+        header("video_creator_stage_wall_seconds", "gauge", "Wall time per stage.")
+        for name, record in report["stages"].items():
+            sample("video_creator_stage_wall_seconds", record["wall_time"], stage=name)
+        header("video_creator_stage_cpu_seconds", "gauge", "CPU time per stage.")
+        for name, record in report["stages"].items():
+            sample("video_creator_stage_cpu_seconds", record["cpu_time"], stage=name)
+
+        header("video_creator_calls_total", "counter", "External calls.")
+        for name, stats in report["calls"].items():
+            sample("video_creator_calls_total", stats["count"], call=name)
+        header("video_creator_call_errors_total", "counter", "Failed external calls.")
+        for name, stats in report["calls"].items():
+            sample("video_creator_call_errors_total", stats["errors"], call=name)
+        header("video_creator_call_seconds_total", "counter", "Time in external calls.")
+        for name, stats in report["calls"].items():
+            sample("video_creator_call_seconds_total", stats["wall_time"], call=name)
+
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path: str, labels: dict = None) -> None:
+        """
+        Writes the run report in the Prometheus text format, atomically so
+        that a textfile collector never reads a partial file.
+        """
+
+        with open(f"{path}.part", "w", encoding="utf-8") as f:
+            f.write(self.to_prometheus(labels))
+        os.replace(f"{path}.part", path)
+
+
+# The metrics of the run in progress, used by the module level helpers
+_current = RunMetrics()
+
+
+def get_metrics() -> RunMetrics:
+    """
+    Returns the metrics of the run in progress.
+    """
+
+    return _current
+
+
+def set_metrics(run_metrics: RunMetrics) -> None:
+    """
+    Makes `run_metrics` the metrics of the run in progress.
+    """
+
+    global _current
+
+    _current = run_metrics
+
+
+def stage(name: str):
+    """
+    Measures a stage of the run in progress.
+    """
+
+    return _current.stage(name)
+
+
+def call(name: str):
+    """
+    Measures an external call of the run in progress.
+    """
+
+    return _current.call(name)
+
+
+def count(name: str, value: int = 1) -> None:
+    """
+    Increments a counter of the run in progress.
+    """
+
+    _current.count(name, value)
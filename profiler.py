@@ -0,0 +1,326 @@
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import TYPE_CHECKING, List
+
+from termcolor import colored
+
+from encoder import write_clip
+
+if TYPE_CHECKING:
+    from moviepy.Clip import Clip
+
+
+def _is_clip(value) -> bool:
+    # moviepy is only imported once a clip exists, i.e. when rendering
+    from moviepy.Clip import Clip
+
+    return isinstance(value, Clip)
+
+
+def clip_label(clip: "Clip") -> str:
+    """
+    Returns a readable label for a clip of the render tree, e.g.
+    "VideoClip[resize]" or "VideoFileClip[a1b2.mp4]".
+    """
+
+    label = type(clip).__name__
+
+    # Clips derived with `fl` render through a closure over the effect.
+    # Copies of a file clip keep its filename, so effects are checked first.
+    effect = _effect_name(clip.make_frame)
+    if effect:
+        return f"{label}[{effect}]"
+
+    filename = getattr(clip, "filename", None)
+    if isinstance(filename, str):
+        return f"{label}[{os.path.basename(filename)}]"
+
+    return label
+
+
+def _function_name(function) -> str:
+    """
+    Returns the name of the module level function that defined `function`,
+    e.g. "crop" for a lambda created inside `crop`, or None for methods.
+    """
+
+    name = getattr(function, "__qualname__", "").split(".<locals>")[0]
+    if not name or "." in name or name == "<lambda>":
+        return None
+    return name
+
+
+def _effect_name(function, depth: int = 3) -> str:
+    """
+    Finds the name of the effect function wrapped by moviepy's
+    `fl`/`fl_image` lambdas, looking a few closures deep.
+    """
+
+    name = _function_name(function)
+    if name or depth == 0:
+        return name
+
+    for cell in getattr(function, "__closure__", None) or []:
+        try:
+            value = cell.cell_contents
+        except ValueError:
+            continue
+        if callable(value) and not _is_clip(value):
+            name = _effect_name(value, depth - 1)
+            if name:
+                return name
+
+    return None
+
+
+def clip_children(clip: "Clip") -> List["Clip"]:
+    """
+    Returns the clips a clip reads its frames from.
+
+    Composites keep their layers in `clips` and `bg`, while clips made by
+    `fl` effects and chained concatenations only reference their sources
+    from the closure of their `make_frame`.
+    """
+
+    children = []
+
+    def collect(value):
+        if _is_clip(value):
+            children.append(value)
+        elif isinstance(value, (list, tuple)):
+            for item in value:
+                if _is_clip(item):
+                    children.append(item)
+
+    collect(getattr(clip, "bg", None))
+    collect(getattr(clip, "clips", None))
+    collect(getattr(clip, "mask", None))
+
+    for cell in getattr(clip.make_frame, "__closure__", None) or []:
+        try:
+            collect(cell.cell_contents)
+        except ValueError:
+            continue
+
+    return [child for child in children if child is not clip]
+
+
+class RenderProfiler:
+    """
+    Opt-in profiler of a moviepy render.
+
+    Every clip of the render tree gets its `get_frame` wrapped for the
+    duration of the profile, recording the time spent in each node per
+    frame. The time spent in `write_videofile` outside of the root clip is
+    attributed to the encoder (ffmpeg pipe, audio and file I/O).
+
+    Usage:
+        with RenderProfiler(clip, "final_video") as profiler:
+            clip.write_videofile(path)
+        profiler.write(f"{project_space}/profiles")
+    """
+
+    ENCODER = "write_videofile"
+
+    def __init__(self, clip: "Clip", name: str = "render"):
+        self.clip = clip
+        self.name = name
+        self.wall_time = 0.0
+
+        self._nodes = []
+        self._local = threading.local()
+        # node id -> [calls, inclusive seconds, exclusive seconds]
+        self._stats = defaultdict(lambda: [0, 0.0, 0.0])
+        # folded stack -> exclusive seconds
+        self._stacks = defaultdict(float)
+        self._labels = {}
+
+    def __enter__(self):
+        self._wrap(self.clip)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_time = time.perf_counter() - self._start
+        for node in self._nodes:
+            # Remove the instance attribute, falling back to Clip.get_frame
+            node.__dict__.pop("get_frame", None)
+        self._nodes = []
+
+    def _wrap(self, root: "Clip") -> None:
+        seen = set()
+        pending = [root]
+
+        while pending:
+            node = pending.pop()
+            if id(node) in seen:
+                continue
+            seen.add(id(node))
+
+            self._labels[id(node)] = f"{clip_label(node)}#{len(self._labels)}"
+            node.get_frame = self._timed(node, node.get_frame)
+            self._nodes.append(node)
+            pending.extend(clip_children(node))
+
+    def _timed(self, node: "Clip", get_frame):
+        node_id = id(node)
+        label = self._labels[node_id]
+
+        def timed_get_frame(t):
+            stack = getattr(self._local, "stack", None)
+            if stack is None:
+                stack = self._local.stack = []
+
+            # Each frame on the stack: [label, seconds spent in children]
+            stack.append([label, 0.0])
+            start = time.perf_counter()
+            try:
+                return get_frame(t)
+            finally:
+                elapsed = time.perf_counter() - start
+                _, children_time = stack.pop()
+                exclusive = elapsed - children_time
+
+                stats = self._stats[node_id]
+                stats[0] += 1
+                stats[1] += elapsed
+                stats[2] += exclusive
+
+                path = ";".join([self.name] + [entry[0] for entry in stack] + [label])
+                self._stacks[path] += exclusive
+                if stack:
+                    stack[-1][1] += elapsed
+
+        return timed_get_frame
+
+    def _encoder_time(self) -> float:
+        """
+        Returns the time spent in `write_videofile` outside of the clip tree.
+        """
+
+        return max(0.0, self.wall_time - self._stats[id(self.clip)][1])
+
+    def summary(self) -> dict:
+        """
+        Returns the profile as a JSON serializable dict, with the nodes
+        sorted by their exclusive time.
+        """
+
+        frames = self._stats[id(self.clip)][0]
+        encoder_time = self._encoder_time()
+
+        nodes = []
+        for node_id, (calls, inclusive, exclusive) in self._stats.items():
+            if not calls:
+                continue
+            nodes.append(
+                {
+                    "node": self._labels[node_id],
+                    "calls": calls,
+                    "inclusive_time": inclusive,
+                    "exclusive_time": exclusive,
+                    "time_per_frame": exclusive / frames if frames else 0.0,
+                    "frames_per_second": calls / inclusive if inclusive else None,
+                }
+            )
+        nodes.append(
+            {
+                "node": self.ENCODER,
+                "calls": frames,
+                "inclusive_time": encoder_time,
+                "exclusive_time": encoder_time,
+                "time_per_frame": encoder_time / frames if frames else 0.0,
+                "frames_per_second": None,
+            }
+        )
+        nodes.sort(key=lambda node: node["exclusive_time"], reverse=True)
+
+        return {
+            "name": self.name,
+            "wall_time": self.wall_time,
+            "frames": frames,
+            "frames_per_second": frames / self.wall_time if self.wall_time else None,
+            "nodes": nodes,
+        }
+
+    def folded_stacks(self) -> str:
+        """
+        Returns the profile in the folded stack format read by flamegraph.pl
+        and speedscope, with the time in microseconds.
+        """
+
+        lines = [
+            f"{path} {round(seconds * 1e6)}" for path, seconds in self._stacks.items()
+        ]
+        lines.append(f"{self.name};{self.ENCODER} {round(self._encoder_time() * 1e6)}")
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, directory: str) -> str:
+        """
+        Writes the JSON summary and the folded stacks of the profile.
+
+        Returns:
+            str: The path to the JSON summary.
+        """
+
+        os.makedirs(directory, exist_ok=True)
+        summary_path = os.path.join(directory, f"{self.name}.json")
+
+        with open(summary_path, "w", encoding="utf-8") as f:
+            json.dump(self.summary(), f, indent=2)
+        with open(os.path.join(directory, f"{self.name}.folded"), "w") as f:
+            f.write(self.folded_stacks())
+
+        return summary_path
+
+    def print_summary(self, top: int = 8) -> None:
+        """
+        Prints the nodes with the most exclusive time.
+        """
+
+        summary = self.summary()
+        print(
+            colored(
+                f"[+] Render profile '{self.name}': {summary['frames']} frames "
+                f"in {summary['wall_time']:.1f}s",
+                "blue",
+            )
+        )
+        for node in summary["nodes"][:top]:
+            share = node["exclusive_time"] / summary["wall_time"] if summary["wall_time"] else 0
+            print(
+                colored(
+                    f"\t=> {node['node']}: {node['exclusive_time']:.2f}s "
+                    f"({share:.0%}), {node['time_per_frame'] * 1000:.1f}ms/frame",
+                    "cyan",
+                )
+            )
+
+
+def write_videofile(clip: "Clip", path: str, profile_dir: str = None, name: str = None, **kwargs):
+    """
+    Writes a clip with `encoder.write_clip`, profiling the render when
+    `profile_dir` is given.
+
+    Args:
+        clip (Clip): The clip to render.
+        path (str): The output path.
+        profile_dir (str): Where to write the profile, or None to not profile.
+        name (str): The name of the profile, defaults to the output file name.
+        **kwargs: Passed to `write_clip`.
+    """
+
+    if not profile_dir:
+        write_clip(clip, path, **kwargs)
+        return
+
+    name = name or os.path.splitext(os.path.basename(path))[0]
+    with RenderProfiler(clip, name) as profiler:
+        write_clip(clip, path, **kwargs)
+
+    profiler.print_summary()
+    profiler.write(profile_dir)
@@ -0,0 +1,84 @@
+from typing import List
+
+# Output profiles are written to this folder of the project space
+PROFILES_FOLDER = "outputs"
+
+# Encoder settings of a profile that are not given in the config
+DEFAULT_PROFILE = {
+    "preset": "medium",
+    "crf": None,
+    "bitrate": None,
+    "subtitles": {},
+}
+
+
+def load_profiles(profiles: List[dict]) -> List[dict]:
+    """
+    Validates the output profiles of the config and fills in their defaults.
+
+    A profile has a "name", an output "size" ([width, height], whose ratio
+    is the aspect of the profile), and optionally a x264 "preset", a "crf"
+    or a "bitrate" (e.g. "800k"), and "subtitles" overriding the subtitle
+    style, e.g. {"position": ["center", "bottom"], "fontsize": 60}.
+
+    Returns:
+        List[dict]: The complete profiles.
+    """
+
+    loaded = []
+    for profile in profiles or []:
+        if "name" not in profile or "size" not in profile:
+            raise ValueError(f"Output profiles need a name and a size: {profile}")
+        if profile.get("crf") is not None and profile.get("bitrate"):
+            raise ValueError(f"Set either a crf or a bitrate: {profile['name']}")
+
+        width, height = profile["size"]
+        loaded.append(
+            {
+                **DEFAULT_PROFILE,
+                **profile,
+                # yuv420p needs even dimensions
+                "size": [width - width % 2, height - height % 2],
+            }
+        )
+
+    names = [profile["name"] for profile in loaded]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Output profile names must be unique: {names}")
+
+    return loaded
+
+
+def profile_path(project_space: str, profile: dict) -> str:
+    """
+    Returns the path of the video rendered for a profile.
+    """
+
+    return f"{project_space}/{PROFILES_FOLDER}/{profile['name']}.mp4"
+
+
+def profile_style(style: dict, profile: dict, timeline_size: List[int]) -> dict:
+    """
+    Returns the subtitle style of a profile: the style of the timeline, with
+    the font scaled to the profile size and the overrides of the profile.
+    """
+
+    scale = min(profile["size"]) / min(timeline_size)
+    return {
+        **style,
+        "fontsize": round(style["fontsize"] * scale),
+        **profile["subtitles"],
+    }
+
+
+def profile_encoder_options(profile: dict) -> dict:
+    """
+    Returns the `FrameWriter` arguments of a profile.
+    """
+
+    options = {"preset": profile["preset"]}
+    if profile["bitrate"]:
+        options["bitrate"] = profile["bitrate"]
+    elif profile["crf"] is not None:
+        options["ffmpeg_params"] = ["-crf", str(profile["crf"])]
+    return options
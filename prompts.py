@@ -1,23 +1,42 @@
+import base64
 import json
 import os
 import re
-from io import BytesIO
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Tuple
 
 # import g4f
-import openai
-import requests
-from PIL import Image
 from termcolor import colored
 
+import metrics
+
 # import google.generativeai as genai
 
 # Set environment variables
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-openai.api_key = OPENAI_API_KEY
 # GOOGLE_API_KEY = os.getenv('GOOGLE_API_KEY')
 # genai.configure(api_key=GOOGLE_API_KEY)
 
+# Settings of the generated images
+IMAGE_MODEL = "dall-e-3"
+IMAGE_SIZE = "1024x1792"
+IMAGE_QUALITY = "standard"
+
+
+def _openai():
+    """
+    Imports the OpenAI SDK on first use: it is the slowest import of the
+    project, and a run resumed after the LLM stages never needs it.
+    """
+
+    import openai
+
+    if openai.api_key is None:
+        openai.api_key = OPENAI_API_KEY
+    return openai
+
 
 def generate_response(prompt: str, ai_model: str) -> str:
     """
@@ -51,14 +70,15 @@ def generate_response(prompt: str, ai_model: str) -> str:
             "gpt-3.5-turbo" if ai_model == "gpt3.5-turbo" else "gpt-4-1106-preview"
         )
 
-        response = (
-            openai.chat.completions.create(
-                model=model_name,
-                messages=[{"role": "user", "content": prompt}],
+        with metrics.call("openai_chat"):
+            response = (
+                _openai().chat.completions.create(
+                    model=model_name,
+                    messages=[{"role": "user", "content": prompt}],
+                )
+                .choices[0]
+                .message.content
             )
-            .choices[0]
-            .message.content
-        )
     elif ai_model == "gemmini":
         # model = genai.GenerativeModel('gemini-pro')
         # response_model = model.generate_content(prompt)
@@ -359,23 +379,104 @@ def generate_metadata(
     return title, description, keywords
 
 
-def generate_images(openai_key, prompt_list, project_space):
+def generate_images(
+    openai_key: str,
+    prompt_list: List[str],
+    project_space: str,
+    max_workers: int = 4,
+    retries: int = 3,
+    image_store=None,
+) -> List[str]:
     """
     Generate images for a video, depending on the subject of the video.
     Subsequently, save the images to the images folder in the project space.
+
+    Images are generated concurrently (at most `max_workers` requests in flight)
+    and each one is retried up to `retries` times. The file names are derived
+    from the prompt index, so the order of the prompts is preserved on disk.
+
+    Args:
+        openai_key (str): The OpenAI API key.
+        prompt_list (List[str]): The prompts to generate images for.
+        project_space (str): The project folder to save the images to.
+        max_workers (int): The maximum number of concurrent generations.
+        retries (int): The number of attempts per image.
+        image_store (ImageStore): Optional library of previously generated
+            images, reused instead of calling the API when a prompt matches.
+
+    Returns:
+        List[str]: The paths of the saved images, in prompt order.
     """
 
-    # Build prompt
     print(colored("[+] Generating Images ...\n", "green"))
 
-    # Generate images
-    # Call the API
-    client = openai.OpenAI(api_key=openai_key)
-    urls = []
+    client = _openai().OpenAI(api_key=openai_key)
+    images_dir = f"{project_space}/images"
+    results = [None] * len(prompt_list)
 
+    # Reuse stored images first, only the remaining prompts hit the API
+    pending = []
     for i, prompt in enumerate(prompt_list):
+        stored_path = (
+            image_store.lookup(prompt, IMAGE_MODEL, IMAGE_SIZE, IMAGE_QUALITY)
+            if image_store
+            else None
+        )
+        if stored_path:
+            results[i] = image_path(images_dir, i)
+            shutil.copyfile(stored_path, results[i])
+            print(colored(f"[+] Reused stored image for prompt: {prompt}", "green"))
+        else:
+            pending.append(i)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {
+            executor.submit(
+                _generate_image,
+                client,
+                prompt_list[i],
+                image_path(images_dir, i),
+                retries,
+            ): i
+            for i in pending
+        }
+        for future in as_completed(futures):
+            i = futures[future]
+            results[i] = future.result()
+            if results[i] and image_store:
+                image_store.add(
+                    prompt_list[i], IMAGE_MODEL, IMAGE_SIZE, IMAGE_QUALITY, results[i]
+                )
+
+    saved_paths = [path for path in results if path]
 
-        final_prompt = f"""
+    print(
+        colored(
+            f"[+] Generated {len(saved_paths)}/{len(prompt_list)} images.", "green"
+        )
+    )
+
+    return saved_paths
+
+
+def image_path(images_dir: str, index: int) -> str:
+    """
+    Returns the path of the image generated for the prompt at `index`.
+    The index is zero padded so that lexical and prompt order agree.
+    """
+
+    return f"{images_dir}/{index:03d}.png"
+
+
+def _generate_image(client, prompt: str, path: str, retries: int) -> str:
+    """
+    Generate a single image and write the returned PNG bytes straight to disk.
+
+    Returns:
+        str: The path to the saved image, or None if every attempt failed.
+    """
+
+    final_prompt = f"""
         Generate an image for {prompt}
         
         THERE SHOULDN'T BE ANY TEXT IN THE IMAGE
@@ -384,26 +485,45 @@ def generate_images(openai_key, prompt_list, project_space):
 
         """
 
-        try:
-
-            response = client.images.generate(
-                model="dall-e-3",
-                prompt=final_prompt,
-                size="1024x1792",
-                quality="standard",
-                n=1,
-            )
+    for attempt in range(1, retries + 1):
+        if attempt > 1:
+            metrics.count("retries")
 
-            # Return the generated images
-            if response:
-                image_data = requests.get(response.data[0].url, timeout=300)
-                Image.open(BytesIO(image_data.content)).save(
-                    f"{project_space}/images/{i}.png"
+        try:
+            with metrics.call("openai_image"):
+                response = client.images.generate(
+                    model=IMAGE_MODEL,
+                    prompt=final_prompt,
+                    size=IMAGE_SIZE,
+                    quality=IMAGE_QUALITY,
+                    response_format="b64_json",
+                    n=1,
                 )
-                urls.append(response.data[0].url)
-                print(colored(f"[+] Image generated for prompt: {prompt}", "green"))
-                print(colored("[+] Image saved!\n", "green"))
-            else:
+
+            if not response or not response.data:
                 print(colored("[-] DALL-E returned an empty response.", "red"))
+                continue
+
+            # Write to a temporary file first, so a half written image
+            # is never picked up by the video stage
+            image_data = base64.b64decode(response.data[0].b64_json)
+            metrics.count("bytes_downloaded", len(image_data))
+
+            tmp_path = f"{path}.part"
+            with open(tmp_path, "wb") as f:
+                f.write(image_data)
+            os.replace(tmp_path, path)
+
+            print(colored(f"[+] Image generated for prompt: {prompt}", "green"))
+            return path
         except Exception as e:
-            print(colored(f"[-] Error generating image: {e}", "red"))
+            print(
+                colored(
+                    f"[-] Error generating image (attempt {attempt}/{retries}): {e}",
+                    "red",
+                )
+            )
+            if attempt < retries:
+                time.sleep(2**attempt)
+
+    return None
@@ -0,0 +1,294 @@
+import subprocess
+import threading
+import time
+from typing import List
+
+import metrics
+
+# The next source of the video track starts decoding this many seconds
+# before the cut, so its first frames are ready when the cut comes
+PREOPEN_SECONDS = 1.0
+
+# Moviepy seeks instead of decoding forward past this many frames
+MAX_SKIPPED_FRAMES = 100
+
+
+class ReadAheadReader:
+    """
+    Decodes the frames of a video file on a background thread, ahead of the
+    frames asked for, into a ring of `capacity` preallocated frames.
+
+    moviepy's reader only decodes a frame when it is asked for it: the
+    compositor waits on ffmpeg, and ffmpeg waits on the compositor. Here,
+    ffmpeg keeps decoding while the previous frames are composited and
+    encoded, until the ring is full.
+
+    Frames are looked up like moviepy does, by their index at time t, so
+    the same frames are shown. The frame returned stays valid until the
+    next one is asked for; it is read-only.
+
+    Readers of consecutive segments are chained with `next`: a reader opens
+    the next one `PREOPEN_SECONDS` before its end, and the next one closes
+    it when it is first read from.
+    """
+
+    def __init__(
+        self, path: str, start: float = 0.0, end: float = None, capacity: int = 8
+    ):
+        from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+        infos = ffmpeg_parse_infos(path)
+        self.path = path
+        self.fps = infos["video_fps"]
+        self.size = tuple(infos["video_size"])
+        self.duration = infos["video_duration"]
+        self.start = start
+        self.end = self.duration if end is None else end
+        self.capacity = max(2, capacity)
+
+        self.next = None
+        self.previous = None
+
+        self._condition = threading.Condition()
+        self._slots = None
+        self._positions = [0] * self.capacity
+        self._process = None
+        self._thread = None
+        self._stopping = False
+        self._finished = False
+        self._error = None
+        # Frames decoded, and frames handed over or skipped, since opening
+        self._written = 0
+        self._read = 0
+        self._current = None
+        self._current_position = None
+
+    def position(self, t: float) -> int:
+        """
+        Returns the index of the frame shown at t, like moviepy's reader.
+        """
+
+        return int(self.fps * t + 0.00001) + 1
+
+    def open(self, t: float = None) -> None:
+        """
+        Starts decoding from t (the start of the reader by default), unless
+        it is decoding already.
+        """
+        import numpy
+        from moviepy.config import get_setting
+
+        if self._thread is not None:
+            return
+
+        t = self.start if t is None else t
+        width, height = self.size
+        if self._slots is None:
+            self._slots = numpy.empty(
+                (self.capacity, height, width, 3), dtype=numpy.uint8
+            )
+
+        # Same command as moviepy's reader, for the same pixels
+        if t != 0:
+            offset = min(1, t)
+            input_args = ["-ss", "%.06f" % (t - offset), "-i", self.path]
+            input_args += ["-ss", "%.06f" % offset]
+        else:
+            input_args = ["-i", self.path]
+        command = (
+            [get_setting("FFMPEG_BINARY")]
+            + input_args
+            + ["-loglevel", "error", "-f", "image2pipe"]
+            + ["-vf", f"scale={width}:{height}", "-sws_flags", "bicubic"]
+            + ["-pix_fmt", "rgb24", "-vcodec", "rawvideo", "-"]
+        )
+        self._process = subprocess.Popen(
+            command,
+            bufsize=0,
+            stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+        )
+
+        self._stopping = self._finished = False
+        self._error = None
+        self._written = self._read = 0
+        self._thread = threading.Thread(
+            target=self._decode,
+            args=(self._process, self.position(t)),
+            daemon=True,
+        )
+        self._thread.start()
+
+    def _decode(self, process, first_position: int) -> None:
+        """
+        Reads the frames of the ffmpeg process into the ring, in order.
+        """
+
+        try:
+            position = first_position
+            while True:
+                with self._condition:
+                    # The slot of the frame the consumer holds is kept
+                    while (
+                        self._written >= self._read + self.capacity - 1
+                        and not self._stopping
+                    ):
+                        self._condition.wait()
+                    if self._stopping:
+                        return
+                    slot = self._written % self.capacity
+
+                view = memoryview(self._slots[slot]).cast("B")
+                filled = 0
+                while filled < len(view):
+                    read = process.stdout.readinto(view[filled:])
+                    if not read:
+                        break
+                    filled += read
+
+                with self._condition:
+                    if filled < len(view):
+                        self._finished = True
+                        self._condition.notify_all()
+                        return
+                    self._positions[slot] = position
+                    self._written += 1
+                    self._condition.notify_all()
+                position += 1
+        except Exception as error:
+            with self._condition:
+                self._error = error
+                self._finished = True
+                self._condition.notify_all()
+
+    def get_frame(self, t: float):
+        """
+        Returns the frame of the file shown at t.
+        """
+
+        if self.previous is not None:
+            self.previous.close()
+            self.previous = None
+        if self.next is not None and t >= self.end - PREOPEN_SECONDS:
+            self.next.open()
+
+        position = self.position(t)
+        if position == self._current_position:
+            return self._current
+
+        if (
+            self._thread is None
+            or position < (self._current_position or 0)
+            or position > self._first_available() + MAX_SKIPPED_FRAMES
+        ):
+            self.close()
+            self.open(t)
+
+        waited = 0.0
+        with self._condition:
+            while True:
+                while self._read == self._written and not self._finished:
+                    start = time.perf_counter()
+                    self._condition.wait()
+                    waited += time.perf_counter() - start
+
+                if self._read == self._written:
+                    # Past the last frame of the file: like moviepy, keep
+                    # showing the last frame
+                    if self._error is not None:
+                        raise self._error
+                    if self._current is None:
+                        raise IOError(f"Could not decode a frame of {self.path}")
+                    break
+
+                slot = self._read % self.capacity
+                self._read += 1
+                self._condition.notify_all()
+                if self._positions[slot] < position:
+                    continue
+
+                self._current = self._slots[slot]
+                self._current.flags.writeable = False
+                self._current_position = self._positions[slot]
+                break
+
+        if waited:
+            metrics.count("decode_wait_ms", round(waited * 1000))
+        return self._current
+
+    def _first_available(self) -> int:
+        """
+        Returns the index of the next frame to be handed over.
+        """
+
+        with self._condition:
+            if self._read < self._written:
+                return self._positions[self._read % self.capacity]
+        if self._current_position is not None:
+            return self._current_position + 1
+        return self.position(self.start)
+
+    def close(self) -> None:
+        """
+        Stops decoding. The reader opens again if it is read from.
+        """
+
+        if self._thread is None:
+            return
+
+        with self._condition:
+            self._stopping = True
+            self._condition.notify_all()
+        self._process.kill()
+        self._thread.join()
+        self._process.stdout.close()
+        self._process.wait()
+
+        self._thread = self._process = None
+        self._current = self._current_position = None
+        # Frames handed over stay valid: the next ring is a new one
+        self._slots = None
+
+
+def read_ahead_clip(
+    path: str, start: float = 0.0, end: float = None, capacity: int = 8
+):
+    """
+    Returns the clip of [start, end) of a video file, without its audio,
+    decoded ahead by a `ReadAheadReader`. The reader is the `reader`
+    attribute of the clip.
+    """
+    from moviepy.editor import VideoClip
+
+    reader = ReadAheadReader(path, start, end, capacity)
+
+    # Setting make_frame directly: the constructor would read the first
+    # frame to find the size, opening the reader before its time
+    clip = VideoClip(duration=reader.end - start)
+    clip.make_frame = lambda t: reader.get_frame(start + t)
+    clip.size = reader.size
+    clip.fps = reader.fps
+    clip.reader = reader
+
+    return clip
+
+
+def chain_readers(readers: List[ReadAheadReader]) -> None:
+    """
+    Chains the readers of consecutive segments, so that each one opens the
+    next before its end, and is closed by it.
+    """
+
+    for reader, next_reader in zip(readers, readers[1:]):
+        reader.next = next_reader
+        next_reader.previous = reader
+
+
+def close_readers(readers: List[ReadAheadReader]) -> None:
+    """
+    Stops the readers still decoding, e.g. after a failed render.
+    """
+
+    for reader in readers:
+        reader.close()
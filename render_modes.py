@@ -0,0 +1,73 @@
+from typing import List
+
+# Encoder settings of the render modes. The final mode keeps the size and
+# frame rate of the timeline and the default x264 settings of moviepy; the
+# preview renders the same timeline at half the resolution and frame rate.
+# The segmented renderer encodes and caches chunks of `segment_seconds`, and
+# frames are piped to ffmpeg in `pipe_format` ("yuv420p" or "rgb24"). Source
+# videos are decoded up to `read_ahead_frames` ahead on background threads,
+# 0 decoding them on demand.
+RENDER_MODES = {
+    "final": {
+        "scale": 1,
+        "fps": None,
+        "preset": "medium",
+        "crf": None,
+        "segment_seconds": 2,
+        "pipe_format": "rgb24",
+        "read_ahead_frames": 8,
+    },
+    "preview": {
+        "scale": 0.5,
+        "fps": 15,
+        "preset": "ultrafast",
+        "crf": 30,
+        "segment_seconds": 2,
+        "pipe_format": "rgb24",
+        "read_ahead_frames": 8,
+    },
+}
+
+# Output files of every render mode, relative to the project space
+OUTPUT_FILES = {
+    "final": {"raw_video": "videos/final_raw.mp4", "output": "output.mp4"},
+    "preview": {"raw_video": "videos/preview_raw.mp4", "output": "preview.mp4"},
+}
+
+
+def render_settings(mode: str) -> dict:
+    """
+    Returns the encoder settings of a render mode.
+    """
+
+    if mode not in RENDER_MODES:
+        raise ValueError(f"Invalid render mode: {mode}")
+    return RENDER_MODES[mode]
+
+
+def output_path(project_space: str, mode: str, kind: str) -> str:
+    """
+    Returns the path of the raw video ("raw_video") or of the final video
+    ("output") rendered in a mode.
+    """
+
+    return f"{project_space}/{OUTPUT_FILES[mode][kind]}"
+
+
+def scaled_size(size: List[int], settings: dict) -> List[int]:
+    """
+    Scales a frame size, keeping both dimensions even for yuv420p.
+    """
+
+    return [max(2, round(dimension * settings["scale"] / 2) * 2) for dimension in size]
+
+
+def encoder_options(settings: dict) -> dict:
+    """
+    Returns the `write_clip` arguments of the encoder settings.
+    """
+
+    options = {"preset": settings["preset"], "pipe_format": settings["pipe_format"]}
+    if settings["crf"] is not None:
+        options["ffmpeg_params"] = ["-crf", str(settings["crf"])]
+    return options
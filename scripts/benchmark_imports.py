@@ -0,0 +1,205 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Make the project modules importable when run as `python scripts/benchmark_imports.py`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from termcolor import colored  # noqa: E402
+
+from scripts.benchmark_render import git_commit  # noqa: E402
+
+MODULES = [
+    "main",
+    "config",
+    "metrics",
+    "storage",
+    "timeline",
+    "render_modes",
+    "prompts",
+    "speech",
+    "tiktokvoice",
+    "image_store",
+    "search",
+    "video",
+    "profiler",
+]
+
+# Dependencies that must only be imported by the stages that use them
+HEAVY_DEPENDENCIES = [
+    "moviepy",
+    "openai",
+    "assemblyai",
+    "srt_equalizer",
+    "PIL",
+    "numpy",
+    "requests",
+]
+
+
+def parse_importtime(stderr: str) -> dict:
+    """
+    Parses the output of `python -X importtime`.
+
+    Returns:
+        dict: The cumulative import time in microseconds of every top level
+            import, by module name.
+    """
+
+    times = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        # Nested imports are indented by two more spaces per level
+        if len(name) - len(name.lstrip()) == 1:
+            times[name.strip()] = int(cumulative)
+    return times
+
+
+def measure(module: str) -> dict:
+    """
+    Imports a module in a fresh interpreter.
+
+    Returns:
+        dict: The import time of the module, the wall time of the process and
+            the heavy dependencies that were loaded.
+    """
+
+    code = (
+        f"import sys, {module}; "
+        f"print(','.join(m for m in {HEAVY_DEPENDENCIES!r} if m in sys.modules))"
+    )
+    start = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    wall_time = time.perf_counter() - start
+
+    times = parse_importtime(process.stderr)
+    return {
+        "import_time": times.get(module, 0) / 1e6,
+        "wall_time": wall_time,
+        "loaded": [name for name in process.stdout.strip().split(",") if name],
+    }
+
+
+def heaviest_imports(module: str, top: int) -> list:
+    """
+    Returns the slowest imports of a module, with their cumulative times.
+    """
+
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    # Children are printed before their parent: keep the direct imports
+    # listed since the previous top level import
+    imports = []
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:") :].split("|")
+        depth = len(name) - len(name.lstrip())
+        if depth == 1:
+            if name.strip() == module:
+                break
+            imports = []
+        elif depth == 3:
+            imports.append((name.strip(), int(cumulative) / 1e6))
+
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the cold import time of the project modules."
+    )
+    parser.add_argument("--modules", nargs="+", default=MODULES)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output", default="benchmark-imports.json")
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        default=None,
+        help="fail if importing main takes longer than this (median)",
+    )
+    args = parser.parse_args()
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "repeat": args.repeat,
+        "results": [],
+    }
+
+    failed = False
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        import_time = statistics.median(run["import_time"] for run in runs)
+        wall_time = statistics.median(run["wall_time"] for run in runs)
+        loaded = runs[0]["loaded"]
+
+        results["results"].append(
+            {
+                "module": module,
+                "import_time": import_time,
+                "wall_time": wall_time,
+                "heavy_dependencies": loaded,
+            }
+        )
+
+        color = "yellow" if loaded else "green"
+        print(
+            colored(
+                f"[+] {module}: {import_time * 1000:.1f}ms import, "
+                f"{wall_time * 1000:.0f}ms process"
+                + (f", loads {', '.join(loaded)}" if loaded else ""),
+                color,
+            )
+        )
+
+        if module == "main":
+            for name, seconds in heaviest_imports(module, 5):
+                print(colored(f"\t=> {name}: {seconds * 1000:.1f}ms", "cyan"))
+
+            if loaded:
+                print(colored("[-] main eagerly imports heavy dependencies", "red"))
+                failed = True
+            if args.budget_ms is not None and import_time * 1000 > args.budget_ms:
+                print(
+                    colored(
+                        f"[-] main imports in {import_time * 1000:.1f}ms, "
+                        f"over the budget of {args.budget_ms:.0f}ms",
+                        "red",
+                    )
+                )
+                failed = True
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(colored(f"[+] Results : {args.output}", "green"))
+
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from queue import Empty
+
+# Make the project modules importable when run as `python scripts/benchmark_render.py`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from termcolor import colored  # noqa: E402
+
+from scripts.synthetic_media import make_fixtures  # noqa: E402
+
+CASES = [
+    "combine_videos",
+    "video_from_images",
+    "generate_video[sparse]",
+    "generate_video[dense]",
+    "add_music_to_video",
+]
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def serve_directory(directory: str) -> ThreadingHTTPServer:
+    """
+    Serves the fixtures over HTTP, so that `combine_videos` downloads the
+    stock clips like it does from Pexels.
+    """
+
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def make_project(workdir: str, name: str) -> str:
+    """
+    Creates an empty project space, like `Videographer.create_temp_folder`.
+    """
+
+    project_space = os.path.join(workdir, "temp", name)
+    shutil.rmtree(project_space, ignore_errors=True)
+    for folder in ["videos", "subtitles", "audio", "images"]:
+        os.makedirs(os.path.join(project_space, folder))
+    return project_space
+
+
+def make_videographer(name: str):
+    """
+    Creates a Videographer for an existing project, without a config file.
+    """
+
+    from config import Config
+    from main import Videographer
+
+    config = Config(None)
+    config.n_threads = 2
+    config.subtitles_position = "center,bottom"
+    config.text_color = "white"
+    config.text_font = "DejaVu-Sans"
+
+    return Videographer("benchmark", stage=4, project_space=name, config=config)
+
+
+def run_case(case: str, length: int, fixtures: dict, base_url: str, threads: int):
+    """
+    Runs a single benchmark case in the current process.
+
+    Returns:
+        int: The number of frames rendered.
+    """
+
+    import video
+
+    name = f"{case.replace('[', '_').rstrip(']')}_{length}"
+    project_space = make_project(os.getcwd(), name)
+    by_length = fixtures["by_length"][length]
+
+    if case == "combine_videos":
+        urls = [f"{base_url}/{clip}" for clip in fixtures["stock_clips"]]
+        video.combine_videos(urls, length, threads, project_space)
+        return length * 30
+
+    if case == "video_from_images":
+        for path in fixtures["images"][: length // 5 + 1]:
+            shutil.copy(path, os.path.join(project_space, "images"))
+        video.video_from_images(project_space, 5, length)
+        return length * 25
+
+    shutil.copy(by_length["speech"], os.path.join(project_space, "audio", "speech.mp3"))
+
+    if case.startswith("generate_video"):
+        density = case[len("generate_video[") : -1]
+        shutil.copy(
+            by_length["raw_video"], os.path.join(project_space, "videos", "final_raw.mp4")
+        )
+        shutil.copy(
+            by_length["subtitles"][density],
+            os.path.join(project_space, "subtitles", "subtitles.srt"),
+        )
+        make_videographer(name).generate_video()
+        return length * 30
+
+    if case == "add_music_to_video":
+        os.makedirs("songs", exist_ok=True)
+        shutil.copy(fixtures["music"], os.path.join("songs", "music.mp3"))
+        shutil.copy(by_length["output"], os.path.join(project_space, "output.mp4"))
+        make_videographer(name).add_music_to_video()
+        return length * 30
+
+    raise ValueError(f"Unknown benchmark case: {case}")
+
+
+def run_case_isolated(queue, case, length, fixtures, base_url, threads, workdir):
+    """
+    Entry point of the child process of a case. Every case runs in a fresh
+    process so that its peak memory is not polluted by the previous ones.
+    """
+
+    from metrics import cpu_time, peak_rss, reset_peak_rss
+
+    # The peak of the child starts at its own resident set, not at the peak
+    # of the parent that built the fixtures
+    reset_peak_rss()
+    os.chdir(workdir)
+    random.seed(0)
+
+    result = {"case": case, "length": length}
+    start, cpu_start = time.perf_counter(), cpu_time()
+    try:
+        frames = run_case(case, length, fixtures, base_url, threads)
+        result["wall_time"] = time.perf_counter() - start
+        result["cpu_time"] = cpu_time() - cpu_start
+        result["frames"] = frames
+        result["frames_per_second"] = frames / result["wall_time"]
+    except Exception as e:
+        result["error"] = f"{type(e).__name__}: {e}"
+    result["peak_rss"] = peak_rss()
+
+    queue.put(result)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results: dict, baseline_path: str, threshold: float) -> list:
+    """
+    Compares the wall time of every case with a previous run.
+
+    Returns:
+        list: The cases that got slower by more than `threshold`.
+    """
+
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = {
+            (result["case"], result["length"]): result
+            for result in json.load(f)["results"]
+            if "wall_time" in result
+        }
+
+    print(colored(f"[+] Compared with {baseline_path}:", "blue"))
+
+    regressions = []
+    for result in results["results"]:
+        previous = baseline.get((result["case"], result["length"]))
+        if previous is None or "wall_time" not in result:
+            continue
+
+        change = result["wall_time"] / previous["wall_time"] - 1
+        color = "red" if change > threshold else "green" if change < -threshold else "cyan"
+        print(
+            colored(
+                f"\t=> {result['case']} @ {result['length']}s: "
+                f"{previous['wall_time']:.2f}s -> {result['wall_time']:.2f}s ({change:+.0%})",
+                color,
+            )
+        )
+        if change > threshold:
+            regressions.append(result)
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the render stages offline.")
+    parser.add_argument("--lengths", type=int, nargs="+", default=[15, 30, 60])
+    parser.add_argument("--cases", nargs="+", default=CASES, choices=CASES)
+    parser.add_argument("--threads", type=int, default=2)
+    parser.add_argument("--workdir", default="temp/benchmark")
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="a previous benchmark JSON to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+
+    workdir = os.path.abspath(args.workdir)
+    fixtures_dir = os.path.join(workdir, "fixtures")
+
+    print(colored("[+] Generating fixtures...", "blue"))
+    fixtures = make_fixtures(fixtures_dir, args.lengths)
+
+    server = serve_directory(fixtures_dir)
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+
+    results = {
+        "commit": git_commit(),
+        "date": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "threads": args.threads,
+        "results": [],
+    }
+
+    context = multiprocessing.get_context("spawn")
+    for length in args.lengths:
+        for case in args.cases:
+            queue = context.Queue()
+            process = context.Process(
+                target=run_case_isolated,
+                args=(queue, case, length, fixtures, base_url, args.threads, workdir),
+            )
+            process.start()
+            result = None
+            while result is None:
+                try:
+                    result = queue.get(timeout=5)
+                except Empty:
+                    if not process.is_alive():
+                        result = {
+                            "case": case,
+                            "length": length,
+                            "error": f"Process exited with code {process.exitcode}",
+                        }
+            process.join()
+
+            results["results"].append(result)
+            if "error" in result:
+                print(colored(f"[-] {case} @ {length}s: {result['error']}", "red"))
+            else:
+                print(
+                    colored(
+                        f"[+] {case} @ {length}s: {result['wall_time']:.2f}s, "
+                        f"{result['frames_per_second']:.1f} frames/s, "
+                        f"peak RSS {result['peak_rss']['self'] / 1024**2:.0f} MB",
+                        "green",
+                    )
+                )
+
+    server.shutdown()
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(results, f, indent=2)
+    print(colored(f"[+] Results : {args.output}", "green"))
+
+    if args.compare and compare(results, args.compare, args.threshold):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
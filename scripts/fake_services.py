@@ -0,0 +1,437 @@
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Make the project modules importable when run as `python scripts/fake_services.py`
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from termcolor import colored  # noqa: E402
+
+from scripts.synthetic_media import make_images, make_video  # noqa: E402
+
+# A silent MPEG-2 Layer III frame: 24 kHz, 32 kbps, mono, 24 ms long.
+# All-zero side information decodes to silence.
+SILENT_MP3_FRAME = bytes([0xFF, 0xF3, 0x44, 0xC0]) + bytes(92)
+SILENT_MP3_FRAME_DURATION = 576 / 24000
+
+# Renditions served for every fake Pexels video, like the real API returns
+RENDITIONS = [
+    ("hd", 1080, 1920),
+    ("sd", 540, 960),
+    ("sd", 360, 640),
+]
+
+# Number of distinct fake videos and images
+FAKE_IMAGES = 40
+
+SCRIPT_SENTENCES = [
+    "Rust gives you memory safety without a garbage collector.",
+    "Its compiler catches whole classes of bugs before your code ever runs.",
+    "Python on the other hand lets you ship an idea in an afternoon.",
+    "Both communities obsess over tooling, and it shows.",
+    "The real winner is the developer who knows when to use which.",
+]
+
+
+class FakeServices:
+    """
+    Behaviour and statistics shared by the request handlers.
+    """
+
+    def __init__(self, args):
+        self.args = args
+        self.media_dir = os.path.abspath(args.media_dir)
+        self.stats = Counter()
+        self._lock = threading.Lock()
+        self._media_lock = threading.Lock()
+        self._window = []
+
+        os.makedirs(self.media_dir, exist_ok=True)
+
+    def count(self, key: str) -> None:
+        with self._lock:
+            self.stats[key] += 1
+
+    def throttled(self) -> bool:
+        """
+        Returns True when the request should get a 429, either randomly or
+        because the server-wide rate limit is exceeded.
+        """
+
+        if random.random() < self.args.throttle_rate:
+            return True
+
+        if not self.args.rate_limit:
+            return False
+
+        now = time.monotonic()
+        with self._lock:
+            self._window = [t for t in self._window if now - t < 1]
+            if len(self._window) >= self.args.rate_limit:
+                return True
+            self._window.append(now)
+        return False
+
+    def video_path(self, video_id: int, width: int, height: int) -> str:
+        """
+        Returns the path of a fake stock video, generating it on first use.
+        """
+
+        path = os.path.join(self.media_dir, f"{video_id}_{width}x{height}.mp4")
+        with self._media_lock:
+            if not os.path.exists(path):
+                pattern = "noise" if video_id % 2 else "bars"
+                make_video(path, width, height, 30, self.args.video_duration, pattern)
+        return path
+
+    def image_path(self, index: int) -> str:
+        """
+        Returns the path of a fake image, generating the set on first use.
+        """
+
+        with self._media_lock:
+            images = make_images(
+                os.path.join(self.media_dir, "images"), FAKE_IMAGES, (256, 448), seed=1
+            )
+        return images[index % FAKE_IMAGES]
+
+
+def fake_video_id(query: str, index: int) -> int:
+    """
+    Returns a stable fake Pexels id. Queries share a few ids, like similar
+    search terms do on the real API.
+    """
+
+    digest = hashlib.sha256(query.lower().encode("utf-8")).digest()
+    return 1000 + (digest[0] + index * 7) % FAKE_IMAGES
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    services: FakeServices = None
+
+    def log_message(self, *args):
+        if self.services.args.verbose:
+            super().log_message(*args)
+
+    # Request plumbing
+
+    def read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else b""
+        if not body:
+            return {}
+        try:
+            return json.loads(body)
+        except ValueError:
+            # Multipart uploads (transcriptions) are not JSON
+            return {}
+
+    def send_json(self, payload, status: int = 200, headers: dict = None) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_bytes(self, body: bytes, content_type: str) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_file(self, path: str, content_type: str) -> None:
+        """
+        Sends a file, honouring single byte range requests.
+        """
+
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        status = 200
+
+        match = re.match(r"bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if match and (match.group(1) or match.group(2)):
+            if match.group(1):
+                start = int(match.group(1))
+                end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+            else:
+                start = max(0, size - int(match.group(2)))
+            if start > end:
+                self.send_response(416)
+                self.send_header("Content-Range", f"bytes */{size}")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            status = 206
+            self.services.count("range_requests")
+
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Length", str(end - start + 1))
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.end_headers()
+
+        if self.command == "HEAD":
+            return
+
+        with open(path, "rb") as f:
+            f.seek(start)
+            remaining = end - start + 1
+            while remaining:
+                chunk = f.read(min(remaining, 1 << 16))
+                if not chunk:
+                    break
+                self.wfile.write(chunk)
+                remaining -= len(chunk)
+
+    def simulate(self, route: str) -> bool:
+        """
+        Applies the configured latency, errors and throttling.
+
+        Returns:
+            bool: False if an error response was already sent.
+        """
+
+        args = self.services.args
+        self.services.count(route)
+
+        if args.latency:
+            time.sleep(max(0.0, random.gauss(args.latency, args.latency * args.jitter)))
+
+        if self.services.throttled():
+            self.services.count("throttled")
+            self.send_json(
+                {"error": {"message": "Rate limit reached", "type": "rate_limit"}},
+                429,
+                {"Retry-After": str(args.retry_after)},
+            )
+            return False
+
+        if random.random() < args.error_rate:
+            self.services.count("errors")
+            self.send_json({"error": {"message": "Injected failure", "type": "server"}}, 500)
+            return False
+
+        return True
+
+    # Routes
+
+    def do_HEAD(self):
+        self.do_GET()
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        video = re.match(r"/files/videos/(\d+)_(\d+)x(\d+)\.mp4$", url.path)
+        picture = re.match(r"/files/pictures/(\d+)\.png$", url.path)
+
+        if url.path == "/__stats":
+            self.send_json(dict(self.services.stats))
+        elif url.path in ("/", ""):
+            # Health check of the TikTok endpoints
+            self.send_json({"status": "ok"})
+        elif url.path == "/videos/search":
+            if self.simulate("pexels_search"):
+                self.pexels_search(parse_qs(url.query))
+        elif video:
+            if self.simulate("video_download"):
+                video_id, width, height = map(int, video.groups())
+                self.send_file(self.services.video_path(video_id, width, height), "video/mp4")
+        elif picture:
+            if self.simulate("picture_download"):
+                self.send_file(self.services.image_path(int(picture.group(1))), "image/png")
+        else:
+            self.send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        payload = self.read_json()
+
+        routes = {
+            "/v1/chat/completions": ("openai_chat", self.chat_completion),
+            "/v1/images/generations": ("openai_image", self.image_generation),
+            "/v1/audio/speech": ("openai_tts", self.speech),
+            "/v1/audio/transcriptions": ("openai_transcribe", self.transcription),
+            "/api/generation": ("tiktok_tts", self.tiktok_tts),
+        }
+        if url.path not in routes:
+            self.send_json({"error": "not found"}, 404)
+            return
+
+        route, handler = routes[url.path]
+        if self.simulate(route):
+            handler(payload)
+
+    def chat_completion(self, payload: dict) -> None:
+        prompt = payload.get("messages", [{}])[-1].get("content", "")
+
+        amount = re.search(r"Generate (\d+)", prompt)
+        amount = int(float(amount.group(1))) if amount else 5
+
+        if "prompts for images" in prompt:
+            content = json.dumps(
+                [f"{SCRIPT_SENTENCES[i % len(SCRIPT_SENTENCES)]} scene {i}" for i in range(amount)]
+            )
+        elif "search terms" in prompt:
+            terms = ["programming", "computer code", "developer laptop", "server room", "coffee"]
+            content = json.dumps([terms[i % len(terms)] for i in range(amount)])
+        else:
+            content = " ".join(SCRIPT_SENTENCES)
+
+        self.send_json(
+            {
+                "id": f"chatcmpl-fake-{random.getrandbits(32):08x}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": payload.get("model", "fake"),
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+            }
+        )
+
+    def image_generation(self, payload: dict) -> None:
+        digest = hashlib.sha256(payload.get("prompt", "").encode("utf-8")).digest()
+        index = digest[0] % FAKE_IMAGES
+        path = self.services.image_path(index)
+
+        if payload.get("response_format") == "b64_json":
+            with open(path, "rb") as f:
+                item = {"b64_json": base64.b64encode(f.read()).decode("ascii")}
+        else:
+            item = {"url": f"{self.base_url()}/files/pictures/{index}.png"}
+
+        self.send_json({"created": int(time.time()), "data": [item]})
+
+    def speech(self, payload: dict) -> None:
+        self.send_bytes(silent_mp3(payload.get("input", "")), "audio/mpeg")
+
+    def transcription(self, payload: dict) -> None:
+        entries = [
+            f"{i + 1}\n00:00:{i * 3:02d},000 --> 00:00:{i * 3 + 3:02d},000\n{sentence}\n"
+            for i, sentence in enumerate(SCRIPT_SENTENCES)
+        ]
+        self.send_bytes("\n".join(entries).encode("utf-8"), "text/plain")
+
+    def tiktok_tts(self, payload: dict) -> None:
+        audio = base64.b64encode(silent_mp3(payload.get("text", ""))).decode("ascii")
+        self.send_json({"success": True, "data": audio, "error": None})
+
+    def pexels_search(self, query: dict) -> None:
+        search = query.get("query", [""])[0].strip("'\"")
+        per_page = int(query.get("per_page", ["15"])[0])
+        base_url = self.base_url()
+
+        videos = []
+        for i in range(per_page):
+            video_id = fake_video_id(search, i)
+            videos.append(
+                {
+                    "id": video_id,
+                    "width": RENDITIONS[0][1],
+                    "height": RENDITIONS[0][2],
+                    "duration": self.services.args.video_duration,
+                    "url": f"https://www.pexels.com/video/{search.replace(' ', '-')}-{video_id}/",
+                    "image": f"{base_url}/files/pictures/{video_id}.png",
+                    "user": {"id": video_id % 7, "name": f"Fake Creator {video_id % 7}"},
+                    "video_files": [
+                        {
+                            "id": video_id * 10 + n,
+                            "quality": quality,
+                            "file_type": "video/mp4",
+                            "width": width,
+                            "height": height,
+                            "fps": 30,
+                            "link": f"{base_url}/files/videos/{video_id}_{width}x{height}.mp4",
+                        }
+                        for n, (quality, width, height) in enumerate(RENDITIONS)
+                    ],
+                    "video_pictures": [
+                        {"id": video_id, "nr": 0, "picture": f"{base_url}/files/pictures/{video_id}.png"}
+                    ],
+                }
+            )
+
+        self.send_json(
+            {"page": 1, "per_page": per_page, "total_results": len(videos), "videos": videos}
+        )
+
+    def base_url(self) -> str:
+        return f"http://{self.headers.get('Host')}"
+
+
+def silent_mp3(text: str, characters_per_second: float = 15) -> bytes:
+    """
+    Returns silent MP3 audio as long as `text` takes to speak.
+    """
+
+    duration = max(0.5, len(text) / characters_per_second)
+    return SILENT_MP3_FRAME * round(duration / SILENT_MP3_FRAME_DURATION)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-ins for the OpenAI, Pexels and TikTok TTS APIs."
+    )
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.0, help="mean latency in seconds")
+    parser.add_argument("--jitter", type=float, default=0.25, help="latency stddev / mean")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of 500 responses")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of 429 responses")
+    parser.add_argument("--rate-limit", type=int, default=0, help="requests per second, 0 = off")
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--video-duration", type=int, default=12)
+    parser.add_argument("--media-dir", default="temp/fake_services")
+    parser.add_argument("--verbose", action="store_true")
+    args = parser.parse_args()
+
+    Handler.services = FakeServices(args)
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    base_url = f"http://{args.host}:{server.server_address[1]}"
+
+    print(colored(f"[+] Fake services listening on {base_url}", "green"))
+    print(colored("[+] Point config.json at them with:", "blue"))
+    print(
+        json.dumps(
+            {
+                "openai_base_url": f"{base_url}/v1",
+                "pexels_base_url": base_url,
+                "tiktok_tts_endpoints": [f"{base_url}/api/generation"],
+            },
+            indent=4,
+        )
+    )
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(colored(f"[+] Requests served: {dict(Handler.services.stats)}", "blue"))
+
+
+if __name__ == "__main__":
+    main()
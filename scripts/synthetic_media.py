@@ -0,0 +1,210 @@
+import os
+import subprocess
+from typing import List
+
+import numpy
+from moviepy.config import get_setting
+from PIL import Image
+
+# (width, height, fps) of the stock clip fixtures: landscape, portrait and
+# square footage at the resolutions and frame rates Pexels usually returns
+STOCK_CLIPS = [
+    (1920, 1080, 30),
+    (1080, 1920, 30),
+    (2560, 1440, 24),
+    (1280, 720, 60),
+    (720, 1280, 25),
+    (1080, 1080, 30),
+]
+
+# Captions per second of the subtitle fixtures
+SUBTITLE_DENSITIES = {
+    "sparse": 1 / 3,  # one sentence every three seconds
+    "dense": 3,  # word level captions
+}
+
+WORDS = (
+    "the quick brown fox jumps over a lazy dog while rust and python "
+    "compete for the fastest video pipeline on the planet"
+).split()
+
+
+def ffmpeg(*args: str) -> None:
+    """
+    Runs ffmpeg with the binary configured for moviepy.
+    """
+
+    subprocess.run(
+        [get_setting("FFMPEG_BINARY"), "-y", "-loglevel", "error", *args], check=True
+    )
+
+
+def make_video(
+    path: str,
+    width: int,
+    height: int,
+    fps: int,
+    duration: float,
+    pattern: str = "bars",
+    with_audio: bool = False,
+) -> str:
+    """
+    Generates an H.264 MP4 of color bars ("bars") or noise ("noise").
+    Noise defeats inter-frame compression, like busy stock footage.
+    """
+
+    if os.path.exists(path):
+        return path
+
+    if pattern == "noise":
+        source = f"color=c=gray:s={width}x{height}:r={fps}:d={duration},noise=alls=60:allf=t"
+    else:
+        source = f"testsrc2=s={width}x{height}:r={fps}:d={duration}"
+
+    args = ["-f", "lavfi", "-i", source]
+    if with_audio:
+        args += ["-f", "lavfi", "-i", f"sine=f=330:d={duration}", "-c:a", "aac"]
+    args += ["-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p"]
+
+    ffmpeg(*args, path)
+    return path
+
+
+def make_speech(path: str, duration: float, frequency: int = 220) -> str:
+    """
+    Generates a speech-like MP3: a tone modulated at syllable rate, with a
+    short pause every few seconds.
+    """
+
+    if os.path.exists(path):
+        return path
+
+    expression = (
+        f"sin(2*PI*{frequency}*t)*(0.5+0.5*sin(2*PI*3*t))*gt(mod(t\\,4)\\,0.3)"
+    )
+    ffmpeg(
+        "-f",
+        "lavfi",
+        "-i",
+        f"aevalsrc={expression}:s=24000:d={duration}",
+        "-codec:a",
+        "libmp3lame",
+        path,
+    )
+    return path
+
+
+def make_images(directory: str, count: int, size=(1024, 1792), seed: int = 0) -> List[str]:
+    """
+    Generates PNGs named like the DALL-E images of a project (000.png, ...):
+    a color gradient with noise, so that resampling has detail to work on.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+    rng = numpy.random.default_rng(seed)
+    width, height = size
+
+    paths = []
+    for i in range(count):
+        path = os.path.join(directory, f"{i:03d}.png")
+        paths.append(path)
+        if os.path.exists(path):
+            continue
+
+        x = numpy.linspace(0, 1, width, dtype=numpy.float32)[None, :]
+        y = numpy.linspace(0, 1, height, dtype=numpy.float32)[:, None]
+        phase = i / max(1, count)
+        image = numpy.stack(
+            [
+                (x + phase) % 1 * numpy.ones_like(y),
+                (y + phase) % 1 * numpy.ones_like(x),
+                (x * y + phase) % 1,
+            ],
+            axis=-1,
+        )
+        image = image * 200 + rng.integers(0, 55, image.shape)
+        Image.fromarray(image.astype(numpy.uint8)).save(path)
+
+    return paths
+
+
+def make_srt(path: str, duration: float, captions_per_second: float) -> str:
+    """
+    Generates an SRT file with evenly spaced captions.
+    """
+
+    def srt_time(seconds):
+        milliseconds = round(seconds * 1000)
+        hours, milliseconds = divmod(milliseconds, 3_600_000)
+        minutes, milliseconds = divmod(milliseconds, 60_000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+    step = 1 / captions_per_second
+    words_per_caption = max(1, round(step * 2.5))
+
+    entries = []
+    start, index = 0.0, 0
+    while start < duration:
+        end = min(duration, start + step)
+        text = " ".join(
+            WORDS[(index * words_per_caption + i) % len(WORDS)]
+            for i in range(words_per_caption)
+        )
+        entries.append(f"{index + 1}\n{srt_time(start)} --> {srt_time(end)}\n{text}\n")
+        start, index = end, index + 1
+
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("\n".join(entries))
+
+    return path
+
+
+def make_fixtures(directory: str, lengths: List[int]) -> dict:
+    """
+    Generates every fixture the benchmarks need, reusing existing files.
+
+    Returns:
+        dict: The paths of the fixtures, by kind.
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    fixtures = {"stock_clips": [], "images": None, "music": None, "by_length": {}}
+
+    for i, (width, height, fps) in enumerate(STOCK_CLIPS):
+        pattern = "noise" if i % 2 else "bars"
+        name = f"clip_{width}x{height}_{fps}_{pattern}.mp4"
+        make_video(os.path.join(directory, name), width, height, fps, 12, pattern)
+        fixtures["stock_clips"].append(name)
+
+    fixtures["images"] = make_images(
+        os.path.join(directory, "images"), max(lengths) // 5 + 1
+    )
+    fixtures["music"] = make_speech(os.path.join(directory, "music.mp3"), max(lengths) + 5, 440)
+
+    for length in lengths:
+        fixtures["by_length"][length] = {
+            "speech": make_speech(os.path.join(directory, f"speech_{length}.mp3"), length),
+            "raw_video": make_video(
+                os.path.join(directory, f"final_raw_{length}.mp4"), 1080, 1920, 30, length
+            ),
+            "output": make_video(
+                os.path.join(directory, f"output_{length}.mp4"),
+                1080,
+                1920,
+                30,
+                length,
+                with_audio=True,
+            ),
+            "subtitles": {
+                density: make_srt(
+                    os.path.join(directory, f"subtitles_{length}_{density}.srt"),
+                    length,
+                    rate,
+                )
+                for density, rate in SUBTITLE_DENSITIES.items()
+            },
+        }
+
+    return fixtures
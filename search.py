@@ -1,24 +1,54 @@
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 
-import requests
 from termcolor import colored
 
+import metrics
+
+
+PEXELS_API_URL = "https://api.pexels.com"
+
+# Side of the grayscale thumbnail, and of its low frequencies, that a
+# perceptual hash is computed from: a hash has HASH_SIZE**2 bits
+HASH_IMAGE_SIZE = 32
+HASH_SIZE = 8
+
+# Number of thumbnails downloaded at once
+THUMBNAIL_WORKERS = 8
+
 
 def search_for_stock_videos(
-    query: str, api_key: str, it: int, min_dur: int, max_dur: int
-) -> List[str]:
+    query: str,
+    api_key: str,
+    it: int,
+    min_dur: int,
+    max_dur: int,
+    base_url: str = PEXELS_API_URL,
+) -> List[dict]:
     """
     Searches for stock videos based on a query.
+
+    Returns:
+        List[dict]: The "url" of the largest file of every video found, with
+            the "id" and "duration" of the video and the "width" and "height"
+            of the file, as reported by Pexels, the URL of the preview
+            "image" of the video, of its Pexels "page", and the name of the
+            "user" who published it. The "renditions" of the video
+            are all its files, each with its "url", "width" and "height",
+            from the smallest to the largest.
     """
+    import requests
 
     headers = {"Authorization": api_key}
-    qurl = f"https://api.pexels.com/videos/search?query='{query}'&per_page={it}"
-    r = requests.get(qurl, headers=headers)
+    qurl = f"{base_url.rstrip('/')}/videos/search?query='{query}'&per_page={it}"
+    with metrics.call("pexels_search"):
+        r = requests.get(qurl, headers=headers)
+    metrics.count("bytes_downloaded", len(r.content))
     response = r.json()
 
     # Parse each video
     raw_urls = []
-    video_url = []
+    videos = []
     try:
         # loop through each video in the result
         for i in range(it):
@@ -29,7 +59,7 @@ def search_for_stock_videos(
             ):
                 continue
             raw_urls = response["videos"][i]["video_files"]
-            temp_video_url = ""
+            temp_video = None
 
             # loop through each url to determine the best quality
             video_res = 0
@@ -38,19 +68,136 @@ def search_for_stock_videos(
                 # if ".com/external" in video["link"]:
                 # Only save the URL with the largest resolution
                 if (video["width"] * video["height"]) > video_res:
-                    temp_video_url = video["link"]
+                    temp_video = video
                     video_res = video["width"] * video["height"]
 
-            # add the url to the return list if it's not empty
-            if temp_video_url != "":
-                video_url.append(temp_video_url)
+            # add the video to the return list if it has a file
+            if temp_video is not None:
+                renditions = sorted(
+                    (
+                        {
+                            "url": video["link"],
+                            "width": video["width"],
+                            "height": video["height"],
+                        }
+                        for video in raw_urls
+                        if video.get("width") and video.get("height")
+                    ),
+                    key=lambda rendition: rendition["width"] * rendition["height"],
+                )
+                videos.append(
+                    {
+                        "url": temp_video["link"],
+                        "id": response["videos"][i]["id"],
+                        "duration": response["videos"][i]["duration"],
+                        "width": temp_video["width"],
+                        "height": temp_video["height"],
+                        "renditions": renditions,
+                        "image": response["videos"][i].get("image"),
+                        "page": response["videos"][i].get("url"),
+                        "user": (response["videos"][i].get("user") or {}).get("name"),
+                    }
+                )
 
     except Exception as e:
         print(colored("[-] No Videos found.", "red"))
         print(colored(e, "red"))
 
     # Let user know
-    print(colored(f'\t=> "{query}" found {len(video_url)} Videos', "cyan"))
+    print(colored(f'\t=> "{query}" found {len(videos)} Videos', "cyan"))
+
+    # Return the videos
+    return videos
+
+
+def thumbnail_hash(image_url: str) -> Optional[int]:
+    """
+    Returns the perceptual hash of a preview image: the signs of the lowest
+    frequencies of the DCT of the image, downscaled to grayscale. Images of
+    the same footage, at any size or encoding, have hashes that differ by
+    a few bits.
+
+    Returns None if the image could not be downloaded or decoded.
+    """
+    import io
+
+    import numpy
+    import requests
+    from PIL import Image
+
+    try:
+        with metrics.call("pexels_thumbnail"):
+            response = requests.get(image_url, timeout=30)
+            response.raise_for_status()
+        metrics.count("bytes_downloaded", len(response.content))
+
+        with Image.open(io.BytesIO(response.content)) as image:
+            image.draft("L", (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE))
+            pixels = numpy.asarray(
+                image.convert("L").resize(
+                    (HASH_IMAGE_SIZE, HASH_IMAGE_SIZE), Image.LANCZOS
+                ),
+                dtype=numpy.float64,
+            )
+    except Exception as e:
+        print(colored(f"[-] Could not read the thumbnail {image_url}: {e}", "red"))
+        return None
+
+    # DCT-II of the rows and columns, as matrix products
+    n = numpy.arange(HASH_IMAGE_SIZE)
+    dct = numpy.cos(numpy.pi * numpy.outer(n, 2 * n + 1) / (2 * HASH_IMAGE_SIZE))
+    frequencies = (dct @ pixels @ dct.T)[:HASH_SIZE, :HASH_SIZE].flatten()
+
+    # The DC term only holds the brightness of the image
+    bits = frequencies > numpy.median(frequencies[1:])
+    return int("".join("1" if bit else "0" for bit in bits), 2)
+
+
+def remove_near_duplicates(videos: List[dict], max_distance: int) -> List[dict]:
+    """
+    Removes the videos whose preview image looks like the one of a video
+    before them, e.g. the same shot found by two search terms, or another
+    take of the same shoot. Only the preview images are downloaded, of the
+    videos without an "image_hash" yet: the hashes are stored in the videos,
+    so that the footage library keeps them.
+
+    Args:
+        videos (List[dict]): The videos, see `search_for_stock_videos`.
+        max_distance (int): The number of bits by which the thumbnail hashes
+            of two near duplicates differ at most, out of 64.
+
+    Returns:
+        List[dict]: The videos kept, in order.
+    """
+
+    unhashed = [
+        video
+        for video in videos
+        if video.get("image_hash") is None and video.get("image")
+    ]
+    with ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as executor:
+        hashes = executor.map(lambda video: thumbnail_hash(video["image"]), unhashed)
+        for video, image_hash in zip(unhashed, hashes):
+            video["image_hash"] = image_hash
+
+    kept = []
+    kept_hashes = []
+    for video in videos:
+        image_hash = video.get("image_hash")
+        if image_hash is not None and any(
+            bin(image_hash ^ other).count("1") <= max_distance for other in kept_hashes
+        ):
+            continue
+        kept.append(video)
+        if image_hash is not None:
+            kept_hashes.append(image_hash)
+
+    if len(kept) < len(videos):
+        print(
+            colored(
+                f"[+] Removed {len(videos) - len(kept)} near duplicate videos",
+                "cyan",
+            )
+        )
 
-    # Return the video url
-    return video_url
+    return kept
@@ -0,0 +1,125 @@
+from collections import OrderedDict
+from typing import Callable, List, Tuple
+
+
+class SlideCache:
+    """
+    Keeps the pixels of the last slides used, scaled to their output size.
+
+    Slides are loaded when their first frame is read and evicted, least
+    recently used first, once more than `capacity` are loaded. Rendering
+    slides in order thus keeps about two of them in memory, however long
+    the video.
+    """
+
+    def __init__(self, capacity: int = 2):
+        self.capacity = capacity
+        self._slides = OrderedDict()
+
+    def get(self, key: Tuple, load: Callable):
+        """
+        Returns the slide stored under `key`, loading it with `load` if needed.
+        """
+
+        if key in self._slides:
+            self._slides.move_to_end(key)
+            return self._slides[key]
+
+        slide = load()
+        self._slides[key] = slide
+        while len(self._slides) > self.capacity:
+            self._slides.popitem(last=False)
+
+        return slide
+
+
+def image_size(path: str) -> Tuple[int, int]:
+    """
+    Returns the width and height of an image, without decoding it.
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.size
+
+
+def load_slide(path: str, size: Tuple[int, int], crop: List[float] = None):
+    """
+    Decodes an image, crops it and scales it to `size`, in one resample.
+
+    Returns:
+        PIL.Image.Image: The scaled image.
+    """
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.convert("RGB").resize(
+            size, Image.LANCZOS, box=tuple(crop) if crop else None
+        )
+
+
+def slide_clip(
+    path: str,
+    duration: float,
+    size: List[int],
+    fps: float,
+    crop: List[float] = None,
+    zoom_ratio: float = 0.0,
+    cache: SlideCache = None,
+):
+    """
+    Returns the clip of a still image, optionally slowly zooming in.
+
+    The image is decoded when the first frame of the slide is read, not when
+    the clip is created, and scaled once to the output size. A still slide
+    returns the same pixels for every frame, and every zoomed frame is a
+    single resample of a box of the scaled image.
+
+    Args:
+        path (str): The image.
+        duration (float): The duration of the slide.
+        size (List[int]): The output size.
+        fps (float): The frame rate.
+        crop (List[float]): The [x1, y1, x2, y2] box of the image to show.
+        zoom_ratio (float): The zoom speed, 0 for a still slide.
+        cache (SlideCache): Where to keep the scaled image.
+
+    Returns:
+        VideoClip: The clip of the slide.
+    """
+    import numpy
+    from moviepy.editor import VideoClip
+    from PIL import Image
+
+    cache = cache if cache is not None else SlideCache()
+
+    width, height = size
+    key = (path, (width, height), tuple(crop) if crop else None, bool(zoom_ratio))
+
+    def make_frame(t):
+        if not zoom_ratio:
+            return cache.get(
+                key, lambda: numpy.asarray(load_slide(path, (width, height), crop))
+            )
+
+        image = cache.get(key, lambda: load_slide(path, (width, height), crop))
+
+        # The centered box of the scaled image visible at t
+        zoom = 1 + zoom_ratio * t
+        box_width, box_height = width / zoom, height / zoom
+        left = (width - box_width) / 2
+        top = (height - box_height) / 2
+        frame = image.resize(
+            (width, height),
+            Image.LANCZOS,
+            box=(left, top, left + box_width, top + box_height),
+        )
+        return numpy.asarray(frame)
+
+    # Setting make_frame directly: the constructor would read the first
+    # frame to find the size, loading the slide before its time
+    clip = VideoClip(duration=duration)
+    clip.make_frame = make_frame
+    clip.size = (width, height)
+
+    return clip.set_fps(fps)
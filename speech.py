@@ -0,0 +1,507 @@
+import hashlib
+import json
+import os
+import re
+import subprocess
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Callable, Iterator, List, Optional, Tuple
+
+from termcolor import colored
+
+import metrics
+
+if TYPE_CHECKING:
+    import numpy
+
+# Bitrates in kbps, indexed by [version is MPEG1][layer][bitrate index]
+_BITRATES = {
+    True: {
+        1: [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+        2: [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+        3: [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    },
+    False: {
+        1: [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+        2: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+        3: [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    },
+}
+
+# Sample rates in Hz, indexed by the version bits of the frame header
+_SAMPLE_RATES = {
+    3: [44100, 48000, 32000],  # MPEG1
+    2: [22050, 24000, 16000],  # MPEG2
+    0: [11025, 12000, 8000],  # MPEG2.5
+}
+
+SEGMENTS_FILE = "speech_segments.json"
+
+
+def split_sentences(script: str) -> List[str]:
+    """
+    Splits a script into sentences.
+
+    Args:
+        script (str): The script to split.
+
+    Returns:
+        List[str]: The sentences of the script, without empty entries.
+    """
+
+    script = " ".join(script.split())
+    sentences = re.split(r"(?<=[.!?])\s+", script)
+
+    return [sentence.strip() for sentence in sentences if sentence.strip()]
+
+
+def strip_id3(data: bytes) -> bytes:
+    """
+    Removes the ID3v2 header and ID3v1 trailer of an MP3 file.
+    """
+
+    if data[:3] == b"ID3" and len(data) >= 10:
+        size = (
+            (data[6] & 0x7F) << 21
+            | (data[7] & 0x7F) << 14
+            | (data[8] & 0x7F) << 7
+            | (data[9] & 0x7F)
+        )
+        footer = 10 if data[5] & 0x10 else 0
+        data = data[10 + size + footer :]
+
+    if len(data) >= 128 and data[-128:-125] == b"TAG":
+        data = data[:-128]
+
+    return data
+
+
+def _parse_frame_header(data: bytes, offset: int) -> Optional[Tuple[int, int, int]]:
+    """
+    Parses the MPEG audio frame header at `offset`.
+
+    Returns:
+        Tuple[int, int, int]: The frame length in bytes, the number of
+        samples in the frame and the sample rate, or None if there is no
+        valid header at `offset`.
+    """
+
+    if offset + 4 > len(data):
+        return None
+
+    b1, b2 = data[offset + 1], data[offset + 2]
+    if data[offset] != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+
+    version = (b1 >> 3) & 0x03
+    layer = 4 - ((b1 >> 1) & 0x03)
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0x03
+    if version == 1 or layer == 4 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    mpeg1 = version == 3
+    bitrate = _BITRATES[mpeg1][layer][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version][sample_rate_index]
+    padding = (b2 >> 1) & 0x01
+
+    if layer == 1:
+        samples = 384
+        length = (12 * bitrate // sample_rate + padding) * 4
+    else:
+        samples = 1152 if mpeg1 or layer == 2 else 576
+        length = samples // 8 * bitrate // sample_rate + padding
+
+    return length, samples, sample_rate
+
+
+def iter_mp3_frames(data: bytes) -> Iterator[Tuple[int, int, int, int]]:
+    """
+    Iterates over the audio frames of an MP3 stream without decoding them.
+
+    Args:
+        data (bytes): The MP3 stream, without ID3 tags.
+
+    Yields:
+        Tuple[int, int, int, int]: The offset and length in bytes, the number
+        of samples and the sample rate of each frame.
+    """
+
+    offset = 0
+    while offset + 4 <= len(data):
+        header = _parse_frame_header(data, offset)
+        if header is None:
+            # Resynchronize on the next possible frame header
+            offset = data.find(b"\xff", offset + 1)
+            if offset < 0:
+                return
+            continue
+
+        length, samples, sample_rate = header
+        if offset + length > len(data):
+            return
+
+        yield offset, length, samples, sample_rate
+        offset += length
+
+
+def _is_info_frame(data: bytes, offset: int, length: int) -> bool:
+    """
+    Checks if a frame is a Xing/Info/VBRI header frame, which describes the
+    whole file and becomes wrong once files are concatenated.
+    """
+
+    frame = data[offset : offset + min(length, 64)]
+    return b"Xing" in frame or b"Info" in frame or b"VBRI" in frame
+
+
+def mp3_duration(data: bytes) -> float:
+    """
+    Returns the duration of an MP3 stream in seconds, by counting its frames.
+    """
+
+    data = strip_id3(data)
+    return sum(
+        samples / sample_rate
+        for offset, length, samples, sample_rate in iter_mp3_frames(data)
+        if not _is_info_frame(data, offset, length)
+    )
+
+
+def concat_mp3(segments: List[bytes]) -> bytes:
+    """
+    Concatenates MP3 streams at the frame level, without re-encoding.
+
+    ID3 tags and Xing/Info header frames are dropped, so the result is a
+    plain sequence of audio frames.
+
+    Args:
+        segments (List[bytes]): The MP3 streams to concatenate, in order.
+
+    Returns:
+        bytes: The concatenated MP3 stream.
+    """
+
+    frames = []
+    for segment in segments:
+        data = strip_id3(segment)
+        for offset, length, _, _ in iter_mp3_frames(data):
+            if not _is_info_frame(data, offset, length):
+                frames.append(data[offset : offset + length])
+
+    return b"".join(frames)
+
+
+class SegmentCache:
+    """
+    On-disk cache of synthesized speech segments, keyed by
+    (provider, voice, model, text hash).
+    """
+
+    def __init__(self, root: str = "cache/tts"):
+        self.root = root
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.root, exist_ok=True)
+
+    def path(self, provider: str, voice: str, model: str, text: str) -> str:
+        """
+        Returns the cache path of a segment.
+        """
+
+        text_hash = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        key = hashlib.sha256(
+            "|".join([provider, voice, model, text_hash]).encode("utf-8")
+        ).hexdigest()
+
+        return os.path.join(self.root, f"{key}.mp3")
+
+    def get(self, provider: str, voice: str, model: str, text: str) -> Optional[str]:
+        """
+        Returns the path of a cached segment, or None if it is not cached.
+        """
+
+        path = self.path(provider, voice, model, text)
+        if os.path.exists(path):
+            self.hits += 1
+            metrics.count("cache_hits")
+            return path
+
+        self.misses += 1
+        metrics.count("cache_misses")
+        return None
+
+    def put(self, provider: str, voice: str, model: str, text: str, audio: bytes) -> str:
+        """
+        Stores a synthesized segment and returns its path.
+        """
+
+        path = self.path(provider, voice, model, text)
+        # A unique temporary file: other workers may store the same segment
+        descriptor, part_path = tempfile.mkstemp(suffix=".part", dir=self.root)
+        try:
+            with os.fdopen(descriptor, "wb") as f:
+                f.write(audio)
+            os.replace(part_path, path)
+        except BaseException:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            raise
+
+        return path
+
+
+def synthesize_segments(
+    sentences: List[str],
+    synthesize: Callable[[str], bytes],
+    cache: SegmentCache,
+    provider: str,
+    voice: str,
+    model: str,
+    max_workers: int = 4,
+) -> List[str]:
+    """
+    Synthesizes every sentence that is not cached yet, concurrently. A
+    sentence repeated in the script is synthesized once.
+
+    Args:
+        sentences (List[str]): The sentences to synthesize.
+        synthesize (Callable[[str], bytes]): Returns the MP3 bytes of a text.
+        cache (SegmentCache): The segment cache.
+        provider (str): The TTS provider, part of the cache key.
+        voice (str): The voice, part of the cache key.
+        model (str): The TTS model, part of the cache key.
+        max_workers (int): The maximum number of concurrent requests.
+
+    Returns:
+        List[str]: The paths of the cached segments, in sentence order.
+    """
+
+    paths = [cache.get(provider, voice, model, sentence) for sentence in sentences]
+
+    # The indices of every distinct sentence to synthesize
+    pending = {}
+    for i, path in enumerate(paths):
+        if path is None:
+            pending.setdefault(sentences[i], []).append(i)
+
+    print(
+        colored(
+            f"[+] Synthesizing {len(pending)} of {len(set(sentences))} sentences "
+            f"({len(set(sentences)) - len(pending)} cached)...",
+            "blue",
+        )
+    )
+
+    def synthesize_sentence(sentence):
+        return cache.put(provider, voice, model, sentence, synthesize(sentence))
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        for indices, path in zip(
+            pending.values(), executor.map(synthesize_sentence, pending)
+        ):
+            for i in indices:
+                paths[i] = path
+
+    return paths
+
+
+def assemble_speech(
+    sentences: List[str], segment_paths: List[str], speech_path: str, info: dict
+) -> List[dict]:
+    """
+    Concatenates the speech segments into a single MP3 file and writes the
+    timing sidecar next to it.
+
+    Args:
+        sentences (List[str]): The sentences of the script.
+        segment_paths (List[str]): The MP3 segment of every sentence.
+        speech_path (str): The path of the assembled speech file.
+        info (dict): Provider, voice and model, stored in the sidecar.
+
+    Returns:
+        List[dict]: The text, start, end and duration of every segment.
+    """
+
+    segment_data = []
+    for path in segment_paths:
+        with open(path, "rb") as f:
+            segment_data.append(f.read())
+
+    with open(speech_path, "wb") as f:
+        f.write(concat_mp3(segment_data))
+
+    segments = []
+    start = 0.0
+    for sentence, path, data in zip(sentences, segment_paths, segment_data):
+        duration = mp3_duration(data)
+        segments.append(
+            {
+                "text": sentence,
+                "start": start,
+                "end": start + duration,
+                "duration": duration,
+                "path": path,
+            }
+        )
+        start += duration
+
+    sidecar_path = os.path.join(os.path.dirname(speech_path), SEGMENTS_FILE)
+    with open(sidecar_path, "w", encoding="utf-8") as f:
+        json.dump({**info, "segments": segments}, f, indent=2)
+
+    return segments
+
+
+def load_segments(project_space: str) -> Optional[List[dict]]:
+    """
+    Loads the speech timing sidecar of a project.
+
+    Returns:
+        List[dict]: The speech segments, or None if there is no sidecar.
+    """
+
+    sidecar_path = f"{project_space}/audio/{SEGMENTS_FILE}"
+    if not os.path.exists(sidecar_path):
+        return None
+
+    with open(sidecar_path, "r", encoding="utf-8") as f:
+        return json.load(f)["segments"]
+
+
+def generate_speech_openai(
+    script: str,
+    project_space: str,
+    api_key: str,
+    voice: str = "alloy",
+    model: str = "tts-1",
+    cache: SegmentCache = None,
+    max_workers: int = 4,
+) -> str:
+    """
+    Generates the speech of a script with the OpenAI TTS API.
+
+    Every sentence is synthesized separately and cached, so editing one
+    sentence only re-synthesizes that sentence.
+
+    Args:
+        script (str): The script to speak.
+        project_space (str): The project folder.
+        api_key (str): The OpenAI API key.
+        voice (str): The OpenAI voice.
+        model (str): The OpenAI TTS model.
+        cache (SegmentCache): The segment cache.
+        max_workers (int): The maximum number of concurrent requests.
+
+    Returns:
+        str: The path to the speech file.
+    """
+    from openai import OpenAI
+
+    client = OpenAI(api_key=api_key)
+    cache = cache or SegmentCache()
+
+    def synthesize(text):
+        with metrics.call("openai_tts"):
+            audio = client.audio.speech.create(
+                model=model, voice=voice, input=text, response_format="mp3"
+            ).content
+        metrics.count("bytes_downloaded", len(audio))
+        return audio
+
+    sentences = split_sentences(script)
+    segment_paths = synthesize_segments(
+        sentences, synthesize, cache, "openai", voice, model, max_workers
+    )
+
+    speech_path = f"{project_space}/audio/speech.mp3"
+    assemble_speech(
+        sentences,
+        segment_paths,
+        speech_path,
+        {"provider": "openai", "voice": voice, "model": model},
+    )
+
+    return speech_path
+
+
+def decode_audio(audio_path: str, sample_rate: int = 16000) -> "numpy.ndarray":
+    """
+    Decodes an audio file to mono float samples with ffmpeg.
+
+    Args:
+        audio_path (str): The audio file to decode.
+        sample_rate (int): The sample rate to resample to.
+
+    Returns:
+        numpy.ndarray: The samples, in the range [-1, 1].
+    """
+    import numpy
+    from moviepy.config import get_setting
+
+    command = [
+        get_setting("FFMPEG_BINARY"),
+        "-loglevel",
+        "error",
+        "-i",
+        audio_path,
+        "-f",
+        "s16le",
+        "-acodec",
+        "pcm_s16le",
+        "-ac",
+        "1",
+        "-ar",
+        str(sample_rate),
+        "-",
+    ]
+    pcm = subprocess.run(command, capture_output=True, check=True).stdout
+
+    return numpy.frombuffer(pcm, dtype=numpy.int16).astype(numpy.float32) / 32768
+
+
+def detect_pauses(
+    samples: "numpy.ndarray",
+    sample_rate: int = 16000,
+    window: float = 0.02,
+    threshold_db: float = -35,
+    min_pause: float = 0.12,
+) -> List[Tuple[float, float]]:
+    """
+    Finds the pauses in speech from the short-time energy of the signal.
+
+    A window is silent when its RMS energy is more than `threshold_db` below
+    the loud (95th percentile) level of the whole signal.
+
+    Args:
+        samples (numpy.ndarray): Mono samples, as returned by `decode_audio`.
+        sample_rate (int): The sample rate of `samples`.
+        window (float): The analysis window in seconds.
+        threshold_db (float): The silence threshold relative to loud speech.
+        min_pause (float): The minimum duration of a pause in seconds.
+
+    Returns:
+        List[Tuple[float, float]]: The start and end time of every pause.
+    """
+    import numpy
+
+    window_size = max(1, int(sample_rate * window))
+    n_windows = len(samples) // window_size
+    if n_windows == 0:
+        return []
+
+    frames = samples[: n_windows * window_size].reshape(n_windows, window_size)
+    rms = numpy.sqrt(numpy.mean(frames**2, axis=1)) + 1e-9
+    level_db = 20 * numpy.log10(rms / numpy.percentile(rms, 95))
+    silent = numpy.concatenate(([False], level_db < threshold_db, [False]))
+
+    # Rising and falling edges of the silent mask delimit the pauses
+    edges = numpy.flatnonzero(numpy.diff(silent.astype(numpy.int8)))
+    starts, ends = edges[::2], edges[1::2]
+
+    return [
+        (start * window, end * window)
+        for start, end in zip(starts, ends)
+        if (end - start) * window >= min_pause
+    ]
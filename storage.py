@@ -0,0 +1,389 @@
+import os
+import shutil
+import socket
+import time
+import uuid
+from typing import List, Optional
+
+from termcolor import colored
+
+# Subfolders of every project space
+PROJECT_FOLDERS = ["videos", "subtitles", "audio", "images"]
+
+# What a successful project keeps, relative to its project space.
+# Everything else is an intermediate and is garbage-collected.
+KEEP_AFTER_SUCCESS = [
+    "output.mp4",
+    "outputs",
+    "script.txt",
+    "metrics.json",
+    "render_plan.json",
+    "profiles",
+    "subtitles",
+    "audio/speech.mp3",
+    "audio/speech_segments.json",
+]
+
+# What garbage collection never removes: the videos rendered, and the
+# timeline to render them again from
+PROTECTED = ["output.mp4", "preview.mp4", "outputs", "render_plan.json"]
+
+# Marker files in the project space. Only the project spaces with a marker
+# are garbage-collected.
+ACTIVE_MARKER = ".active"
+COMPLETE_MARKER = ".complete"
+# A previewed project, waiting for its final render
+PARKED_MARKER = ".parked"
+
+
+class StorageQuotaExceeded(Exception):
+    """
+    Raised when a project or the storage root exceeds its disk quota.
+    """
+
+
+def owner_alive(marker_path: str) -> Optional[bool]:
+    """
+    Tells whether the process that wrote an active marker is still running.
+
+    Returns:
+        Optional[bool]: None if that cannot be told: the marker is missing or
+            unreadable, or it was written on another host or on Windows.
+    """
+
+    try:
+        with open(marker_path, "r") as f:
+            host, pid = f.read().split()
+        pid = int(pid)
+    except (OSError, ValueError):
+        return None
+
+    # os.kill terminates the process on Windows
+    if host != socket.gethostname() or os.name == "nt":
+        return None
+
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Running, as another user
+        return True
+    return True
+
+
+def disk_usage(path: str) -> int:
+    """
+    Returns the size in bytes of the files under `path`, following the
+    symlinks to scratch folders.
+    """
+
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+
+    total = 0
+    for directory, _, files in os.walk(path, followlinks=True):
+        for file_name in files:
+            try:
+                total += os.path.getsize(os.path.join(directory, file_name))
+            except OSError:
+                # Removed while walking, e.g. a temporary moviepy file
+                continue
+    return total
+
+
+class StorageManager:
+    """
+    Manages the project spaces of the video creation runs.
+
+    Project spaces live under `root`. High-churn intermediate folders can be
+    placed on a separate (e.g. tmpfs/RAM-backed) `scratch_dir`, linked into
+    the project space. Disk usage is bounded per job and globally, completed
+    projects lose their intermediates, and old projects are removed
+    according to the retention policy, except for their `PROTECTED` files.
+    Previewed projects are parked: they are kept whole until their final
+    render.
+    """
+
+    def __init__(
+        self,
+        root: str = "temp",
+        scratch_dir: str = None,
+        scratch_folders: List[str] = None,
+        job_quota_mb: int = 0,
+        global_quota_mb: int = 0,
+        retention_days: float = 0,
+        stale_hours: float = 0,
+        keep_after_success: List[str] = None,
+    ):
+        self.root = root
+        self.scratch_dir = scratch_dir or None
+        self.scratch_folders = (
+            scratch_folders if scratch_folders is not None else ["videos"]
+        )
+        self.job_quota = job_quota_mb * 1024**2
+        self.global_quota = global_quota_mb * 1024**2
+        self.retention = retention_days * 24 * 60 * 60
+        self.stale = stale_hours * 60 * 60
+        self.keep_after_success = (
+            keep_after_success if keep_after_success is not None else KEEP_AFTER_SUCCESS
+        )
+
+        os.makedirs(self.root, exist_ok=True)
+
+    @classmethod
+    def from_config(cls, config) -> "StorageManager":
+        """
+        Creates the storage manager described by the config.
+        """
+
+        return cls(
+            root=config.storage_root,
+            scratch_dir=config.scratch_dir,
+            scratch_folders=config.scratch_folders,
+            job_quota_mb=config.job_quota_mb,
+            global_quota_mb=config.global_quota_mb,
+            retention_days=config.retention_days,
+            stale_hours=config.stale_hours,
+        )
+
+    def project_path(self, name: str) -> str:
+        """
+        Returns the project space of a project.
+        """
+
+        return f"{self.root}/{name}"
+
+    def create_project(self, name: str = None) -> str:
+        """
+        Creates a project space and its subfolders, after making room for it
+        within the global quota.
+
+        Returns:
+            str: The path to the project space.
+        """
+
+        self.collect_garbage()
+
+        name = str(name or uuid.uuid4())
+        project_space = self.project_path(name)
+        os.makedirs(project_space, exist_ok=True)
+
+        for folder in PROJECT_FOLDERS:
+            folder_path = os.path.join(project_space, folder)
+            if os.path.exists(folder_path):
+                continue
+
+            if self.scratch_dir and folder in self.scratch_folders:
+                scratch_path = os.path.join(self.scratch_dir, name, folder)
+                os.makedirs(scratch_path, exist_ok=True)
+                try:
+                    os.symlink(os.path.abspath(scratch_path), folder_path)
+                    continue
+                except OSError as e:
+                    # Symlinks need extra privileges on Windows
+                    print(
+                        colored(
+                            f"[-] Could not use scratch for {folder}: {e}", "yellow"
+                        )
+                    )
+                    shutil.rmtree(scratch_path, ignore_errors=True)
+
+            os.makedirs(folder_path)
+
+        self.touch(project_space)
+
+        return project_space
+
+    def touch(self, project_space: str) -> None:
+        """
+        Marks a project as active, so garbage collection leaves it alone
+        while this process runs.
+        """
+
+        with open(os.path.join(project_space, ACTIVE_MARKER), "w") as f:
+            f.write(f"{socket.gethostname()}\n{os.getpid()}\n")
+
+    def park(self, project_space: str) -> None:
+        """
+        Marks a previewed project as waiting for its final render, so garbage
+        collection leaves its sources and timeline alone.
+        """
+
+        with open(os.path.join(project_space, PARKED_MARKER), "w") as f:
+            f.write(str(time.time()))
+        try:
+            os.remove(os.path.join(project_space, ACTIVE_MARKER))
+        except FileNotFoundError:
+            pass
+
+    def check_quota(self, project_space: str) -> None:
+        """
+        Checks the project against the per-job quota, and the storage root
+        against the global quota. Called between stages.
+
+        Raises:
+            StorageQuotaExceeded: If a quota is exceeded.
+        """
+
+        self.touch(project_space)
+
+        if self.job_quota:
+            usage = disk_usage(project_space)
+            if usage > self.job_quota:
+                raise StorageQuotaExceeded(
+                    f"Project {project_space} uses {usage / 1024**2:.1f} MB, "
+                    f"over its quota of {self.job_quota / 1024**2:.0f} MB"
+                )
+
+        if self.global_quota and self.total_usage() > self.global_quota:
+            self.collect_garbage(exclude=[project_space])
+            if self.total_usage() > self.global_quota:
+                raise StorageQuotaExceeded(
+                    f"Storage root {self.root} is over its quota of "
+                    f"{self.global_quota / 1024**2:.0f} MB"
+                )
+
+    def total_usage(self) -> int:
+        """
+        Returns the disk usage of all the project spaces, scratch included.
+        """
+
+        return disk_usage(self.root)
+
+    def finish(self, project_space: str) -> None:
+        """
+        Marks a project as successfully completed and removes its
+        intermediates, keeping the final output.
+        """
+
+        self.remove_intermediates(project_space)
+
+        with open(os.path.join(project_space, COMPLETE_MARKER), "w") as f:
+            f.write(str(time.time()))
+        for marker in [ACTIVE_MARKER, PARKED_MARKER]:
+            try:
+                os.remove(os.path.join(project_space, marker))
+            except FileNotFoundError:
+                pass
+
+        print(colored(f"[+] Removed the intermediates of {project_space}", "green"))
+
+    def remove_intermediates(self, project_space: str) -> None:
+        """
+        Removes everything but the `keep_after_success` paths of a project.
+        """
+
+        keep = {os.path.normpath(path) for path in self.keep_after_success}
+        keep_parents = {
+            os.path.normpath(os.path.dirname(path))
+            for path in keep
+            if os.path.dirname(path)
+        }
+        keep.update([ACTIVE_MARKER, COMPLETE_MARKER])
+
+        for directory, folders, files in os.walk(project_space, topdown=True):
+            relative_directory = os.path.relpath(directory, project_space)
+            for entry in list(folders) + files:
+                relative = os.path.normpath(os.path.join(relative_directory, entry))
+                if relative in keep:
+                    if entry in folders:
+                        folders.remove(entry)
+                    continue
+                if relative in keep_parents:
+                    continue
+
+                self._remove(os.path.join(directory, entry))
+                if entry in folders:
+                    folders.remove(entry)
+
+        self._remove_scratch(project_space)
+
+    def remove_project(self, project_space: str) -> None:
+        """
+        Removes a project space, scratch folders and markers included, but
+        for its `PROTECTED` files. The project space itself is only removed
+        if it has none.
+        """
+
+        self._remove_scratch(project_space)
+        for entry in os.listdir(project_space):
+            if entry not in PROTECTED:
+                self._remove(os.path.join(project_space, entry))
+
+        if not os.listdir(project_space):
+            os.rmdir(project_space)
+
+    def collect_garbage(self, exclude: List[str] = None) -> None:
+        """
+        Applies the retention policy: completed projects older than the
+        retention period and incomplete projects that went stale are removed.
+        If the storage root is still over the global quota, the oldest
+        incomplete and then completed projects are removed until it fits.
+
+        Parked projects, projects whose process is still running, and
+        folders without the markers of a project are left alone. See
+        `remove_project` for what is kept of the others.
+        """
+
+        exclude = {os.path.normpath(path) for path in exclude or []}
+        now = time.time()
+        candidates = []
+
+        for name in os.listdir(self.root):
+            project_space = self.project_path(name)
+            if not os.path.isdir(project_space):
+                continue
+            if os.path.normpath(project_space) in exclude:
+                continue
+
+            complete = os.path.join(project_space, COMPLETE_MARKER)
+            active = os.path.join(project_space, ACTIVE_MARKER)
+
+            if os.path.exists(os.path.join(project_space, PARKED_MARKER)):
+                continue
+            if os.path.exists(complete):
+                age = now - os.path.getmtime(complete)
+                if self.retention and age > self.retention:
+                    self.remove_project(project_space)
+                    continue
+                candidates.append((1, -age, project_space))
+            elif os.path.exists(active):
+                # A stage can run for longer than any age limit
+                alive = owner_alive(active)
+                if alive:
+                    continue
+                age = now - os.path.getmtime(active)
+                if self.stale and age > self.stale:
+                    self.remove_project(project_space)
+                    continue
+                # Recently active projects may belong to a worker on another host
+                if alive is False or age > 60 * 60:
+                    candidates.append((0, -age, project_space))
+
+        if not self.global_quota:
+            return
+
+        # Oldest incomplete projects first, then oldest completed ones
+        for _, _, project_space in sorted(candidates):
+            if self.total_usage() <= self.global_quota:
+                break
+            print(
+                colored(
+                    f"[-] Over the storage quota, removing {project_space}", "yellow"
+                )
+            )
+            self.remove_project(project_space)
+
+    def _remove_scratch(self, project_space: str) -> None:
+        if not self.scratch_dir:
+            return
+        name = os.path.basename(os.path.normpath(project_space))
+        shutil.rmtree(os.path.join(self.scratch_dir, name), ignore_errors=True)
+
+    @staticmethod
+    def _remove(path: str) -> None:
+        if os.path.islink(path) or os.path.isfile(path):
+            os.remove(path)
+        else:
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,41 @@
+from contextlib import ExitStack
+
+import numpy
+import pytest
+
+from encoder import FrameWriter
+
+SIZE = (64, 48)
+
+
+def test_failed_encoder_kills_the_others(tmp_path):
+    frame = numpy.zeros((SIZE[1], SIZE[0], 3), dtype=numpy.uint8)
+
+    with pytest.raises(IOError, match="missing"):
+        with ExitStack() as stack:
+            writers = [
+                stack.enter_context(FrameWriter(str(path), SIZE, 30))
+                for path in [tmp_path / "ok.mp4", tmp_path / "missing" / "ko.mp4"]
+            ]
+            for writer in writers:
+                writer.write_frame(frame)
+
+    # Closed last, the first encoder is killed by the error of the second one
+    assert writers[0]._process.returncode < 0
+    assert writers[0]._process.stdin.closed
+
+
+def test_encoders_close_in_turn(tmp_path):
+    frame = numpy.zeros((SIZE[1], SIZE[0], 3), dtype=numpy.uint8)
+    paths = [tmp_path / "first.mp4", tmp_path / "second.mp4"]
+
+    with ExitStack() as stack:
+        writers = [
+            stack.enter_context(FrameWriter(str(path), SIZE, 30)) for path in paths
+        ]
+        for _ in range(3):
+            for writer in writers:
+                writer.write_frame(frame)
+
+    assert all(writer._process.returncode == 0 for writer in writers)
+    assert all(path.stat().st_size > 0 for path in paths)
@@ -0,0 +1,185 @@
+import os
+import re
+import subprocess
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from fetch import (
+    build_boxes,
+    cut_edits,
+    download_prefix,
+    parse_boxes,
+    probe_video,
+    read_entries,
+    write_entries,
+)
+
+FPS = 30
+SECONDS = 4
+# A keyframe every half second
+GOP = 15
+
+
+def ffmpeg_binary() -> str:
+    from moviepy.config import get_setting
+
+    return get_setting("FFMPEG_BINARY")
+
+
+class RangeHandler(SimpleHTTPRequestHandler):
+    """
+    Serves files with Range requests, like a CDN, except under /norange/.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        match = re.match(r"bytes=(\d+)-(\d*)", self.headers.get("Range", ""))
+        path = self.translate_path(self.path.replace("/norange/", "/"))
+        if not os.path.isfile(path):
+            return self.send_error(404)
+        size = os.path.getsize(path)
+        if not match or self.path.startswith("/norange/"):
+            start, end, status = 0, size - 1, 200
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2) or size - 1), size - 1)
+            status = 206
+            if start >= size:
+                return self.send_error(416)
+
+        self.send_response(status)
+        if status == 206:
+            self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.end_headers()
+        with open(path, "rb") as f:
+            f.seek(start)
+            self.wfile.write(f.read(end - start + 1))
+
+
+@pytest.fixture(scope="module")
+def media(tmp_path_factory):
+    """
+    Generates the test videos, served by a local Range server.
+    """
+
+    root = tmp_path_factory.mktemp("media")
+    inputs = [
+        "-f", "lavfi", "-i", f"testsrc=size=320x240:rate={FPS}:duration={SECONDS}",
+        "-f", "lavfi", "-i", f"sine=frequency=440:duration={SECONDS}",
+    ]  # fmt: skip
+    encode = ["-c:v", "libx264", "-g", str(GOP), "-pix_fmt", "yuv420p", "-c:a", "aac"]
+    for name, flags in [("fast.mp4", ["-movflags", "+faststart"]), ("slow.mp4", [])]:
+        subprocess.run(
+            [ffmpeg_binary(), "-v", "error", "-y", *inputs, *encode, *flags]
+            + [str(root / name)],
+            check=True,
+        )
+
+    fast = (root / "fast.mp4").read_bytes()
+    moov_end = fast.index(b"mdat") - 4
+    # The index without any frame, and a cut inside the index
+    (root / "no_mdat.mp4").write_bytes(fast[:moov_end])
+    (root / "truncated.mp4").write_bytes(fast[: moov_end // 2])
+    (root / "garbage.mp4").write_bytes(os.urandom(4096))
+
+    server = ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(RangeHandler, directory=str(root))
+    )
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield root, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def decoded_frames(path: str) -> int:
+    """
+    Decodes a video, failing on any decoding error, and counts its frames.
+    """
+
+    result = subprocess.run(
+        [ffmpeg_binary(), "-v", "error", "-i", path, "-map", "0:v"]
+        + ["-s", "16x16", "-pix_fmt", "gray", "-f", "rawvideo", "-"],
+        capture_output=True,
+        check=True,
+    )
+    assert result.stderr == b""
+    return len(result.stdout) // (16 * 16)
+
+
+def test_probe_reads_the_index(media):
+    _, base_url = media
+
+    index = probe_video(f"{base_url}/fast.mp4")
+
+    assert (index["width"], index["height"]) == (320, 240)
+    assert index["duration"] == pytest.approx(SECONDS, abs=0.1)
+    assert len(index["tracks"][index["video_track"]]["sizes"]) == FPS * SECONDS
+
+
+def test_boxes_round_trip(media):
+    _, base_url = media
+    index = probe_video(f"{base_url}/fast.mp4")
+    start, size = index["moov"]
+    moov = index["header"][start : start + size]
+
+    assert build_boxes(parse_boxes(moov)) == moov
+
+
+def test_cut_edits():
+    # An empty edit of 100, then 1000 of media from 1024
+    edits = [(100, -1, 1 << 16), (1000, 1024, 1 << 16)]
+    elst = write_entries(b"\0\0\0\0", "IiI", edits)
+
+    assert read_entries(cut_edits(elst, 600), "IiI") == [
+        (100, -1, 1 << 16),
+        (500, 1024, 1 << 16),
+    ]
+    assert read_entries(cut_edits(elst, 50), "IiI") == [(50, -1, 1 << 16)]
+
+
+@pytest.mark.parametrize("seconds, frames", [(1.0, 45), (1.4, 60), (2.2, 90)])
+def test_prefix_decodes_to_the_next_keyframe(media, tmp_path, seconds, frames):
+    _, base_url = media
+    index = probe_video(f"{base_url}/fast.mp4")
+    path = str(tmp_path / "prefix.mp4")
+
+    download_prefix(index, seconds, path)
+
+    from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+    # The margin past `seconds`, rounded up to the next keyframe
+    assert decoded_frames(path) == frames
+    assert ffmpeg_parse_infos(path)["duration"] == pytest.approx(frames / FPS, abs=0.05)
+    assert os.path.getsize(path) < os.path.getsize(media[0] / "fast.mp4")
+
+
+def test_prefix_past_the_end_downloads_the_whole_video(media, tmp_path):
+    root, base_url = media
+    index = probe_video(f"{base_url}/fast.mp4")
+    path = str(tmp_path / "whole.mp4")
+
+    download_prefix(index, SECONDS, path)
+
+    assert open(path, "rb").read() == (root / "fast.mp4").read_bytes()
+
+
+@pytest.mark.parametrize(
+    "name",
+    [
+        "slow.mp4",
+        "norange/fast.mp4",
+        "no_mdat.mp4",
+        "truncated.mp4",
+        "garbage.mp4",
+        "missing.mp4",
+    ],
+)
+def test_probe_falls_back_on_other_videos(media, name):
+    _, base_url = media
+
+    assert probe_video(f"{base_url}/{name}") is None
@@ -0,0 +1,54 @@
+import search
+from footage import FootageLibrary
+from search import remove_near_duplicates
+
+
+def make_video(video_id: int, image_hash: int = None) -> dict:
+    return {
+        "url": f"https://videos.example/{video_id}.mp4",
+        "id": video_id,
+        "duration": 15,
+        "width": 1920,
+        "height": 1080,
+        "renditions": [],
+        "image": f"https://images.example/{video_id}.jpg",
+        "page": f"https://www.pexels.com/video/city-at-night-{video_id}/",
+        "user": "Someone",
+        "image_hash": image_hash,
+        "query": "city night",
+    }
+
+
+def test_library_hits_keep_their_thumbnail_hashes(tmp_path, monkeypatch):
+    library = FootageLibrary(str(tmp_path), min_results=2)
+    library.add([make_video(1, 0b1111), make_video(2, 0b1110), make_video(3, 1 << 40)])
+
+    def download(image_url):
+        raise AssertionError(f"Downloaded {image_url}")
+
+    monkeypatch.setattr(search, "thumbnail_hash", download)
+    hits = FootageLibrary(str(tmp_path), 2).search("City, night", 10, 20)
+
+    assert [video["image_hash"] for video in hits] == [0b1111, 0b1110, 1 << 40]
+    assert [video["id"] for video in remove_near_duplicates(hits, 1)] == [1, 3]
+
+
+def test_unhashed_videos_are_hashed_once(tmp_path, monkeypatch):
+    downloads = []
+
+    def download(image_url):
+        downloads.append(image_url)
+        return 0b1010
+
+    monkeypatch.setattr(search, "thumbnail_hash", download)
+    library = FootageLibrary(str(tmp_path), min_results=1)
+    # Stored by a version of the library without hashes
+    library.add([make_video(1)])
+
+    videos = remove_near_duplicates(library.search("city", 10, 20), 6)
+    library.add(videos)
+    remove_near_duplicates(library.search("city", 10, 20), 6)
+
+    assert downloads == ["https://images.example/1.jpg"]
+    reloaded = FootageLibrary(str(tmp_path), min_results=1)
+    assert reloaded.search("city", 10, 20)[0]["image_hash"] == 0b1010
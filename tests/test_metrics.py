@@ -0,0 +1,26 @@
+import pytest
+
+from metrics import RunMetrics, reset_peak_rss
+
+MB = 1024**2
+
+
+@pytest.mark.skipif(not reset_peak_rss(), reason="needs /proc/self/clear_refs")
+def test_stage_peak_is_its_own_high_water_mark():
+    run = RunMetrics()
+
+    with run.stage("outer"):
+        with run.stage("large"):
+            buffer = bytearray(200 * MB)
+            # Touch every page, so that it is resident
+            buffer[::4096] = b"\1" * len(buffer[::4096])
+            del buffer
+        with run.stage("small"):
+            pass
+
+    large = run.stages["large"]["peak_rss"]["self"]
+    small = run.stages["small"]["peak_rss"]["self"]
+    assert large - small > 150 * MB
+    # An enclosing stage and the run keep the peak of the stages inside
+    assert run.stages["outer"]["peak_rss"]["self"] >= large
+    assert run.to_dict()["peak_rss"]["self"] >= large
@@ -0,0 +1,41 @@
+import os
+import threading
+
+from speech import SegmentCache, synthesize_segments
+
+
+def test_repeated_sentences_are_synthesized_once(tmp_path):
+    cache = SegmentCache(str(tmp_path))
+    calls = []
+    lock = threading.Lock()
+
+    def synthesize(text):
+        with lock:
+            calls.append(text)
+        return text.encode("utf-8")
+
+    sentences = ["Hello.", "World.", "Hello.", "Again.", "Hello."]
+    paths = synthesize_segments(
+        sentences, synthesize, cache, "openai", "alloy", "tts-1", max_workers=4
+    )
+
+    assert sorted(calls) == ["Again.", "Hello.", "World."]
+    assert paths[0] == paths[2] == paths[4]
+    assert [open(path, "rb").read() for path in paths] == [
+        sentence.encode("utf-8") for sentence in sentences
+    ]
+    assert not [name for name in os.listdir(tmp_path) if name.endswith(".part")]
+
+
+def test_cached_sentences_are_not_synthesized_again(tmp_path):
+    cache = SegmentCache(str(tmp_path))
+    synthesize_segments(["One."], str.encode, cache, "openai", "alloy", "tts-1")
+
+    def synthesize(text):
+        raise AssertionError(f"{text} is cached")
+
+    paths = synthesize_segments(
+        ["One.", "One."], synthesize, cache, "openai", "alloy", "tts-1"
+    )
+
+    assert paths[0] == paths[1] == cache.path("openai", "alloy", "tts-1", "One.")
@@ -0,0 +1,55 @@
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import pytest
+
+from storage import ACTIVE_MARKER, StorageManager
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+@pytest.fixture
+def storage(tmp_path):
+    # Every project is over the quota
+    return StorageManager(root=str(tmp_path), global_quota_mb=1, stale_hours=1)
+
+
+def make_project(storage, name, host, pid, idle_hours):
+    project_space = storage.create_project(name)
+    with open(os.path.join(project_space, "videos", "clip.mp4"), "wb") as f:
+        f.write(b"\0" * 2 * 1024**2)
+
+    marker = os.path.join(project_space, ACTIVE_MARKER)
+    with open(marker, "w") as f:
+        f.write(f"{host}\n{pid}\n")
+    idle_since = time.time() - idle_hours * 60 * 60
+    os.utime(marker, (idle_since, idle_since))
+    return project_space
+
+
+def test_projects_of_running_processes_are_never_removed(storage):
+    host = socket.gethostname()
+    running = make_project(storage, "running", host, os.getpid(), idle_hours=5)
+    crashed = make_project(storage, "crashed", host, dead_pid(), idle_hours=0)
+
+    storage.collect_garbage()
+
+    assert os.path.exists(os.path.join(running, "videos", "clip.mp4"))
+    assert not os.path.exists(crashed)
+
+
+def test_projects_of_other_hosts_are_removed_once_idle(storage):
+    recent = make_project(storage, "recent", "elsewhere", 1, idle_hours=0)
+    stale = make_project(storage, "stale", "elsewhere", 1, idle_hours=5)
+
+    storage.collect_garbage()
+
+    assert os.path.exists(os.path.join(recent, "videos", "clip.mp4"))
+    assert not os.path.exists(stale)
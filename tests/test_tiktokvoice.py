@@ -0,0 +1,62 @@
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from tiktokvoice import TikTokSynthesizer
+
+SLOW_SECONDS = 1
+
+
+class HealthHandler(BaseHTTPRequestHandler):
+    """
+    Answers health checks, slowly under /slow.
+    """
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.startswith("/slow"):
+            time.sleep(SLOW_SECONDS)
+        self.send_response(200)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), HealthHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+
+
+def test_slow_health_check_does_not_block_the_others(base_url):
+    fast, slow = f"{base_url}/fast/api/tts", f"{base_url}/slow/api/tts"
+
+    with TikTokSynthesizer([fast, slow]) as synthesizer:
+        assert synthesizer.is_healthy(fast)
+
+        checking = threading.Thread(target=synthesizer.is_healthy, args=(slow,))
+        checking.start()
+        time.sleep(0.1)
+        start = time.perf_counter()
+        assert synthesizer.is_healthy(fast)
+        assert time.perf_counter() - start < SLOW_SECONDS / 2
+        checking.join()
+
+
+def test_health_check_keeps_a_newer_state(base_url):
+    slow = f"{base_url}/slow/api/tts"
+
+    with TikTokSynthesizer([slow]) as synthesizer:
+        checking = threading.Thread(target=synthesizer.is_healthy, args=(slow,))
+        checking.start()
+        time.sleep(0.1)
+        # A request failed on the endpoint while it was being checked
+        synthesizer._set_health(slow, False)
+        checking.join()
+
+        assert not synthesizer.is_healthy(slow)
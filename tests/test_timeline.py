@@ -0,0 +1,128 @@
+import pytest
+
+from timeline import MAX_CLIP_SECONDS, fill_lengths, plan_stock_segments
+
+
+def make_source(path: str, duration: float, query: str = None) -> dict:
+    return {
+        "path": path,
+        "width": 1920,
+        "height": 1080,
+        "duration": duration,
+        "query": query,
+    }
+
+
+def check_plan(segments, sources, max_duration):
+    """
+    Checks that the segments fill the duration back to back, with clips of
+    at most MAX_CLIP_SECONDS within their sources, and that a video shown
+    again continues where its last clip ended, or starts over once all its
+    footage was shown.
+    """
+
+    durations = {source["path"]: source["duration"] for source in sources}
+    assert segments[0].start == 0
+    for previous, segment in zip(segments, segments[1:]):
+        assert segment.start == pytest.approx(previous.end)
+    assert segments[-1].end == pytest.approx(max_duration)
+
+    source_outs = {}
+    for segment in segments:
+        assert 0 < segment.duration <= MAX_CLIP_SECONDS + 1e-9
+        assert segment.source_out <= durations[segment.source] + 1e-9
+        if segment.source in source_outs and segment.source_in:
+            assert segment.source_in == pytest.approx(source_outs[segment.source])
+        source_outs[segment.source] = segment.source_out
+
+
+@pytest.mark.parametrize(
+    "capacities, duration, lengths",
+    [
+        # The shorter clips are used whole, the others share the rest
+        ([1, 5, 5], 7, [1, 3, 3]),
+        ([5, 2, 5], 10, [4, 2, 4]),
+        # Clips too short for the duration are all used whole
+        ([2, 5], 10, [2, 5]),
+        # A duration ending exactly on a clip boundary
+        ([5, 5], 10, [5, 5]),
+        ([3], 2, [2]),
+    ],
+)
+def test_fill_lengths(capacities, duration, lengths):
+    assert fill_lengths(capacities, duration) == pytest.approx(lengths)
+
+
+def test_uneven_clips_are_all_shown_before_any_repeats():
+    sources = [
+        make_source("a.mp4", 2, "city"),
+        make_source("b.mp4", 30, "city"),
+        make_source("c.mp4", 7, "sea"),
+        make_source("d.mp4", 12, "sea"),
+    ]
+
+    segments = plan_stock_segments(sources, 20, seed=1)
+
+    check_plan(segments, sources, 20)
+    paths = [segment.source for segment in segments]
+    assert sorted(paths[:4]) == ["a.mp4", "b.mp4", "c.mp4", "d.mp4"]
+    # The 2 second video is used whole, the others share the rest
+    assert next(s for s in segments if s.source == "a.mp4").duration == 2
+    # Consecutive clips alternate between the search terms
+    queries = {source["path"]: source["query"] for source in sources}
+    assert all(
+        queries[previous] != queries[path] for previous, path in zip(paths, paths[1:4])
+    )
+
+
+def test_one_query():
+    sources = [make_source(f"{index}.mp4", 6, "city") for index in range(3)]
+
+    segments = plan_stock_segments(sources, 40, seed=2)
+
+    check_plan(segments, sources, 40)
+    assert {segment.source for segment in segments} == {"0.mp4", "1.mp4", "2.mp4"}
+
+
+def test_repeated_source_continues_where_its_clip_ended():
+    sources = [make_source("long.mp4", 20), make_source("short.mp4", 2)]
+
+    segments = plan_stock_segments(sources, 10, seed=3)
+
+    check_plan(segments, sources, 10)
+    long_clips = [
+        (segment.source_in, segment.source_out)
+        for segment in segments
+        if segment.source == "long.mp4"
+    ]
+    # Shortened to 4 seconds to fit, not the MAX_CLIP_SECONDS planned
+    assert long_clips == [(0, pytest.approx(4)), (pytest.approx(4), pytest.approx(8))]
+
+
+def test_footage_repeats_once_every_video_is_shown_whole():
+    sources = [make_source("a.mp4", 3), make_source("b.mp4", 4)]
+
+    segments = plan_stock_segments(sources, 12, seed=4)
+
+    check_plan(segments, sources, 12)
+    assert [segment.source_in for segment in segments] == [0, 0, 0, 0]
+
+
+def test_duration_ending_on_a_clip_boundary():
+    sources = [make_source(f"{index}.mp4", 10) for index in range(3)]
+
+    segments = plan_stock_segments(sources, 2 * MAX_CLIP_SECONDS, seed=5)
+
+    check_plan(segments, sources, 2 * MAX_CLIP_SECONDS)
+    assert [segment.duration for segment in segments] == [MAX_CLIP_SECONDS] * 2
+
+
+def test_same_seed_same_plan():
+    sources = [make_source(f"{index}.mp4", 8, str(index % 2)) for index in range(5)]
+
+    plans = [
+        [segment.to_dict() for segment in plan_stock_segments(sources, 30, seed=6)]
+        for _ in range(2)
+    ]
+
+    assert plans[0] == plans[1]
@@ -0,0 +1,18 @@
+import re
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizes a text so that trivially different texts (case, punctuation,
+    whitespace) map to the same key, e.g. image prompts or search terms.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text, lowercase words separated by single spaces.
+    """
+
+    text = text.lower()
+    text = re.sub(r"[^\w\s]", " ", text)
+    return " ".join(text.split())
@@ -7,11 +7,15 @@
 # --- MODIFIED VERSION --- #
 
 import base64
-import requests
 import threading
-
+import time
+from concurrent.futures import ThreadPoolExecutor
 from typing import List
+
 from termcolor import colored
+
+import metrics
+from speech import SegmentCache, assemble_speech, concat_mp3, split_sentences
 # from playsound import playsound
 
 
@@ -70,11 +74,16 @@ ENDPOINTS = [
     "https://tiktok-tts.weilnet.workers.dev/api/generation",
     "https://tiktoktts.com/api/tiktok-tts",
 ]
-current_endpoint = 0
 # in one conversion, the text can have a maximum length of 300 characters
 TEXT_BYTE_LIMIT = 300
 
 
+class TTSError(Exception):
+    """
+    Raised when no endpoint could synthesize a text.
+    """
+
+
 # create a list by splitting a string, every element has n chars
 def split_string(string: str, chunk_size: int) -> List[str]:
     words = string.split()
@@ -94,48 +103,210 @@ def split_string(string: str, chunk_size: int) -> List[str]:
     return result
 
 
-# checking if the website that provides the service is available
-def get_api_response() -> requests.Response:
-    url = f'{ENDPOINTS[current_endpoint].split("/a")[0]}'
-    response = requests.get(url)
-    return response
+# extract the base64 audio from the JSON response of an endpoint
+def extract_audio_base64(payload: dict) -> str:
+    for key in ("data", "audio", "audioUrl", "url"):
+        value = payload.get(key)
+        if isinstance(value, str) and value:
+            break
+    else:
+        raise TTSError(f"No audio in response: {str(payload)[:200]}")
+
+    if value == "error":
+        raise TTSError("This voice is unavailable right now")
+
+    # Some endpoints return a data URI, e.g. "data:audio/mpeg;base64,...."
+    if value.startswith("data:"):
+        value = value.split(",", 1)[1]
+
+    return value
+
+
+class TikTokSynthesizer:
+    """
+    Synthesizes speech with the TikTok TTS endpoints.
+
+    The health of every endpoint is cached for `health_ttl` seconds instead
+    of being checked before each request, and a failing endpoint is skipped
+    in favour of the next one. Text longer than the endpoint limit is split
+    into chunks that are synthesized on a bounded worker pool, decoded one
+    by one and joined at the MP3 frame level.
+    """
+
+    def __init__(
+        self,
+        endpoints: List[str] = None,
+        max_workers: int = 4,
+        health_ttl: float = 300,
+        timeout: float = 30,
+    ):
+        self.endpoints = list(endpoints or ENDPOINTS)
+        self.max_workers = max(1, max_workers)
+        self.health_ttl = health_ttl
+        self.timeout = timeout
+
+        # Imported here to keep `import main` fast for the other providers
+        import requests
+
+        self._session = requests.Session()
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._lock = threading.Lock()
+        # endpoint -> (healthy, time of the last check)
+        self._health = {}
+
+    def close(self) -> None:
+        """
+        Shuts down the worker pool and the HTTP session.
+        """
+
+        self._executor.shutdown(wait=True)
+        self._session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def is_healthy(self, endpoint: str) -> bool:
+        """
+        Returns the cached health of an endpoint, checking it again
+        once the cached state is older than `health_ttl`.
+        """
+        import requests
+
+        with self._lock:
+            state = self._health.get(endpoint)
+        if state is not None and time.time() - state[1] < self.health_ttl:
+            return state[0]
+
+        # Checked without the lock, so that a slow endpoint does not hold up
+        # the workers using the others
+        checked = time.time()
+        try:
+            base_url = endpoint.split("/api")[0]
+            with metrics.call("tiktok_health"):
+                healthy = self._session.get(base_url, timeout=self.timeout).ok
+        except requests.RequestException:
+            healthy = False
+
+        with self._lock:
+            # A request may have failed or succeeded on it in the meantime
+            state = self._health.get(endpoint)
+            if state is None or state[1] < checked:
+                self._health[endpoint] = (healthy, checked)
+        return healthy
+
+    def _set_health(self, endpoint: str, healthy: bool) -> None:
+        with self._lock:
+            self._health[endpoint] = (healthy, time.time())
+
+    def synthesize_chunk(self, text: str, voice: str) -> bytes:
+        """
+        Synthesizes a text of at most TEXT_BYTE_LIMIT characters on the first
+        healthy endpoint, failing over to the next one on errors.
+
+        Returns:
+            bytes: The decoded MP3 audio.
+        """
+        import requests
+
+        errors = []
+        for endpoint in self.endpoints:
+            if not self.is_healthy(endpoint):
+                continue
+
+            if errors:
+                metrics.count("retries")
+
+            try:
+                with metrics.call("tiktok_tts"):
+                    response = self._session.post(
+                        endpoint,
+                        headers={"Content-Type": "application/json"},
+                        json={"text": text, "voice": voice},
+                        timeout=self.timeout,
+                    )
+                    response.raise_for_status()
+                metrics.count("bytes_downloaded", len(response.content))
+                return base64.b64decode(extract_audio_base64(response.json()))
+            except TTSError as e:
+                # The endpoint works, but refused this voice or text
+                errors.append(f"{endpoint}: {e}")
+            except (requests.RequestException, ValueError) as e:
+                self._set_health(endpoint, False)
+                errors.append(f"{endpoint}: {e}")
+
+        if not errors:
+            raise TTSError(
+                "TTS Service not available and probably temporarily rate limited, try again later..."
+            )
+        raise TTSError("; ".join(errors))
+
+    def synthesize(self, text: str, voice: str) -> bytes:
+        """
+        Synthesizes a text of any length.
+
+        Returns:
+            bytes: The MP3 audio of the whole text.
+        """
+
+        return self.synthesize_script([text], voice)[0]
+
+    def synthesize_script(self, sentences: List[str], voice: str) -> List[bytes]:
+        """
+        Synthesizes all the sentences of a script at once.
+
+        The chunks of every sentence share one worker pool, so a script takes
+        about as long as its slowest chunk when there are enough workers.
+
+        Args:
+            sentences (List[str]): The sentences to synthesize.
+            voice (str): The TikTok voice.
+
+        Returns:
+            List[bytes]: The MP3 audio of every sentence, in order.
+        """
+
+        if voice not in VOICES:
+            raise TTSError(f"Voice not available: {voice}")
+
+        chunks = [split_string(sentence, TEXT_BYTE_LIMIT - 1) for sentence in sentences]
+        futures = [
+            [self._executor.submit(self.synthesize_chunk, chunk, voice) for chunk in parts]
+            for parts in chunks
+        ]
+
+        return [concat_mp3([future.result() for future in parts]) for parts in futures]
+
+
+_default_synthesizer = None
+
+
+def get_synthesizer() -> TikTokSynthesizer:
+    """
+    Returns the synthesizer shared by the module level helpers.
+    """
+
+    global _default_synthesizer
+
+    if _default_synthesizer is None:
+        _default_synthesizer = TikTokSynthesizer()
+    return _default_synthesizer
 
 
 # saving the audio file
-def save_audio_file(base64_data: str, filename: str = "output.mp3") -> None:
-    audio_bytes = base64.b64decode(base64_data)
+def save_audio_file(audio_bytes: bytes, filename: str = "output.mp3") -> None:
     with open(filename, "wb") as file:
         file.write(audio_bytes)
 
 
-# send POST request to get the audio data
-def generate_audio(text: str, voice: str) -> bytes:
-    url = f"{ENDPOINTS[current_endpoint]}"
-    headers = {"Content-Type": "application/json"}
-    data = {"text": text, "voice": voice}
-    response = requests.post(url, headers=headers, json=data)
-    return response.content
-
-
 # creates an text to speech audio file
 def tts(
     text: str,
     voice: str = "none",
     filename: str = "output.mp3",
 ) -> None:
-    # checking if the website is available
-    global current_endpoint
-
-    if get_api_response().status_code == 200:
-        print(colored("[+] TikTok TTS Service available!", "green"))
-    else:
-        current_endpoint = (current_endpoint + 1) % 2
-        if get_api_response().status_code == 200:
-            print(colored("[+] TTS Service available!", "green"))
-        else:
-            print(colored("[-] TTS Service not available and probably temporarily rate limited, try again later..." , "red"))
-            return
-
     # checking if arguments are valid
     if voice == "none":
         print(colored("[-] Please specify a voice", "red"))
@@ -151,81 +322,58 @@ def tts(
 
     # creating the audio file
     try:
-        if len(text) < TEXT_BYTE_LIMIT:
-            audio = generate_audio((text), voice)
-            if current_endpoint == 0:
-                audio_base64_data = str(audio).split('"')[5]
-            else:
-                audio_base64_data = str(audio).split('"')[3].split(",")[1]
-
-            if audio_base64_data == "error":
-                print(colored("[-] This voice is unavailable right now", "red"))
-                return
-
-        else:
-            # Split longer text into smaller parts
-            text_parts = split_string(text, 299)
-            audio_base64_data = [None] * len(text_parts)
-
-            # Define a thread function to generate audio for each text part
-            def generate_audio_thread(text_part, index):
-                audio = generate_audio(text_part, voice)
-                if current_endpoint == 0:
-                    base64_data = str(audio).split('"')[5]
-                else:
-                    base64_data = str(audio).split('"')[3].split(",")[1]
-
-                if audio_base64_data == "error":
-                    print(colored("[-] This voice is unavailable right now", "red"))
-                    return "error"
-
-                audio_base64_data[index] = base64_data
-
-            threads = []
-            for index, text_part in enumerate(text_parts):
-                # Create and start a new thread for each text part
-                thread = threading.Thread(
-                    target=generate_audio_thread, args=(text_part, index)
-                )
-                thread.start()
-                threads.append(thread)
-
-            # Wait for all threads to complete
-            for thread in threads:
-                thread.join()
-
-            # Concatenate the base64 data in the correct order
-            audio_base64_data = "".join(audio_base64_data)
-
-        save_audio_file(audio_base64_data, filename)
+        save_audio_file(get_synthesizer().synthesize(text, voice), filename)
         print(colored(f"[+] Audio file saved successfully as '{filename}'", "green"))
 
     except Exception as e:
         print(colored(f"[-] An error occurred during TTS: {e}", "red"))
 
 
-def generate_speech_from_script(self, script):
+def generate_speech_from_script(
+    script: str,
+    project_space: str,
+    voice: str,
+    cache: SegmentCache = None,
+    synthesizer: TikTokSynthesizer = None,
+) -> str:
     """
     Generate speech from script using TikTokVoice.
-    """
 
-    # Split script into sentences
-    sentences = script.split(". ")
-
-    # Remove empty strings
-    sentences = list(filter(lambda x: x != "", sentences))
-    temp_tts_paths = []
+    Sentences that are not cached yet are synthesized in one batch, then the
+    segments are joined into speech.mp3 with a timing sidecar.
 
-    # Generate TTS for every sentence
-    for sentence in sentences:
-        current_tts_path = f"{self.project_space}/audio/{uuid.uuid4()}.mp3"
-        tts(sentence, self.config.voice, filename=current_tts_path)
-        audio_clip = AudioFileClip(current_tts_path)
-        temp_tts_paths.append(audio_clip)
+    Returns:
+        str: The path to the speech file.
+    """
 
-    # Combine all TTS files using moviepy
-    final_audio = concatenate_audioclips(temp_tts_paths)
-    final_tts_path = f"{self.project_space}/audio/{uuid.uuid4()}.mp3"
-    final_audio.write_audiofile(final_tts_path)
+    synthesizer = synthesizer or get_synthesizer()
+    cache = cache or SegmentCache()
 
-    return final_tts_path, temp_tts_paths, sentences
+    # Split script into sentences
+    sentences = split_sentences(script)
+
+    segment_paths = [cache.get("tiktok", voice, "tiktok", sentence) for sentence in sentences]
+    pending = [i for i, path in enumerate(segment_paths) if path is None]
+
+    print(
+        colored(
+            f"[+] Synthesizing {len(pending)} of {len(sentences)} sentences "
+            f"({len(sentences) - len(pending)} cached)...",
+            "blue",
+        )
+    )
+
+    # Generate TTS for every uncached sentence at once
+    audio = synthesizer.synthesize_script([sentences[i] for i in pending], voice)
+    for i, data in zip(pending, audio):
+        segment_paths[i] = cache.put("tiktok", voice, "tiktok", sentences[i], data)
+
+    speech_path = f"{project_space}/audio/speech.mp3"
+    assemble_speech(
+        sentences,
+        segment_paths,
+        speech_path,
+        {"provider": "tiktok", "voice": voice, "model": "tiktok"},
+    )
+
+    return speech_path
@@ -0,0 +1,558 @@
+import json
+import os
+import random
+import re
+from typing import Dict, List, Optional
+
+# The timeline of a project is saved next to its outputs
+TIMELINE_FILE = "render_plan.json"
+TIMELINE_VERSION = 2
+
+# Aspect ratio (width / height) of the vertical videos
+VERTICAL_ASPECT = 0.5625
+
+# Longest stretch of a stock video shown at once, and shortest continuation
+# of a stock video worth showing again
+MAX_CLIP_SECONDS = 5.0
+MIN_CLIP_SECONDS = 1.5
+
+
+class Segment:
+    """
+    A span of a source placed on the video track: the edit decision of a
+    single clip or slide.
+
+    Source paths are relative to the project space. `crop` is the
+    [x1, y1, x2, y2] box kept from the source frame, before scaling to the
+    timeline size, and `effect` an optional effect applied after scaling,
+    e.g. {"name": "zoom_in", "ratio": 0.04}.
+    """
+
+    def __init__(
+        self,
+        source: str,
+        kind: str = "video",
+        start: float = 0.0,
+        source_in: float = 0.0,
+        source_out: float = 0.0,
+        crop: List[float] = None,
+        effect: dict = None,
+    ):
+        self.source = source
+        self.kind = kind
+        self.start = start
+        self.source_in = source_in
+        self.source_out = source_out
+        self.crop = crop
+        self.effect = effect
+
+    @property
+    def duration(self) -> float:
+        return self.source_out - self.source_in
+
+    @property
+    def end(self) -> float:
+        return self.start + self.duration
+
+    def to_dict(self) -> dict:
+        return {
+            "source": self.source,
+            "kind": self.kind,
+            "start": self.start,
+            "in": self.source_in,
+            "out": self.source_out,
+            "crop": self.crop,
+            "effect": self.effect,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Segment":
+        return cls(
+            data["source"],
+            data["kind"],
+            data["start"],
+            data["in"],
+            data["out"],
+            data.get("crop"),
+            data.get("effect"),
+        )
+
+
+class SubtitleEvent:
+    """
+    A caption shown from `start` to `end`.
+    """
+
+    def __init__(self, start: float, end: float, text: str):
+        self.start = start
+        self.end = end
+        self.text = text
+
+    def to_dict(self) -> dict:
+        return {"start": self.start, "end": self.end, "text": self.text}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "SubtitleEvent":
+        return cls(data["start"], data["end"], data["text"])
+
+
+class AudioBed:
+    """
+    An audio source mixed under the whole video, e.g. the speech or the
+    background music. `offset` is the position in the source the bed starts
+    from, and `volume` its gain.
+    """
+
+    def __init__(
+        self, name: str, source: str, offset: float = 0.0, volume: float = 1.0
+    ):
+        self.name = name
+        self.source = source
+        self.offset = offset
+        self.volume = volume
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "source": self.source,
+            "offset": self.offset,
+            "volume": self.volume,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "AudioBed":
+        return cls(data["name"], data["source"], data["offset"], data["volume"])
+
+
+class Timeline:
+    """
+    Edit decision list of a video: a video track of segments, the subtitle
+    events with their style, and the audio beds.
+
+    The timeline is produced by the planning functions below and consumed by
+    the renderers, so a video can be rendered again (at another quality, or
+    by another renderer) without redoing any planning, download or API call.
+
+    A preview may be planned on proxies, small renditions of the stock
+    videos: `proxies` maps the path of each proxy to the "url" and "path"
+    of its full resolution rendition and to the "size" of the proxy, so
+    that the final render can replace it, see `conform_proxies`.
+    """
+
+    def __init__(self, size: List[int] = None, fps: float = 30, seed: int = None):
+        self.size = list(size or [1080, 1920])
+        self.fps = fps
+        self.seed = seed
+        self.video: List[Segment] = []
+        self.subtitles: List[SubtitleEvent] = []
+        self.subtitle_style: Optional[dict] = None
+        self.audio: List[AudioBed] = []
+        self.proxies: Dict[str, dict] = {}
+
+    @property
+    def duration(self) -> float:
+        return max((segment.end for segment in self.video), default=0.0)
+
+    def audio_bed(self, name: str) -> Optional[AudioBed]:
+        """
+        Returns the audio bed called `name`, or None.
+        """
+
+        return next((bed for bed in self.audio if bed.name == name), None)
+
+    def set_audio_bed(self, name: str, bed: Optional[AudioBed]) -> None:
+        """
+        Replaces (or removes, if `bed` is None) the audio bed called `name`.
+        """
+
+        self.audio = [other for other in self.audio if other.name != name]
+        if bed is not None:
+            self.audio.append(bed)
+
+    def sources(self) -> List[str]:
+        """
+        Returns the project files the video track is rendered from.
+        """
+
+        return sorted({segment.source for segment in self.video})
+
+    def to_dict(self) -> dict:
+        return {
+            "version": TIMELINE_VERSION,
+            "size": self.size,
+            "fps": self.fps,
+            "seed": self.seed,
+            "tracks": {
+                "video": [segment.to_dict() for segment in self.video],
+                "subtitles": {
+                    "style": self.subtitle_style,
+                    "events": [event.to_dict() for event in self.subtitles],
+                },
+                "audio": [bed.to_dict() for bed in self.audio],
+            },
+            "proxies": self.proxies,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Timeline":
+        if data.get("version") != TIMELINE_VERSION:
+            raise ValueError(f"Unsupported timeline version: {data.get('version')}")
+
+        timeline = cls(data["size"], data["fps"], data.get("seed"))
+        tracks = data["tracks"]
+        timeline.video = [Segment.from_dict(segment) for segment in tracks["video"]]
+        timeline.subtitle_style = tracks["subtitles"]["style"]
+        timeline.subtitles = [
+            SubtitleEvent.from_dict(event) for event in tracks["subtitles"]["events"]
+        ]
+        timeline.audio = [AudioBed.from_dict(bed) for bed in tracks["audio"]]
+        timeline.proxies = data.get("proxies", {})
+        return timeline
+
+    def save(self, project_space: str) -> str:
+        """
+        Writes the timeline to the project space.
+
+        Returns:
+            str: The path to the timeline.
+        """
+
+        path = f"{project_space}/{TIMELINE_FILE}"
+        with open(f"{path}.part", "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(f"{path}.part", path)
+
+        return path
+
+    @classmethod
+    def load(cls, project_space: str) -> "Timeline":
+        """
+        Reads the timeline of a project, or returns an empty timeline if the
+        project has none yet.
+        """
+
+        path = f"{project_space}/{TIMELINE_FILE}"
+        if not os.path.exists(path):
+            return cls()
+
+        with open(path, "r", encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+    def diff(self, other: "Timeline") -> List[str]:
+        """
+        Compares two timelines.
+
+        Returns:
+            List[str]: A description of every difference, empty if the
+                timelines render the same video.
+        """
+
+        changes = []
+
+        for key in ("size", "fps"):
+            if getattr(self, key) != getattr(other, key):
+                changes.append(f"{key}: {getattr(self, key)} -> {getattr(other, key)}")
+
+        def compare(track, before, after):
+            for i in range(max(len(before), len(after))):
+                old = before[i].to_dict() if i < len(before) else None
+                new = after[i].to_dict() if i < len(after) else None
+                if old != new:
+                    changes.append(f"{track}[{i}]: {old} -> {new}")
+
+        compare("video", self.video, other.video)
+        compare("subtitles", self.subtitles, other.subtitles)
+        if self.subtitle_style != other.subtitle_style:
+            changes.append(
+                f"subtitle style: {self.subtitle_style} -> {other.subtitle_style}"
+            )
+        compare(
+            "audio",
+            sorted(self.audio, key=lambda bed: bed.name),
+            sorted(other.audio, key=lambda bed: bed.name),
+        )
+
+        return changes
+
+
+def center_crop(
+    width: int, height: int, aspect: float = VERTICAL_ASPECT
+) -> List[float]:
+    """
+    Returns the largest centered [x1, y1, x2, y2] box of a frame with the
+    given aspect ratio (width / height).
+    """
+
+    if round((width / height), 4) < aspect:
+        crop_width, crop_height = width, round(width / aspect)
+    else:
+        crop_width, crop_height = round(aspect * height), height
+
+    return [
+        width / 2 - crop_width / 2,
+        height / 2 - crop_height / 2,
+        width / 2 + crop_width / 2,
+        height / 2 + crop_height / 2,
+    ]
+
+
+def scale_crop(
+    crop: Optional[List[float]], scale_x: float, scale_y: float
+) -> Optional[List[float]]:
+    """
+    Returns the [x1, y1, x2, y2] box of `crop` in a rendition of its frame
+    `scale_x` times as wide and `scale_y` times as high.
+    """
+
+    if not crop:
+        return crop
+
+    x1, y1, x2, y2 = crop
+    return [x1 * scale_x, y1 * scale_y, x2 * scale_x, y2 * scale_y]
+
+
+def proxy_rendition(renditions: List[dict], size: List[int]) -> dict:
+    """
+    Returns the smallest of the renditions of a stock video whose center
+    crop fills a frame of the given size (the largest one if none does).
+
+    Args:
+        renditions (List[dict]): The "width" and "height" of every
+            rendition, from the smallest to the largest.
+        size (List[int]): The size of the frame, e.g. of a preview.
+
+    Returns:
+        dict: The rendition.
+    """
+
+    for rendition in renditions:
+        x1, y1, x2, y2 = center_crop(
+            rendition["width"], rendition["height"], size[0] / size[1]
+        )
+        if x2 - x1 >= size[0] - 1 and y2 - y1 >= size[1] - 1:
+            return rendition
+
+    return renditions[-1]
+
+
+def fit_crop(
+    crop: Optional[List[float]], width: int, height: int, aspect: float
+) -> List[float]:
+    """
+    Returns the largest [x1, y1, x2, y2] box of a frame with the given aspect
+    ratio (width / height), centered on the planned `crop` (or on the frame
+    if None) and moved back inside the frame if needed.
+
+    This derives the crop of every output format from the single crop of the
+    plan, e.g. a 1:1 or 16:9 box around the same subject as the 9:16 one.
+    """
+
+    x1, y1, x2, y2 = center_crop(width, height, aspect)
+    crop_width, crop_height = x2 - x1, y2 - y1
+
+    if crop:
+        center_x, center_y = (crop[0] + crop[2]) / 2, (crop[1] + crop[3]) / 2
+    else:
+        center_x, center_y = width / 2, height / 2
+
+    x1 = min(max(center_x - crop_width / 2, 0), width - crop_width)
+    y1 = min(max(center_y - crop_height / 2, 0), height - crop_height)
+
+    return [x1, y1, x1 + crop_width, y1 + crop_height]
+
+
+def interleave_by_query(sources: List[dict], rng: random.Random) -> List[dict]:
+    """
+    Shuffles the stock videos, alternating between the search terms that
+    found them, so that consecutive clips show different subjects.
+    """
+
+    groups = {}
+    for source in sources:
+        groups.setdefault(source.get("query"), []).append(source)
+    groups = list(groups.values())
+    for group in groups:
+        rng.shuffle(group)
+    rng.shuffle(groups)
+
+    order = []
+    for index in range(max(len(group) for group in groups)):
+        order += [group[index] for group in groups if index < len(group)]
+    return order
+
+
+def fill_lengths(capacities: List[float], duration: float) -> List[float]:
+    """
+    Splits `duration` between clips as evenly as their `capacities` allow:
+    the shorter clips are used whole, the others share the rest.
+    """
+
+    lengths = [0.0] * len(capacities)
+    remaining = duration
+    by_capacity = sorted(range(len(capacities)), key=lambda index: capacities[index])
+    for rank, index in enumerate(by_capacity):
+        lengths[index] = min(capacities[index], remaining / (len(capacities) - rank))
+        remaining -= lengths[index]
+    return lengths
+
+
+def plan_stock_segments(
+    sources: List[dict],
+    max_duration: float,
+    seed: int = None,
+    max_clip_seconds: float = MAX_CLIP_SECONDS,
+) -> List[Segment]:
+    """
+    Chooses, orders, trims and crops the stock videos to fill `max_duration`.
+
+    Only as many videos as needed are used, each for at most
+    `max_clip_seconds`, alternating between the search terms. Every video
+    is shown once before any is shown again, and a video shown again
+    continues exactly where its last clip ended. Footage is repeated once
+    the rest of every video is too short for another clip. The videos not
+    in the plan need not be downloaded.
+
+    The sources are shuffled with a generator seeded by `seed`, so the same
+    sources and seed always give the same segments.
+
+    Args:
+        sources (List[dict]): The "path", "width", "height" and "duration"
+            of every stock video, and optionally the "query" that found it.
+        max_duration (float): The duration of the video to fill.
+        seed (int): The seed of the shuffle.
+        max_clip_seconds (float): The longest clip of a video.
+
+    Returns:
+        List[Segment]: The segments of the video track.
+    """
+
+    sources = [source for source in sources if source["duration"] > 0]
+    if not sources:
+        raise ValueError("No stock videos to plan")
+
+    order = interleave_by_query(sources, random.Random(seed))
+
+    # Clips of [source, seconds available, whether it continues the last
+    # clip of its video], taken in order until they can fill the duration
+    clips = []
+    last_round = []
+    candidates = [[source, source["duration"], False] for source in order]
+    while sum(min(clip[1], max_clip_seconds) for clip in clips) < max_duration:
+        if not candidates:
+            # Every video is used: continue them after their clips, or
+            # repeat them once all their footage is shown. A clip may end
+            # up shorter than max_clip_seconds, leaving more footage
+            # available than counted here.
+            candidates = [
+                [source, available - max_clip_seconds, True]
+                for source, available, _ in last_round
+                if available - max_clip_seconds >= MIN_CLIP_SECONDS
+            ] or [[source, source["duration"], False] for source in order]
+            last_round = []
+        clips.append(candidates.pop(0))
+        last_round.append(clips[-1])
+
+    lengths = fill_lengths(
+        [min(available, max_clip_seconds) for _, available, _ in clips], max_duration
+    )
+
+    segments = []
+    start = 0.0
+    # Where the last clip of every video ended
+    source_outs = {}
+    for (source, _, continues), length in zip(clips, lengths):
+        source_in = source_outs[source["path"]] if continues else 0.0
+        source_outs[source["path"]] = source_in + length
+        segments.append(
+            Segment(
+                source["path"],
+                "video",
+                start=start,
+                source_in=source_in,
+                source_out=source_in + length,
+                crop=center_crop(source["width"], source["height"]),
+            )
+        )
+        start += length
+
+    return segments
+
+
+def plan_slide_segments(
+    images: List[str],
+    image_duration: float,
+    max_duration: float,
+    zoom_ratio: float = 0.04,
+) -> List[Segment]:
+    """
+    Gives every generated image a slot of `image_duration` seconds, with a
+    slow zoom, until `max_duration` is filled.
+
+    Args:
+        images (List[str]): The images, in prompt order.
+        image_duration (float): The duration of every slide.
+        max_duration (float): The duration of the video to fill.
+        zoom_ratio (float): The zoom speed of the slides.
+
+    Returns:
+        List[Segment]: The segments of the video track.
+    """
+
+    segments = []
+    duration_left = max_duration
+    for image in images:
+        duration = duration_left if duration_left < 5 else image_duration
+        segments.append(
+            Segment(
+                image,
+                "image",
+                start=max_duration - duration_left,
+                source_in=0.0,
+                source_out=duration,
+                effect={"name": "zoom_in", "ratio": zoom_ratio},
+            )
+        )
+        if duration_left < 5:
+            break
+        duration_left -= image_duration
+
+    return segments
+
+
+def parse_srt_time(timestamp: str) -> float:
+    """
+    Converts an SRT timestamp (HH:MM:SS,mmm) to seconds.
+    """
+
+    hours, minutes, seconds = timestamp.strip().replace(",", ".").split(":")
+    return int(hours) * 3600 + int(minutes) * 60 + float(seconds)
+
+
+def read_subtitle_events(subtitles_path: str) -> List[SubtitleEvent]:
+    """
+    Reads the captions of an SRT file.
+
+    Returns:
+        List[SubtitleEvent]: The captions.
+    """
+
+    with open(subtitles_path, "r", encoding="utf-8") as f:
+        blocks = re.split(r"\n\s*\n", f.read().strip())
+
+    events = []
+    for block in blocks:
+        lines = block.strip().splitlines()
+        timing = next((i for i, line in enumerate(lines) if "-->" in line), None)
+        if timing is None:
+            continue
+
+        start, end = lines[timing].split("-->")
+        events.append(
+            SubtitleEvent(
+                parse_srt_time(start),
+                parse_srt_time(end),
+                "\n".join(lines[timing + 1 :]),
+            )
+        )
+
+    return events
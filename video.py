@@ -1,31 +1,58 @@
 import math
 import os
-import random
 import uuid
-from datetime import timedelta
-from typing import List
-
-import assemblyai as aai
-import moviepy.editor as mp
-import numpy
-import requests
-import srt_equalizer
-from moviepy.editor import (
-    AudioFileClip,
-    CompositeVideoClip,
-    TextClip,
-    VideoFileClip,
-    concatenate_videoclips,
-)
-from moviepy.video.fx.all import crop
-from moviepy.video.tools.subtitles import SubtitlesClip
-from openai import OpenAI
-from PIL import Image
+from contextlib import ExitStack
+from typing import List, Tuple
+
 from termcolor import colored
 
+import metrics
+from captions import burn_captions
+from encoder import FrameWriter
+from fetch import download_prefix, download_video, probe_video
+from chunks import (
+    CHUNKS_FOLDER,
+    chunk_key,
+    concat_chunks,
+    events_between,
+    mux_audio,
+    plan_chunks,
+    segments_between,
+    source_fingerprint,
+)
+from profiler import write_videofile
+from profiles import profile_encoder_options, profile_path, profile_style
+from readahead import ReadAheadReader, chain_readers, close_readers, read_ahead_clip
+from render_modes import encoder_options, render_settings, scaled_size
+from slides import SlideCache, image_size, slide_clip
+from timeline import (
+    Segment,
+    SubtitleEvent,
+    Timeline,
+    fit_crop,
+    plan_slide_segments,
+    plan_stock_segments,
+    scale_crop,
+)
+from speech import decode_audio, detect_pauses, load_segments
+
+# moviepy, the API clients, requests, srt_equalizer, NumPy and PIL are
+# imported by the functions that use them: importing them all takes seconds,
+# which every short-lived worker process would pay even for stages that
+# never render.
+
 ASSEMBLY_AI_API_KEY = os.getenv("ASSEMBLY_AI_API_KEY")
 
 
+def frame_count(clip) -> int:
+    """
+    Returns the number of frames `write_videofile` encodes for a clip, or
+    the renderers for a timeline: one every 1 / fps seconds in [0, duration).
+    """
+
+    return math.ceil(round(clip.duration * clip.fps, 6))
+
+
 def save_video(video_url: str, directory: str = "temp") -> str:
     """
     Saves a video from a given URL and returns the path to the video.
@@ -37,12 +64,9 @@ def save_video(video_url: str, directory: str = "temp") -> str:
     Returns:
         str: The path to the saved video.
     """
-    video_id = uuid.uuid4()
-    video_path = f"{directory}/{video_id}.mp4"
-    with open(video_path, "wb") as f:
-        f.write(requests.get(video_url).content)
 
-    return video_path
+    video_id = uuid.uuid4()
+    return download_video(video_url, f"{directory}/{video_id}.mp4")
 
 
 def __generate_subtitles_assemblyai(audio_path: str, voice: str, api_key: str) -> str:
@@ -55,6 +79,7 @@ def __generate_subtitles_assemblyai(audio_path: str, voice: str, api_key: str) -
     Returns:
         str: The generated subtitles
     """
+    import assemblyai as aai
 
     language_mapping = {
         "br": "pt",
@@ -71,57 +96,164 @@ def __generate_subtitles_assemblyai(audio_path: str, voice: str, api_key: str) -
     aai.settings.api_key = api_key
     config = aai.TranscriptionConfig(language_code=lang_code)
     transcriber = aai.Transcriber(config=config)
-    transcript = transcriber.transcribe(audio_path)
+    metrics.count("bytes_uploaded", os.path.getsize(audio_path))
+    with metrics.call("assemblyai_transcribe"):
+        transcript = transcriber.transcribe(audio_path)
     subtitles = transcript.export_subtitles_srt(chars_per_caption=64)
 
     return subtitles
 
 
 def __generate_subtitles_whisper(audio_path: str, openai_api_key: str) -> str:
+    from openai import OpenAI
 
     client = OpenAI(api_key=openai_api_key)
     audio_file = open(audio_path, "rb")
-    transcript = client.audio.transcriptions.create(
-        model="whisper-1", file=audio_file, response_format="srt"
-    )
+    metrics.count("bytes_uploaded", os.path.getsize(audio_path))
+    with metrics.call("openai_transcribe"):
+        transcript = client.audio.transcriptions.create(
+            model="whisper-1", file=audio_file, response_format="srt"
+        )
 
     print(transcript)
 
     return transcript
 
 
+def __split_caption(
+    text: str,
+    start: float,
+    end: float,
+    pauses: List[Tuple[float, float]],
+    max_chars: int,
+    tolerance: float = 0.3,
+) -> List[Tuple[float, float, str]]:
+    """
+    Splits a long sentence into caption sized chunks.
+
+    Word times are estimated from the character count, and chunk boundaries
+    are moved onto pauses in the speech when one is close enough.
+
+    Args:
+        text (str): The sentence.
+        start (float): The start time of the sentence in seconds.
+        end (float): The end time of the sentence in seconds.
+        pauses (List[Tuple[float, float]]): The pauses detected in the speech.
+        max_chars (int): The maximum number of characters per chunk.
+        tolerance (float): How far a boundary may move to reach a pause.
+
+    Returns:
+        List[Tuple[float, float, str]]: The start, end and text of every chunk.
+    """
+
+    words = text.split()
+    if len(text) <= max_chars or len(words) < 2:
+        return [(start, end, text)]
+
+    # Estimated time of the boundary before every word but the first
+    total_chars = len(" ".join(words))
+    boundary_times = [start]
+    chars = 0
+    for word in words[:-1]:
+        chars += len(word) + 1
+        boundary_times.append(start + (end - start) * chars / total_chars)
+
+    pause_times = [(a + b) / 2 for a, b in pauses if start < (a + b) / 2 < end]
+
+    def nearest_pause(t):
+        return min(pause_times, key=lambda p: abs(p - t), default=None)
+
+    chunks = []
+    first_word, chunk_start = 0, start
+    while first_word < len(words):
+        remaining = " ".join(words[first_word:])
+        if len(remaining) <= max_chars or first_word == len(words) - 1:
+            chunks.append((chunk_start, end, remaining))
+            break
+
+        # Every boundary that keeps the chunk within max_chars
+        candidates = []
+        length = -1
+        for boundary in range(first_word + 1, len(words)):
+            length += len(words[boundary - 1]) + 1
+            if length > max_chars and candidates:
+                break
+            candidates.append((boundary, length))
+
+        # Prefer a boundary close to a pause, otherwise fill the chunk
+        aligned = [
+            boundary
+            for boundary, length in candidates
+            if length >= max_chars // 2
+            and nearest_pause(boundary_times[boundary]) is not None
+            and abs(nearest_pause(boundary_times[boundary]) - boundary_times[boundary])
+            <= tolerance
+        ]
+        if aligned:
+            boundary = min(
+                aligned,
+                key=lambda b: abs(nearest_pause(boundary_times[b]) - boundary_times[b]),
+            )
+            boundary_time = nearest_pause(boundary_times[boundary])
+        else:
+            boundary = candidates[-1][0]
+            boundary_time = boundary_times[boundary]
+
+        boundary_time = max(boundary_time, chunk_start + 0.001)
+        chunks.append((chunk_start, boundary_time, " ".join(words[first_word:boundary])))
+        first_word, chunk_start = boundary, boundary_time
+
+    return chunks
+
+
 def __generate_subtitles_locally(
-    sentences: List[str], audio_clips: List[AudioFileClip]
+    sentences: List[str],
+    durations: List[float],
+    audio_path: str = None,
+    max_chars: int = 64,
 ) -> str:
     """
-    Generates subtitles from a given audio file and returns the path to the subtitles.
+    Generates subtitles from the durations of the individual speech segments,
+    without transcribing the audio.
 
     Args:
         sentences (List[str]): all the sentences said out loud in the audio clips
-        audio_clips (List[AudioFileClip]): all the individual audio clips which will make up the final audio track
+        durations (List[float]): the duration of the audio segment of every sentence
+        audio_path (str): the speech file, analyzed to split long sentences on pauses
+        max_chars (int): the maximum number of characters per caption
     Returns:
         str: The generated subtitles
     """
 
     def convert_to_srt_time_format(total_seconds):
         # Convert total seconds to the SRT time format: HH:MM:SS,mmm
-        if total_seconds == 0:
-            return "0:00:00,0"
-        return str(timedelta(seconds=total_seconds)).rstrip("0").replace(".", ",")
+        milliseconds = round(total_seconds * 1000)
+        hours, milliseconds = divmod(milliseconds, 3_600_000)
+        minutes, milliseconds = divmod(milliseconds, 60_000)
+        seconds, milliseconds = divmod(milliseconds, 1000)
+        return f"{hours:02d}:{minutes:02d}:{seconds:02d},{milliseconds:03d}"
+
+    # Only decode the speech if a sentence is too long for a single caption
+    pauses = []
+    if audio_path and any(len(sentence) > max_chars for sentence in sentences):
+        pauses = detect_pauses(decode_audio(audio_path))
 
     start_time = 0
-    subtitles = []
+    captions = []
 
-    for i, (sentence, audio_clip) in enumerate(zip(sentences, audio_clips), start=1):
-        duration = audio_clip.duration
+    for sentence, duration in zip(sentences, durations):
         end_time = start_time + duration
+        captions.extend(
+            __split_caption(sentence, start_time, end_time, pauses, max_chars)
+        )
+        start_time = end_time  # Update start time for the next subtitle
 
+    subtitles = []
+    for i, (start, end, text) in enumerate(captions, start=1):
         # Format: subtitle index, start time --> end time, sentence
-        subtitle_entry = f"{i}\n{convert_to_srt_time_format(start_time)} --> {convert_to_srt_time_format(end_time)}\n{sentence}\n"
+        subtitle_entry = f"{i}\n{convert_to_srt_time_format(start)} --> {convert_to_srt_time_format(end)}\n{text}\n"
         subtitles.append(subtitle_entry)
 
-        start_time += duration  # Update start time for the next subtitle
-
     return "\n".join(subtitles)
 
 
@@ -130,24 +262,43 @@ def generate_subtitles(
     voice: str,
     api_key: str = "",
     openai_api_key: str = "",
-) -> str:
+    method: str = "auto",
+) -> List[SubtitleEvent]:
     """
-    Generates subtitles from a given audio file and returns the path to the subtitles.
+    Generates subtitles from a given audio file, saves them to
+    `subtitles/subtitles.srt` and returns them.
+
+    With the "local" method (and with "auto" when the speech timing sidecar
+    exists) the subtitles are built from the durations of the speech segments,
+    offline. Otherwise the speech is transcribed with AssemblyAI or Whisper.
 
     Args:
-        audio_path (str): The path to the audio file to generate subtitles from.
-        sentences (List[str]): all the sentences said out loud in the audio clips
-        audio_clips (List[AudioFileClip]): all the individual audio clips which will make up the final audio track
+        project_space (str): The project folder.
+        voice (str): The language of the speech.
+        api_key (str): The AssemblyAI API key.
+        openai_api_key (str): The OpenAI API key.
+        method (str): One of "auto", "local", "assemblyai" or "whisper".
 
     Returns:
-        str: The path to the generated subtitles.
+        List[SubtitleEvent]: The captions, split to at most 32 characters.
     """
 
     print(colored("[+] Generating subtitles...", "green"))
 
     audio_path = f"{project_space}/audio/speech.mp3"
+    segments = load_segments(project_space) if method in ("auto", "local") else None
+
+    if method == "local" and not segments:
+        print(colored("[-] No speech timings found, transcribing instead", "yellow"))
 
-    if api_key is not None and api_key != "":
+    if segments:
+        print(colored("[+] Creating subtitles from the speech timings", "green"))
+        subtitles = __generate_subtitles_locally(
+            [segment["text"] for segment in segments],
+            [segment["duration"] for segment in segments],
+            audio_path,
+        )
+    elif api_key is not None and api_key != "" and method != "whisper":
         print(colored("[+] Creating subtitles using AssemblyAI", "green"))
         subtitles = __generate_subtitles_assemblyai(audio_path, voice, api_key)
     elif openai_api_key is not None and openai_api_key != "":
@@ -155,175 +306,215 @@ def generate_subtitles(
         subtitles = __generate_subtitles_whisper(audio_path, openai_api_key)
     else:
         print(colored("[+] No valid method provided for generating subtitles", "red"))
+        return None
 
-    subtitles_path = f"{project_space}/subtitles/subtitles.srt"
+    # Equalize subtitles, like srt_equalizer.equalize_srt_file but in memory
+    import srt
+    from srt_equalizer import split_subtitle
 
-    with open(subtitles_path, "w", encoding="utf-8") as file:
-        file.write(subtitles.strip())
+    captions = []
+    for caption in srt.parse(subtitles.strip()):
+        start_from_index = captions[-1].index if captions else 0
+        captions.extend(split_subtitle(caption, 32, start_from_index))
 
-    # Equalize subtitles
-    srt_equalizer.equalize_srt_file(subtitles_path, subtitles_path, 32)
+    subtitles_path = f"{project_space}/subtitles/subtitles.srt"
+    with open(subtitles_path, "w", encoding="utf-8") as file:
+        file.write(srt.compose(captions))
 
     print(colored("[+] Done generating subtitles.", "green"))
 
+    return [
+        SubtitleEvent(
+            caption.start.total_seconds(),
+            caption.end.total_seconds(),
+            caption.content,
+        )
+        for caption in captions
+    ]
 
-def combine_videos(
-    video_paths: List[str], max_duration: int, threads: int, project_space: str
-) -> str:
+
+def stock_candidates(video_urls: List[str], folder: str = "videos") -> List[dict]:
+    """
+    Returns the stock videos to probe for URLs, each with a "path" to
+    download it to, relative to the project space.
     """
-    Combines a list of videos into one video and returns the path to the combined video.
+
+    return [
+        {"url": video_url, "path": f"{folder}/{uuid.uuid4()}.mp4"}
+        for video_url in dict.fromkeys(video_urls)
+    ]
+
+
+def probe_stock_videos(candidates: List[dict], project_space: str) -> List[dict]:
+    """
+    Reads the dimensions and duration of the stock videos.
+
+    Where the server allows it, only the index of a video is downloaded,
+    and the video itself by `fetch_stock_videos` once the clips are
+    planned. The other videos are downloaded whole.
 
     Args:
-        video_paths (List): A list of paths to the videos to combine.
-        max_duration (int): The maximum duration of the combined video.
-        max_clip_duration (int): The maximum duration of each clip.
-        threads (int): The number of threads to use for the video processing.
+        candidates (List[dict]): The "url" of every video and the "path" to
+            download it to, relative to the project space.
+        project_space (str): The project folder.
 
     Returns:
-        str: The path to the combined video.
+        List[dict]: The candidates that could be read, with the "width",
+            "height" and "duration" of their video, and its "index" if it
+            is not downloaded yet.
     """
-    video_id = uuid.uuid4()
-    combined_video_path = f"{project_space}/videos/final_raw.mp4"
-
-    # Required duration of each clip
-    # req_dur = max_duration / len(video_paths)
-
-    print(colored("[+] Combining videos...", "blue"))
-    # print(colored(f"[+] Each clip will be maximum {req_dur} seconds long.", "blue"))
-
-    clips = []
-    tot_dur = 0
-    # Add downloaded clips over and over until the duration of the audio (max_duration) has been reached
-    random.shuffle(video_paths)
-    while tot_dur < max_duration:
-        for video_path in video_paths:
-            saved_video_path = save_video(video_path, f"{project_space}/videos")
-            clip = VideoFileClip(saved_video_path)
-            clip = clip.without_audio()
-            # Check if clip is longer than the remaining audio
-            if (max_duration - tot_dur) < clip.duration:
-                clip = clip.subclip(0, (max_duration - tot_dur))
-            # Only shorten clips if the calculated clip length (req_dur) is shorter than the actual clip to prevent still image
-            # elif req_dur < clip.duration:
-            #     clip = clip.subclip(0, req_dur)
-            # clip = clip.set_fps(30)
-
-            # Not all videos are same size,
-            # so we need to resize them
-            if round((clip.w / clip.h), 4) < 0.5625:
-                clip = crop(
-                    clip,
-                    width=clip.w,
-                    height=round(clip.w / 0.5625),
-                    x_center=clip.w / 2,
-                    y_center=clip.h / 2,
+    from moviepy.editor import VideoFileClip
+
+    sources = []
+    for candidate in candidates:
+        path = f"{project_space}/{candidate['path']}"
+        try:
+            index = probe_video(candidate["url"])
+            if index is not None:
+                sources.append(
+                    {
+                        **candidate,
+                        "width": index["width"],
+                        "height": index["height"],
+                        "duration": index["duration"],
+                        "index": index,
+                    }
                 )
-            else:
-                clip = crop(
-                    clip,
-                    width=round(0.5625 * clip.h),
-                    height=clip.h,
-                    x_center=clip.w / 2,
-                    y_center=clip.h / 2,
-                )
-            clip = clip.resize((1080, 1920))
+                continue
+
+            download_video(candidate["url"], path)
+        except Exception:
+            print(colored(f"[-] Could not download video: {candidate['url']}", "red"))
+            continue
+
+        clip = VideoFileClip(path, audio=False)
+        sources.append(
+            {
+                **candidate,
+                "width": clip.w,
+                "height": clip.h,
+                "duration": clip.duration,
+                "index": None,
+            }
+        )
+        clip.close()
 
-            # if clip.duration > max_clip_duration:
-            #     clip = clip.subclip(0, max_clip_duration)
+    return sources
 
-            clips.append(clip)
-            tot_dur += clip.duration
-            if tot_dur >= max_duration:
-                break
 
-    final_clip = concatenate_videoclips(clips)
-    final_clip = final_clip.set_fps(30)
-    final_clip.write_videofile(combined_video_path, threads=threads)
+def fetch_stock_videos(
+    sources: List[dict], segments: List[Segment], project_space: str
+) -> None:
+    """
+    Downloads the probed stock videos up to the last second the segments
+    use, see `download_prefix`. Videos that are not used are not downloaded.
 
-    return combined_video_path
+    Args:
+        sources (List[dict]): The videos, see `probe_stock_videos`.
+        segments (List[Segment]): The segments of the video track.
+        project_space (str): The project folder.
+    """
 
+    for source in sources:
+        used = [
+            segment.source_out
+            for segment in segments
+            if segment.source == source["path"]
+        ]
+        if source["index"] is None or not used:
+            continue
+        download_prefix(
+            source["index"], max(used), f"{project_space}/{source['path']}"
+        )
 
-def generate_video(
-    combined_video_path: str,
-    tts_path: str,
-    subtitles_path: str,
+
+def conform_proxies(timeline: Timeline, project_space: str) -> None:
+    """
+    Replaces the proxies of a timeline by the full resolution renditions of
+    their videos, downloaded up to the last second the segments use, and
+    scales the crops of the segments to them. Proxies no segment uses are
+    not downloaded again.
+
+    Args:
+        timeline (Timeline): The timeline, see `Timeline.proxies`.
+        project_space (str): The project folder.
+    """
+    from moviepy.editor import VideoFileClip
+
+    used = {
+        proxy: [segment for segment in timeline.video if segment.source == proxy]
+        for proxy in timeline.proxies
+    }
+    print(
+        colored(
+            f"[+] Downloading {sum(map(bool, used.values()))} videos "
+            "in full resolution...",
+            "blue",
+        )
+    )
+
+    for proxy, full in list(timeline.proxies.items()):
+        segments = used[proxy]
+        if segments:
+            path = f"{project_space}/{full['path']}"
+            source_out = max(segment.source_out for segment in segments)
+            index = probe_video(full["url"])
+            if index is None:
+                download_video(full["url"], path)
+            else:
+                download_prefix(index, source_out, path)
+
+            clip = VideoFileClip(path, audio=False)
+            scale_x = clip.w / full["size"][0]
+            scale_y = clip.h / full["size"][1]
+            clip.close()
+            for segment in segments:
+                segment.source = full["path"]
+                segment.crop = scale_crop(segment.crop, scale_x, scale_y)
+
+        del timeline.proxies[proxy]
+
+
+def combine_videos(
+    video_paths: List[str],
+    max_duration: int,
     threads: int,
-    subtitles_position: str,
-    text_color: str,
-    video_path: str,
-    text_font: str,
+    project_space: str,
+    profile_dir: str = None,
+    seed: int = None,
 ) -> str:
     """
-    This function creates the final video, with subtitles and audio.
+    Combines a list of videos into one video and returns the path to the combined video.
 
     Args:
-        combined_video_path (str): The path to the combined video.
-        tts_path (str): The path to the text-to-speech audio.
-        subtitles_path (str): The path to the subtitles.
+        video_paths (List): A list of paths to the videos to combine.
+        max_duration (int): The maximum duration of the combined video.
         threads (int): The number of threads to use for the video processing.
-        subtitles_position (str): The position of the subtitles.
+        project_space (str): The project folder.
+        profile_dir (str): Where to write a render profile, None to not profile.
+        seed (int): The seed of the clip order.
 
     Returns:
-        str: The path to the final video.
+        str: The path to the combined video.
     """
-    # Make a generator that returns a TextClip when called with consecutive
-    generator = lambda txt: TextClip(
-        txt,
-        font=text_font,
-        fontsize=80,
-        color=text_color,
-        bg_color="aqua",
-    ).set_opacity(0.9)
-
-    # def text_formatter(txt):
-    #     text_clip = TextClip(
-    #         txt,
-    #         font="Papyrus",
-    #         fontsize=80,
-    #         color="black",
-    #     )
-
-    #     text_clip = text_clip.set_position("center")
-
-    #     image_width, image_height = text_clip.size
-
-    #     padding_width = 80  # 40 pixels on each side
-    #     padding_height = 20  # 10 pixels on each side
-
-    #     color_clip = ColorClip(
-    #         size=(image_width + padding_width, image_height + padding_height),
-    #         color=(0, 255, 255),
-    #     ).set_opacity(0.7)
-
-    #     return CompositeVideoClip([color_clip, text_clip])
-
-    # Split the subtitles position into horizontal and vertical
-    horizontal_subtitles_position, vertical_subtitles_position = (
-        subtitles_position.split(",")
-    )
 
-    # Burn the subtitles into the video
-    subtitles = SubtitlesClip(subtitles_path, generator)
-
-    result = CompositeVideoClip(
-        [
-            VideoFileClip(combined_video_path),
-            subtitles.set_pos(
-                (horizontal_subtitles_position, vertical_subtitles_position)
-            ),
-        ]
-    )
+    sources = probe_stock_videos(stock_candidates(video_paths), project_space)
 
-    # Add the audio
-    audio = AudioFileClip(tts_path)
-    result = result.set_audio(audio)
+    timeline = Timeline([1080, 1920], 30, seed)
+    timeline.video = plan_stock_segments(sources, max_duration, seed)
+    fetch_stock_videos(sources, timeline.video, project_space)
 
-    result.write_videofile(f"{video_path}/output.mp4", threads=threads or 2)
-
-    return f"{video_path}/output.mp4"
+    combined_video_path = f"{project_space}/videos/final_raw.mp4"
+    renderer = MoviepyRenderer(
+        project_space, render_settings("final"), threads, profile_dir
+    )
+    return renderer.render_video_track(timeline, combined_video_path)
 
 
 def zoom_in_effect(clip, zoom_ratio=0.04):
+    import numpy
+    from PIL import Image
+
     def effect(get_frame, t):
         img = Image.fromarray(get_frame(t))
         base_size = img.size
@@ -347,34 +538,728 @@ def zoom_in_effect(clip, zoom_ratio=0.04):
     return clip.fl(effect)
 
 
-def video_from_images(project_space: str, image_video_duration: int, max_duration: int):
+def list_images_in_order(images_dir: str) -> List[str]:
+    """
+    Lists the generated images of a project in prompt order.
 
-    size = (1024, 1792)
-    combined_video_path = f"{project_space}/videos/final_raw.mp4"
-    img_list = os.listdir(f"{project_space}/images")
-
-    slides = []
-    duration_left = max_duration
-    for n, path in enumerate(img_list):
-        full_path = f"{project_space}/images/{path}"
-        if duration_left < 5:
-            slides.append(
-                mp.ImageClip(full_path)
-                .set_fps(25)
-                .set_duration(duration_left)
-                .resize(size)
+    Images are named after the index of their prompt, so they are sorted
+    numerically rather than in `os.listdir` order.
+
+    Args:
+        images_dir (str): The folder containing the generated images.
+
+    Returns:
+        List[str]: The image file names, in prompt order.
+    """
+
+    def prompt_index(file_name):
+        stem = os.path.splitext(file_name)[0]
+        return (0, int(stem), "") if stem.isdigit() else (1, 0, file_name)
+
+    return sorted(
+        (name for name in os.listdir(images_dir) if name.endswith(".png")),
+        key=prompt_index,
+    )
+
+
+class MoviepyRenderer:
+    """
+    Renders a timeline with moviepy.
+
+    Like the stages of the pipeline, a video is rendered in three passes:
+    the video track into the raw video, the subtitles and speech over it,
+    and the background music over the result.
+    """
+
+    def __init__(
+        self,
+        project_space: str,
+        settings: dict,
+        threads: int = 2,
+        profile_dir: str = None,
+    ):
+        self.project_space = project_space
+        self.settings = settings
+        self.threads = threads
+        self.profile_dir = profile_dir
+        self.slides = SlideCache()
+
+    def source_path(self, source: str) -> str:
+        """
+        Returns the path of a timeline source, relative to the project space.
+        """
+
+        return f"{self.project_space}/{source}"
+
+    def open_video(self, path: str, start: float = 0.0, end: float = None):
+        """
+        Returns the clip of [start, end) of a video file, without its audio,
+        decoded ahead on a background thread unless `read_ahead_frames` is 0.
+        """
+        from moviepy.editor import VideoFileClip
+
+        capacity = self.settings["read_ahead_frames"]
+        if capacity:
+            return read_ahead_clip(path, start, end, capacity)
+        return VideoFileClip(path, audio=False).subclip(start, end)
+
+    def segment_source(self, segment: Segment, fps: float):
+        """
+        Returns the clip of the source span of a video segment, as decoded.
+        """
+
+        return self.open_video(
+            self.source_path(segment.source), segment.source_in, segment.source_out
+        )
+
+    def segment_sources(self, segments: List[Segment], fps: float) -> list:
+        """
+        Returns the source clips of consecutive segments, None for the
+        slides. Their readers are chained, so that every clip starts
+        decoding shortly before its cut.
+        """
+
+        sources = [
+            None if segment.kind == "image" else self.segment_source(segment, fps)
+            for segment in segments
+        ]
+        chain_readers(
+            [
+                source.reader
+                for source in sources
+                if source is not None and isinstance(source.reader, ReadAheadReader)
+            ]
+        )
+        return sources
+
+    def render_slide(
+        self,
+        segment: Segment,
+        size: List[int],
+        fps: float,
+        crop_box: List[float] = None,
+        slides: SlideCache = None,
+    ):
+        """
+        Returns the clip of an image segment, scaled once and loaded lazily,
+        see `slide_clip`.
+        """
+
+        effect = segment.effect or {}
+        return slide_clip(
+            self.source_path(segment.source),
+            segment.duration,
+            size,
+            fps,
+            crop_box or segment.crop,
+            effect.get("ratio", 0.0) if effect.get("name") == "zoom_in" else 0.0,
+            slides or self.slides,
+        )
+
+    def fit_segment(self, segment: Segment, clip, size: List[int], crop_box=None):
+        """
+        Crops the source clip of a segment to `crop_box` (the crop of the
+        segment by default), scales it to `size` and applies its effect.
+        """
+        from moviepy.video.fx.all import crop
+
+        crop_box = crop_box or segment.crop
+        if crop_box:
+            x1, y1, x2, y2 = crop_box
+            clip = crop(clip, x1=x1, y1=y1, x2=x2, y2=y2)
+        clip = clip.resize(size)
+
+        if segment.effect and segment.effect["name"] == "zoom_in":
+            clip = zoom_in_effect(clip, segment.effect["ratio"])
+
+        return clip
+
+    def render_segment(
+        self, segment: Segment, size: List[int], fps: float, source=None
+    ):
+        """
+        Returns the clip of a segment of the video track, from its `source`
+        clip if it is opened already.
+        """
+
+        if segment.kind == "image":
+            return self.render_slide(segment, size, fps)
+        if source is None:
+            source = self.segment_source(segment, fps)
+        return self.fit_segment(segment, source, size)
+
+    def render_video_track(self, timeline: Timeline, video_path: str) -> str:
+        """
+        Renders the video track of a timeline.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+        from moviepy.editor import concatenate_videoclips
+
+        print(colored("[+] Combining videos...", "blue"))
+
+        size = scaled_size(timeline.size, self.settings)
+        fps = self.settings["fps"] or timeline.fps
+
+        sources = self.segment_sources(timeline.video, fps)
+        clips = [
+            self.render_segment(segment, size, fps, source)
+            for segment, source in zip(timeline.video, sources)
+        ]
+        video = concatenate_videoclips(clips).set_fps(fps)
+
+        kind = timeline.video[0].kind if timeline.video else "video"
+        try:
+            write_videofile(
+                video,
+                video_path,
+                self.profile_dir,
+                "video_from_images" if kind == "image" else "combine_videos",
+                threads=self.threads,
+                **encoder_options(self.settings),
             )
-            slides[n] = zoom_in_effect(slides[n], 0.04)
-            break
+        finally:
+            close_readers([source.reader for source in sources if source is not None])
+        metrics.count("frames_encoded", frame_count(video))
+
+        return video_path
+
+    def render_subtitles(
+        self, timeline: Timeline, raw_video_path: str, video_path: str
+    ) -> str:
+        """
+        Burns the subtitles into the raw video, and adds the speech.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+        # Burn the subtitles into the video
+        video_clip = self.open_video(raw_video_path)
+        result = self.burn_subtitles(
+            video_clip, timeline.subtitle_style, timeline.subtitles
+        )
+
+        # Add the audio
+        result = result.set_audio(self.speech_audio(timeline))
+
+        try:
+            write_videofile(
+                result,
+                video_path,
+                self.profile_dir,
+                "generate_video",
+                threads=self.threads,
+                **encoder_options(self.settings),
+            )
+        finally:
+            video_clip.reader.close()
+        metrics.count("frames_encoded", frame_count(result))
+
+        return video_path
+
+    def burn_subtitles(self, clip, style: dict, events: List[SubtitleEvent]):
+        """
+        Returns the clip with the subtitle events burnt in, with their style.
+        """
+        from moviepy.editor import TextClip
+
+        def on_subtitles_read(txt):
+            return TextClip(
+                txt,
+                font=style["font"],
+                fontsize=round(style["fontsize"] * self.settings["scale"]),
+                color=style["color"],
+                bg_color=style["bg_color"],
+            ).set_opacity(style["opacity"])
+
+        return burn_captions(clip, events, on_subtitles_read, style["position"])
+
+    def speech_audio(self, timeline: Timeline):
+        """
+        Returns the audio clip of the speech bed.
+        """
+        from moviepy.editor import AudioFileClip
+
+        speech = timeline.audio_bed("speech")
+        audio = AudioFileClip(self.source_path(speech.source))
+        if speech.offset:
+            audio = audio.subclip(speech.offset)
+        if speech.volume != 1:
+            audio = audio.volumex(speech.volume)
+        return audio
+
+    def music_mix(self, timeline: Timeline, audio):
+        """
+        Returns `audio` mixed with the music bed.
+        """
+        from moviepy.editor import AudioFileClip, CompositeAudioClip
+
+        music = timeline.audio_bed("music")
+
+        song_clip = AudioFileClip(self.source_path(music.source)).set_fps(44100)
+        if music.offset:
+            song_clip = song_clip.subclip(music.offset)
+
+        # Set the volume of the song
+        song_clip = song_clip.volumex(music.volume).set_fps(44100)
+
+        return CompositeAudioClip([audio, song_clip])
+
+    def render_music(self, timeline: Timeline, video_path: str) -> str:
+        """
+        Mixes the music bed of the timeline into a rendered video, in place.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+        from moviepy.editor import VideoFileClip
+
+        video_clip = VideoFileClip(video_path)
+        original_duration = video_clip.duration
+
+        # Add the song to the video
+        video_clip = video_clip.set_audio(self.music_mix(timeline, video_clip.audio))
+        video_clip = video_clip.set_fps(self.settings["fps"] or 30)
+        video_clip = video_clip.set_duration(original_duration)
+
+        output_file = os.path.splitext(video_path)[0] + "_music.mp4"
+        write_videofile(
+            video_clip,
+            output_file,
+            self.profile_dir,
+            "add_music_to_video",
+            threads=self.threads,
+            **encoder_options(self.settings),
+        )
+        metrics.count("frames_encoded", frame_count(video_clip))
+
+        os.replace(output_file, video_path)
+
+        return video_path
+
+    def render_profiles(
+        self, timeline: Timeline, profiles: List[dict], audio_path: str
+    ) -> List[str]:
+        """
+        Renders the timeline in several output profiles at once.
+
+        Every source frame is decoded once, then cropped, scaled and
+        subtitled for each profile and piped to one encoder per profile, so
+        the encoders run side by side. The crop of each profile is fitted
+        around the crop of the plan. The audio is copied from `audio_path`.
+
+        Args:
+            timeline (Timeline): The timeline to render.
+            profiles (List[dict]): The output profiles, see `load_profiles`.
+            audio_path (str): The rendered video whose audio track to use.
+
+        Returns:
+            List[str]: The paths to the videos, in the order of the profiles.
+        """
+        from moviepy.editor import concatenate_videoclips
+
+        print(colored(f"[+] Rendering {len(profiles)} output profiles...", "blue"))
+
+        fps = timeline.fps
+        sources = [
+            None if source is None else shared_frames(source)
+            for source in self.segment_sources(timeline.video, fps)
+        ]
+        # Every profile keeps its current and next slides
+        slides = SlideCache(2 * len(profiles))
+
+        clips = []
+        for profile in profiles:
+            width, height = profile["size"]
+            segments = []
+            for segment, source in zip(timeline.video, sources):
+                if segment.kind == "image":
+                    source_width, source_height = image_size(
+                        self.source_path(segment.source)
+                    )
+                    crop_box = fit_crop(
+                        segment.crop, source_width, source_height, width / height
+                    )
+                    segments.append(
+                        self.render_slide(
+                            segment, profile["size"], fps, crop_box, slides
+                        )
+                    )
+                    continue
+
+                crop_box = fit_crop(segment.crop, source.w, source.h, width / height)
+                segments.append(
+                    self.fit_segment(segment, source, profile["size"], crop_box)
+                )
+            clip = concatenate_videoclips(segments)
+
+            if timeline.subtitles and timeline.subtitle_style:
+                style = profile_style(timeline.subtitle_style, profile, timeline.size)
+                clip = self.burn_subtitles(clip, style, timeline.subtitles)
+            clips.append(clip)
+
+        paths = [profile_path(self.project_space, profile) for profile in profiles]
+        os.makedirs(os.path.dirname(paths[0]), exist_ok=True)
+        frames = frame_count(timeline)
+        try:
+            # Every encoder is closed, or killed if any of them failed, and
+            # the first error is raised
+            with ExitStack() as stack:
+                writers = [
+                    stack.enter_context(
+                        FrameWriter(
+                            f"{os.path.splitext(path)[0]}_video.mp4",
+                            profile["size"],
+                            fps,
+                            threads=self.threads,
+                            pipe_format=self.settings["pipe_format"],
+                            **profile_encoder_options(profile),
+                        )
+                    )
+                    for profile, path in zip(profiles, paths)
+                ]
+
+                # Every profile reads the frame at t in turn: the sources
+                # decode it for the first one and hand it over to the others
+                for index in range(frames):
+                    t = index / fps
+                    for clip, writer in zip(clips, writers):
+                        writer.write_frame(clip.get_frame(t))
+        finally:
+            close_readers([source.reader for source in sources if source is not None])
+        metrics.count("frames_encoded", frames * len(profiles))
+
+        for path in paths:
+            video_path = f"{os.path.splitext(path)[0]}_video.mp4"
+            mux_audio(video_path, audio_path, path)
+            os.remove(video_path)
+
+        return paths
+
+
+class SegmentedRenderer(MoviepyRenderer):
+    """
+    Renders a timeline in chunks of a few seconds, cached in the project
+    space under a hash of everything they are rendered from.
+
+    Rendering the timeline again, after changing a caption or a clip, only
+    encodes the chunks that changed: the others are reused and joined with
+    them without re-encoding. The audio is rendered on its own and muxed in,
+    so adding the music never encodes the video again.
+    """
+
+    def chunk_path(self, key: str) -> str:
+        return f"{self.project_space}/{CHUNKS_FOLDER}/{key}.mp4"
+
+    def video_chunk_key(self, timeline: Timeline, frames: Tuple[int, int]) -> str:
+        """
+        Returns the cache key of a chunk of the video track: the render
+        settings, the frames of the chunk and the segments overlapping it.
+        """
+
+        fps = self.settings["fps"] or timeline.fps
+        segments = segments_between(timeline, frames[0] / fps, frames[1] / fps)
+
+        return chunk_key(
+            {
+                "pass": "video",
+                "settings": self.settings,
+                "size": scaled_size(timeline.size, self.settings),
+                "fps": fps,
+                "frames": list(frames),
+                "segments": [
+                    {
+                        **segment.to_dict(),
+                        "fingerprint": source_fingerprint(
+                            self.source_path(segment.source)
+                        ),
+                    }
+                    for segment in segments
+                ],
+            }
+        )
 
-        slides.append(
-            mp.ImageClip(full_path)
-            .set_fps(25)
-            .set_duration(image_video_duration)
-            .resize(size)
+    def subtitles_chunk_key(
+        self, timeline: Timeline, frames: Tuple[int, int], video_key: str
+    ) -> str:
+        """
+        Returns the cache key of a subtitled chunk: its video chunk, the
+        subtitle style and the events shown during the chunk.
+        """
+
+        fps = self.settings["fps"] or timeline.fps
+        events = events_between(timeline, frames[0] / fps, frames[1] / fps)
+
+        return chunk_key(
+            {
+                "pass": "subtitles",
+                "video": video_key,
+                "style": timeline.subtitle_style,
+                "events": [event.to_dict() for event in events],
+            }
         )
-        slides[n] = zoom_in_effect(slides[n], 0.04)
-        duration_left -= image_video_duration
 
-    video = mp.concatenate_videoclips(slides)
-    video.write_videofile(combined_video_path)
+    def encode_chunk(
+        self, clip, frames: Tuple[int, int], fps: float, path: str, name: str
+    ) -> str:
+        """
+        Encodes the frames of a chunk, without audio.
+
+        Returns:
+            str: The path to the chunk.
+        """
+
+        # Frames are sampled every 1 / fps over [0, duration): ending half a
+        # frame early gives exactly the frames of the chunk
+        count = frames[1] - frames[0]
+        clip = clip.set_fps(fps).set_duration((count - 0.5) / fps)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        part_path = f"{os.path.splitext(path)[0]}.part.mp4"
+        write_videofile(
+            clip,
+            part_path,
+            self.profile_dir,
+            f"{name}[{frames[0]}]",
+            threads=self.threads,
+            audio=False,
+            logger=None,
+            **encoder_options(self.settings),
+        )
+        metrics.count("frames_encoded", count)
+        os.replace(part_path, path)
+
+        return path
+
+    def render_video_chunk(self, timeline: Timeline, frames: Tuple[int, int]) -> str:
+        """
+        Renders a chunk of the video track, unless it is cached.
+
+        Returns:
+            str: The path to the chunk.
+        """
+        from moviepy.editor import concatenate_videoclips
+
+        path = self.chunk_path(self.video_chunk_key(timeline, frames))
+        if os.path.exists(path):
+            return path
+
+        size = scaled_size(timeline.size, self.settings)
+        fps = self.settings["fps"] or timeline.fps
+        start, end = frames[0] / fps, frames[1] / fps
+
+        segments = segments_between(timeline, start, end)
+        sources = self.segment_sources(segments, fps)
+        clips = []
+        for segment, source in zip(segments, sources):
+            clip = self.render_segment(segment, size, fps, source)
+            clips.append(
+                clip.subclip(
+                    max(start, segment.start) - segment.start,
+                    min(end, segment.end) - segment.start,
+                )
+            )
+
+        kind = timeline.video[0].kind if timeline.video else "video"
+        try:
+            return self.encode_chunk(
+                concatenate_videoclips(clips),
+                frames,
+                fps,
+                path,
+                "video_from_images" if kind == "image" else "combine_videos",
+            )
+        finally:
+            close_readers([source.reader for source in sources if source is not None])
+
+    def render_subtitles_chunk(
+        self, timeline: Timeline, frames: Tuple[int, int]
+    ) -> str:
+        """
+        Burns the subtitles into a chunk of the video track, unless it is
+        cached. Chunks without subtitles are the video chunks themselves.
+
+        Returns:
+            str: The path to the chunk.
+        """
+        video_key = self.video_chunk_key(timeline, frames)
+        fps = self.settings["fps"] or timeline.fps
+        start, end = frames[0] / fps, frames[1] / fps
+
+        events = events_between(timeline, start, end)
+        if not events:
+            return self.render_video_chunk(timeline, frames)
+
+        path = self.chunk_path(self.subtitles_chunk_key(timeline, frames, video_key))
+        if os.path.exists(path):
+            return path
+
+        video_clip = self.open_video(self.render_video_chunk(timeline, frames))
+        # Move the events to the time of the chunk
+        events = [
+            SubtitleEvent(max(event.start - start, 0), event.end - start, event.text)
+            for event in events
+        ]
+        result = self.burn_subtitles(video_clip, timeline.subtitle_style, events)
+
+        try:
+            self.encode_chunk(result, frames, fps, path, "generate_video")
+        finally:
+            video_clip.reader.close()
+
+        return path
+
+    def render_chunks(self, timeline: Timeline, render_chunk, keys) -> List[str]:
+        """
+        Renders the chunks of a timeline, reporting how many were cached.
+
+        Args:
+            timeline (Timeline): The timeline to render.
+            render_chunk: Renders a chunk, given the timeline and its frames.
+            keys: Returns the cache key of a chunk, given its frames.
+
+        Returns:
+            List[str]: The paths to the chunks, in order.
+        """
+
+        fps = self.settings["fps"] or timeline.fps
+        chunks = plan_chunks(timeline.duration, fps, self.settings["segment_seconds"])
+
+        missing = [
+            frames
+            for frames in chunks
+            if not os.path.exists(self.chunk_path(keys(frames)))
+        ]
+        print(
+            colored(
+                f"[+] Rendering {len(missing)} of {len(chunks)} chunks "
+                f"({len(chunks) - len(missing)} cached)...",
+                "blue",
+            )
+        )
+        metrics.count("cache_hits", len(chunks) - len(missing))
+        metrics.count("cache_misses", len(missing))
+
+        return [render_chunk(timeline, frames) for frames in chunks]
+
+    def render_video_track(self, timeline: Timeline, video_path: str) -> str:
+        """
+        Renders the video track of a timeline, chunk by chunk.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+
+        print(colored("[+] Combining videos...", "blue"))
+
+        chunk_paths = self.render_chunks(
+            timeline,
+            self.render_video_chunk,
+            lambda frames: self.video_chunk_key(timeline, frames),
+        )
+        return concat_chunks(chunk_paths, video_path)
+
+    def render_subtitles(
+        self, timeline: Timeline, raw_video_path: str, video_path: str
+    ) -> str:
+        """
+        Burns the subtitles into the chunks of the video track, and adds the
+        speech. Without a video track, e.g. for a raw video rendered
+        elsewhere, the whole raw video is rendered instead.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+
+        if not timeline.video:
+            return super().render_subtitles(timeline, raw_video_path, video_path)
+
+        fps = self.settings["fps"] or timeline.fps
+
+        def keys(frames):
+            video_key = self.video_chunk_key(timeline, frames)
+            if not events_between(timeline, frames[0] / fps, frames[1] / fps):
+                return video_key
+            return self.subtitles_chunk_key(timeline, frames, video_key)
+
+        chunk_paths = self.render_chunks(timeline, self.render_subtitles_chunk, keys)
+
+        base_path = os.path.splitext(video_path)[0]
+        concat_chunks(chunk_paths, f"{base_path}_video.mp4")
+
+        # Add the audio, cut to the video
+        duration = round(timeline.duration * fps) / fps
+        audio = self.speech_audio(timeline)
+        audio = audio.set_duration(min(audio.duration, duration))
+        audio.write_audiofile(f"{base_path}_speech.mp3", fps=44100, logger=None)
+
+        mux_audio(f"{base_path}_video.mp4", f"{base_path}_speech.mp3", video_path)
+        os.remove(f"{base_path}_video.mp4")
+        os.remove(f"{base_path}_speech.mp3")
+
+        return video_path
+
+    def render_music(self, timeline: Timeline, video_path: str) -> str:
+        """
+        Mixes the music bed of the timeline into a rendered video, in place,
+        copying its video stream.
+
+        Returns:
+            str: The path to the rendered video.
+        """
+        from moviepy.editor import VideoFileClip
+
+        video_clip = VideoFileClip(video_path)
+        audio = self.music_mix(timeline, video_clip.audio)
+        audio = audio.set_duration(video_clip.duration)
+
+        base_path = os.path.splitext(video_path)[0]
+        audio.write_audiofile(f"{base_path}_music.mp3", fps=44100, logger=None)
+        video_clip.close()
+
+        mux_audio(video_path, f"{base_path}_music.mp3", f"{base_path}_music.mp4")
+        os.remove(f"{base_path}_music.mp3")
+        os.replace(f"{base_path}_music.mp4", video_path)
+
+        return video_path
+
+
+def shared_frames(clip):
+    """
+    Returns a copy of a clip that remembers its last frame, so that the
+    clips derived from it, reading the same time in turn, decode it once.
+    """
+
+    last = {}
+
+    def remember(get_frame, t):
+        if last.get("t") != t:
+            last["t"], last["frame"] = t, get_frame(t)
+        return last["frame"]
+
+    return clip.fl(remember)
+
+
+# Renderers of timelines, by name
+RENDERERS = {
+    "moviepy": MoviepyRenderer,
+    "segmented": SegmentedRenderer,
+}
+
+
+def video_from_images(
+    project_space: str,
+    image_video_duration: int,
+    max_duration: int,
+    profile_dir: str = None,
+):
+    images = [
+        f"images/{name}" for name in list_images_in_order(f"{project_space}/images")
+    ]
+
+    timeline = Timeline([1024, 1792], 25)
+    timeline.video = plan_slide_segments(images, image_video_duration, max_duration)
+
+    renderer = MoviepyRenderer(project_space, render_settings("final"), 2, profile_dir)
+    renderer.render_video_track(timeline, f"{project_space}/videos/final_raw.mp4")